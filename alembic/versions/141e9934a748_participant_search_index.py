@@ -0,0 +1,29 @@
+"""Participant search index (SQLite FTS5 trigram / PostgreSQL pg_trgm)
+
+Revision ID: 141e9934a748
+Revises: 508df5a720b0
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from search_index import ensure_search_index, drop_search_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = '141e9934a748'
+down_revision: Union[str, Sequence[str], None] = '508df5a720b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    ensure_search_index(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    drop_search_index(op.get_bind())
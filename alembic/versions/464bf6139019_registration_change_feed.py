@@ -0,0 +1,55 @@
+"""Registration change feed
+
+Revision ID: 464bf6139019
+Revises: 2e2a1011ca14
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '464bf6139019'
+down_revision: Union[str, Sequence[str], None] = '2e2a1011ca14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('registration_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('registration_id', sa.Integer(), nullable=False),
+    sa.Column('participant_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(), nullable=False),
+    sa.Column('arrival_time', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True,
+    )
+    op.create_index('ix_registration_changes_event_id_id', 'registration_changes', ['event_id', 'id'], unique=False)
+
+    # Существующие регистрации попадают в журнал, чтобы курсор 0 давал полное состояние
+    op.execute(
+        "INSERT INTO registration_changes "
+        "(event_id, registration_id, participant_id, action, arrival_time, created_at) "
+        "SELECT event_id, id, participant_id, 'registered', NULL, registration_time "
+        "FROM registrations ORDER BY id"
+    )
+    op.execute(
+        "INSERT INTO registration_changes "
+        "(event_id, registration_id, participant_id, action, arrival_time, created_at) "
+        "SELECT event_id, id, participant_id, 'arrival_set', arrival_time, arrival_time "
+        "FROM registrations WHERE arrival_time IS NOT NULL ORDER BY arrival_time, id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_registration_changes_event_id_id', table_name='registration_changes')
+    op.drop_table('registration_changes')
@@ -0,0 +1,66 @@
+"""Registrations: unique (event_id, participant_id) and lookup indexes
+
+Revision ID: 508df5a720b0
+Revises: 464bf6139019
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '508df5a720b0'
+down_revision: Union[str, Sequence[str], None] = '464bf6139019'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Дубли могли появиться из-за гонки в register_users: переносим отметку о прибытии
+    # на самую раннюю регистрацию пары и удаляем остальные. Оба изменения пишутся в
+    # журнал (user-001), иначе планшеты, синхронизирующиеся по курсору, их не увидят
+    op.execute(
+        "INSERT INTO registration_changes "
+        "(event_id, registration_id, participant_id, action, arrival_time, created_at) "
+        "SELECT r.event_id, r.id, r.participant_id, 'arrival_set', MIN(r2.arrival_time), CURRENT_TIMESTAMP "
+        "FROM registrations r JOIN registrations r2"
+        " ON r2.event_id = r.event_id AND r2.participant_id = r.participant_id"
+        " AND r2.arrival_time IS NOT NULL "
+        "WHERE r.arrival_time IS NULL"
+        " AND r.id IN (SELECT MIN(id) FROM registrations GROUP BY event_id, participant_id) "
+        "GROUP BY r.event_id, r.id, r.participant_id ORDER BY r.id"
+    )
+    op.execute(
+        "UPDATE registrations SET arrival_time = ("
+        " SELECT MIN(r2.arrival_time) FROM registrations r2"
+        " WHERE r2.event_id = registrations.event_id"
+        " AND r2.participant_id = registrations.participant_id"
+        ") WHERE arrival_time IS NULL"
+    )
+    op.execute(
+        "INSERT INTO registration_changes "
+        "(event_id, registration_id, participant_id, action, arrival_time, created_at) "
+        "SELECT event_id, id, participant_id, 'deleted', NULL, CURRENT_TIMESTAMP "
+        "FROM registrations WHERE id NOT IN ("
+        " SELECT MIN(id) FROM registrations GROUP BY event_id, participant_id"
+        ") ORDER BY id"
+    )
+    op.execute(
+        "DELETE FROM registrations WHERE id NOT IN ("
+        " SELECT MIN(id) FROM registrations GROUP BY event_id, participant_id"
+        ")"
+    )
+
+    op.create_index('ix_registrations_event_id_participant_id', 'registrations', ['event_id', 'participant_id'], unique=True)
+    op.create_index('ix_registrations_participant_id', 'registrations', ['participant_id'], unique=False)
+    op.create_index('ix_registrations_event_id_arrival_time', 'registrations', ['event_id', 'arrival_time'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_registrations_event_id_arrival_time', table_name='registrations')
+    op.drop_index('ix_registrations_participant_id', table_name='registrations')
+    op.drop_index('ix_registrations_event_id_participant_id', table_name='registrations')
@@ -0,0 +1,29 @@
+"""System users: token_version for access token revocation
+
+Revision ID: 7c3d52e1f0a9
+Revises: 141e9934a748
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3d52e1f0a9'
+down_revision: Union[str, Sequence[str], None] = '141e9934a748'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('system_users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('system_users') as batch_op:
+        batch_op.drop_column('token_version')
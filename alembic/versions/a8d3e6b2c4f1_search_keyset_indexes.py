@@ -0,0 +1,35 @@
+"""Keyset search indexes: participants (full_name, id), registrations arrival tie-breaker
+
+Revision ID: a8d3e6b2c4f1
+Revises: f2a7c9d1e8b4
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3e6b2c4f1'
+down_revision: Union[str, Sequence[str], None] = 'f2a7c9d1e8b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_participants_full_name_id', 'participants', ['full_name', 'id'], unique=False)
+    # participant_id в конце индекса - тай-брейк keyset-страниц по времени прибытия
+    op.drop_index('ix_registrations_event_id_arrival_time', table_name='registrations')
+    op.create_index(
+        'ix_registrations_event_id_arrival_time', 'registrations',
+        ['event_id', 'arrival_time', 'participant_id'], unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_registrations_event_id_arrival_time', table_name='registrations')
+    op.create_index('ix_registrations_event_id_arrival_time', 'registrations', ['event_id', 'arrival_time'], unique=False)
+    op.drop_index('ix_participants_full_name_id', table_name='participants')
@@ -0,0 +1,48 @@
+"""Registration changes: per-event sequence cursor
+
+Revision ID: c5d8e2a7f310
+Revises: 9a41f6d2c8b3
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e2a7f310'
+down_revision: Union[str, Sequence[str], None] = '9a41f6d2c8b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('event_change_sequences',
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('last_seq', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('event_id'),
+    )
+    op.add_column('registration_changes', sa.Column('seq', sa.Integer(), nullable=True))
+    # seq существующих записей равен id: курсоры, уже сохранённые на планшетах, остаются верными
+    op.execute("UPDATE registration_changes SET seq = id")
+    if op.get_bind().dialect.name != "sqlite":
+        # SQLite не меняет NOT NULL без пересоздания таблицы; seq всегда пишет change_feed
+        op.alter_column('registration_changes', 'seq', nullable=False)
+    op.execute(
+        "INSERT INTO event_change_sequences (event_id, last_seq) "
+        "SELECT event_id, MAX(seq) FROM registration_changes GROUP BY event_id"
+    )
+    op.drop_index('ix_registration_changes_event_id_id', table_name='registration_changes')
+    op.create_index('ix_registration_changes_event_id_seq', 'registration_changes', ['event_id', 'seq'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_registration_changes_event_id_seq', table_name='registration_changes')
+    op.create_index('ix_registration_changes_event_id_id', 'registration_changes', ['event_id', 'id'], unique=False)
+    op.drop_column('registration_changes', 'seq')
+    op.drop_table('event_change_sequences')
@@ -0,0 +1,41 @@
+"""Event change sequences: running registration counters
+
+Revision ID: e4f1a9c3b7d2
+Revises: c5d8e2a7f310
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4f1a9c3b7d2'
+down_revision: Union[str, Sequence[str], None] = 'c5d8e2a7f310'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('event_change_sequences', sa.Column('registered', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('event_change_sequences', sa.Column('arrived', sa.Integer(), server_default='0', nullable=False))
+    # Начальные значения счётчиков - по текущим регистрациям; дальше их ведёт change_feed
+    op.execute(
+        "UPDATE event_change_sequences SET "
+        "registered = (SELECT COUNT(*) FROM registrations r WHERE r.event_id = event_change_sequences.event_id), "
+        "arrived = (SELECT COUNT(r.arrival_time) FROM registrations r WHERE r.event_id = event_change_sequences.event_id)"
+    )
+    op.execute(
+        "INSERT INTO event_change_sequences (event_id, last_seq, registered, arrived) "
+        "SELECT event_id, 0, COUNT(*), COUNT(arrival_time) FROM registrations "
+        "WHERE event_id NOT IN (SELECT event_id FROM event_change_sequences) GROUP BY event_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('event_change_sequences', 'arrived')
+    op.drop_column('event_change_sequences', 'registered')
@@ -0,0 +1,30 @@
+"""Directory memberships: index by participant
+
+Revision ID: f2a7c9d1e8b4
+Revises: e4f1a9c3b7d2
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a7c9d1e8b4'
+down_revision: Union[str, Sequence[str], None] = 'e4f1a9c3b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_directory_memberships_participant_id', 'directory_memberships',
+        ['participant_id', 'directory_id'], unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_directory_memberships_participant_id', table_name='directory_memberships')
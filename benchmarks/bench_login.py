@@ -0,0 +1,111 @@
+"""
+Бенчмарк пропускной способности /token при одновременном входе смены регистраторов.
+
+Запуск из корня проекта:
+    python benchmarks/bench_login.py [число одновременных входов...]
+
+По умолчанию 40 одновременных входов (стоимость bcrypt - BCRYPT_ROUNDS). Для каждого
+режима - общее время, входов в секунду и самая долгая пауза цикла событий (насколько
+в это время задержалась бы WebSocket-рассылка): хэш в пуле потоков против прежнего
+синхронного хэша прямо в обработчике.
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+import passwords
+from database import Base, get_db
+from main import app
+from routers import auth as auth_router
+
+DEFAULT_SIZES = [40]
+TICK_SECONDS = 0.005
+
+
+async def _inline_verify_and_update(plain_password: str, hashed_password: str):
+    # Прежнее поведение: bcrypt выполняется в цикле событий
+    return passwords.pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+async def _max_loop_stall(stop: asyncio.Event) -> float:
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK_SECONDS)
+        worst = max(worst, loop.time() - started - TICK_SECONDS)
+    return worst
+
+
+async def _run(size: int, inline: bool) -> tuple[float, float]:
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    password_hash = passwords.get_password_hash("shift-start")
+    async with Session() as session:
+        await session.execute(
+            insert(models.SystemUser),
+            [
+                {"username": f"registrar{i}", "role": models.SystemUserRole.REGISTRAR, "hashed_password": password_hash}
+                for i in range(size)
+            ],
+        )
+        await session.commit()
+
+    async def _get_db():
+        async with Session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = _get_db
+    if inline:
+        auth_router.verify_and_update_async = _inline_verify_and_update
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://bench") as client:
+            stop = asyncio.Event()
+            watcher = asyncio.create_task(_max_loop_stall(stop))
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(
+                client.post("/token", data={"username": f"registrar{i}", "password": "shift-start"})
+                for i in range(size)
+            ))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            stall = await watcher
+        assert all(resp.status_code == 200 for resp in responses)
+    finally:
+        auth_router.verify_and_update_async = passwords.verify_and_update_async
+        app.dependency_overrides.clear()
+        await engine.dispose()
+    return elapsed, stall
+
+
+async def main(sizes: list[int]) -> None:
+    print(f"BCRYPT_ROUNDS={passwords.BCRYPT_ROUNDS}, PASSWORD_HASH_WORKERS={passwords.PASSWORD_HASH_WORKERS}")
+    print(f"{'входов':>7} | {'режим':>10} | {'всего, мс':>10} | {'входов/с':>9} | {'пауза цикла, мс':>16}")
+    print("-" * 65)
+    for size in sizes:
+        for inline in (True, False):
+            elapsed, stall = await _run(size, inline)
+            mode = "синхронно" if inline else "пул"
+            print(f"{size:>7} | {mode:>10} | {elapsed * 1000:>10.1f} | {size / elapsed:>9.1f} | {stall * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    asyncio.run(main(sizes))
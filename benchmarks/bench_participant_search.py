@@ -0,0 +1,96 @@
+"""
+Бенчмарк поиска участников: ILIKE '%q%' против индекса search_index (FTS5 trigram).
+
+Запуск из корня проекта:
+    python benchmarks/bench_participant_search.py [размеры...]
+
+По умолчанию 100 000 и 1 000 000 участников во временной SQLite-базе.
+Для каждого размера - среднее время запроса поиска (limit 100) по нескольким строкам.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import insert, or_
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+
+import models
+from database import Base
+from search_index import participant_search_filter
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+QUERIES = ["ванов 4217", "p98765@", "Делегация 77", "нет такого"]
+REPEATS = 5
+INSERT_BATCH = 20_000
+
+SURNAMES = ["Иванов", "Петров", "Сидоров", "Кузнецов", "Смирнов", "Попов", "Васильев", "Соколов"]
+
+
+async def _seed(session: AsyncSession, size: int) -> None:
+    for start in range(0, size, INSERT_BATCH):
+        await session.execute(
+            insert(models.Participant),
+            [
+                {
+                    "full_name": f"{SURNAMES[i % len(SURNAMES)]} {i}",
+                    "email": f"p{i}@bench.local",
+                    "note": f"Делегация {i % 100}",
+                }
+                for i in range(start, min(start + INSERT_BATCH, size))
+            ],
+        )
+    await session.commit()
+
+
+def _ilike_filter(query: str):
+    pattern = f"%{query}%"
+    return or_(
+        models.Participant.full_name.ilike(pattern),
+        models.Participant.email.ilike(pattern),
+        models.Participant.note.ilike(pattern),
+    )
+
+
+async def _measure(session: AsyncSession, make_filter) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        for query in QUERIES:
+            stmt = select(models.Participant.id).filter(make_filter(query)).limit(100)
+            (await session.execute(stmt)).all()
+    return (time.perf_counter() - started) / (REPEATS * len(QUERIES))
+
+
+async def _run(size: int) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.db")
+        Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        async with Session() as session:
+            await _seed(session, size)
+            ilike = await _measure(session, _ilike_filter)
+            indexed = await _measure(session, lambda q: participant_search_filter(session, q))
+
+        await engine.dispose()
+    return ilike, indexed
+
+
+async def main(sizes: list[int]) -> None:
+    print(f"{'участников':>12} | {'ILIKE, мс':>10} | {'индекс, мс':>11}")
+    print("-" * 40)
+    for size in sizes:
+        ilike, indexed = await _run(size)
+        print(f"{size:>12} | {ilike * 1000:>10.2f} | {indexed * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    asyncio.run(main(sizes))
@@ -0,0 +1,94 @@
+"""
+Бенчмарк массовой регистрации (bulk_registration.bulk_register).
+
+Запуск из корня проекта:
+    python benchmarks/bench_register_users.py [размеры...]
+
+По умолчанию меряет 100, 1 000 и 10 000 участников на SQLite в памяти:
+регистрацию всего справочника и регистрацию по явному списку ID.
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+from database import Base
+from bulk_registration import bulk_register
+
+DEFAULT_SIZES = [100, 1_000, 10_000]
+
+
+async def _seed(session: AsyncSession, size: int) -> tuple[int, int, int, list[int]]:
+    user = models.SystemUser(username="bench", role=models.SystemUserRole.OPERATOR, hashed_password="-")
+    event = models.Event(title="Bench", event_date=models.func.now(), registration_active=True)
+    directory = models.Directory(name="Bench directory")
+    session.add_all([user, event, directory])
+    await session.flush()
+
+    await session.execute(
+        insert(models.Participant),
+        [{"full_name": f"Участник {i}", "email": f"p{i}@bench.local"} for i in range(size)],
+    )
+    result = await session.execute(models.Participant.__table__.select().with_only_columns(models.Participant.id))
+    participant_ids = list(result.scalars().all())
+    await session.execute(
+        insert(models.DirectoryMembership),
+        [{"directory_id": directory.id, "participant_id": p_id} for p_id in participant_ids],
+    )
+    await session.commit()
+    return user.id, event.id, directory.id, participant_ids
+
+
+async def _run(size: int) -> tuple[float, float]:
+    engine = create_async_engine(
+        "sqlite+aiosqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with Session() as session:
+        user_id, event_id, directory_id, participant_ids = await _seed(session, size)
+
+        started = time.perf_counter()
+        created = await bulk_register(session, event_id, user_id, directory_id=directory_id)
+        await session.commit()
+        by_directory = time.perf_counter() - started
+        assert len(created) == size
+
+        second_event = models.Event(title="Bench 2", event_date=models.func.now(), registration_active=True)
+        session.add(second_event)
+        await session.commit()
+
+        started = time.perf_counter()
+        created = await bulk_register(session, second_event.id, user_id, participant_ids=participant_ids)
+        await session.commit()
+        by_ids = time.perf_counter() - started
+        assert len(created) == size
+
+    await engine.dispose()
+    return by_directory, by_ids
+
+
+async def main(sizes: list[int]) -> None:
+    print(f"{'участников':>12} | {'справочник, мс':>15} | {'список ID, мс':>14}")
+    print("-" * 48)
+    for size in sizes:
+        by_directory, by_ids = await _run(size)
+        print(f"{size:>12} | {by_directory * 1000:>15.1f} | {by_ids * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    asyncio.run(main(sizes))
@@ -0,0 +1,139 @@
+"""
+Бенчмарк SQLite-профилей: настройки по умолчанию против SQLITE_PROFILE=production
+(WAL, synchronous=NORMAL, единственный писатель и пул читателей).
+
+Запуск из корня проекта:
+    python benchmarks/bench_sqlite_profile.py [число одновременных клиентов...]
+
+По умолчанию 10 и 50 клиентов во временном файле SQLite. Каждый клиент делает
+CHECKINS_PER_CLIENT отметок прибытия (UPDATE регистрации + запись в журнал изменений,
+как PUT /arrival) и между ними читает счётчик прибывших. Для каждого профиля - отметок
+в секунду, число ошибок "database is locked" и среднее время чтения.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+
+import models
+from change_feed import record_change
+from database import Base
+from db_settings import DatabaseSettings, engine_options
+from sqlite_profile import create_engines, routing_sessionmaker
+
+DEFAULT_CLIENTS = [10, 50]
+CHECKINS_PER_CLIENT = 20
+
+
+async def _seed(Session, size: int) -> int:
+    async with Session() as session:
+        user = models.SystemUser(username="bench", role=models.SystemUserRole.REGISTRAR, hashed_password="-")
+        event = models.Event(title="Bench", event_date=func.now(), registration_active=True)
+        session.add_all([user, event])
+        await session.flush()
+        await session.execute(
+            insert(models.Participant),
+            [{"full_name": f"Участник {i}", "email": f"p{i}@bench.local"} for i in range(size)],
+        )
+        participant_ids = (await session.execute(select(models.Participant.id))).scalars().all()
+        await session.execute(
+            insert(models.Registration),
+            [
+                {"event_id": event.id, "participant_id": p_id, "registered_by_user_id": user.id}
+                for p_id in participant_ids
+            ],
+        )
+        await session.commit()
+        return event.id
+
+
+async def _client(Session, event_id: int, first_participant: int, stats: dict) -> None:
+    for offset in range(CHECKINS_PER_CLIENT):
+        participant_id = first_participant + offset
+        try:
+            async with Session() as session:
+                started = time.perf_counter()
+                await session.execute(
+                    select(func.count(models.Registration.id)).filter(
+                        models.Registration.event_id == event_id,
+                        models.Registration.arrival_time.is_not(None),
+                    )
+                )
+                stats["read_seconds"] += time.perf_counter() - started
+                stats["reads"] += 1
+
+                result = await session.execute(
+                    update(models.Registration)
+                    .where(
+                        models.Registration.event_id == event_id,
+                        models.Registration.participant_id == participant_id,
+                    )
+                    .values(arrival_time=func.now())
+                    .returning(models.Registration.id)
+                )
+                await record_change(
+                    session, event_id, models.RegistrationChangeAction.ARRIVAL_SET,
+                    result.scalar_one(), participant_id,
+                )
+                await session.commit()
+                stats["checkins"] += 1
+        except OperationalError:
+            stats["locked"] += 1
+
+
+async def _run(clients: int, production: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = DatabaseSettings(
+            url=f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}",
+            sqlite_profile="production" if production else "default",
+            pool_size=clients,
+            max_overflow=0,
+        )
+        if production:
+            writer, reader = create_engines(settings)
+            Session = routing_sessionmaker(writer, reader, expire_on_commit=False)
+            engines = [writer, reader]
+        else:
+            engine = create_async_engine(settings.url, **engine_options(settings))
+            Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+            engines = [engine]
+        async with engines[0].begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        event_id = await _seed(Session, clients * CHECKINS_PER_CLIENT)
+        stats = {"checkins": 0, "locked": 0, "reads": 0, "read_seconds": 0.0}
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _client(Session, event_id, 1 + i * CHECKINS_PER_CLIENT, stats) for i in range(clients)
+        ))
+        stats["elapsed"] = time.perf_counter() - started
+        for engine in engines:
+            await engine.dispose()
+    return stats
+
+
+async def main(client_counts: list[int]) -> None:
+    print(f"{'клиентов':>9} | {'профиль':>10} | {'отметок/с':>10} | {'locked':>7} | {'чтение, мс':>11}")
+    print("-" * 60)
+    for clients in client_counts:
+        for production in (False, True):
+            stats = await _run(clients, production)
+            profile = "production" if production else "default"
+            rate = stats["checkins"] / stats["elapsed"]
+            read_ms = stats["read_seconds"] / stats["reads"] * 1000 if stats["reads"] else 0.0
+            print(f"{clients:>9} | {profile:>10} | {rate:>10.1f} | {stats['locked']:>7} | {read_ms:>11.2f}")
+
+
+if __name__ == "__main__":
+    client_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_CLIENTS
+    asyncio.run(main(client_counts))
@@ -0,0 +1,384 @@
+"""
+Брокер рассылки WebSocket-сообщений между процессами.
+
+ConnectionManager.broadcast публикует сообщение в брокер, а брокер доставляет его
+в ConnectionManager.deliver каждого процесса (включая текущий). Бэкенды:
+
+- memory   - только текущий процесс (один воркер uvicorn);
+- unix     - ретранслятор на UNIX-сокете: процесс, захвативший flock на
+             BROADCAST_SOCKET_PATH + ".lock", становится хабом, остальные подключаются
+             к нему клиентами; при падении хаба его место занимает следующий процесс.
+             Свои сообщения клиент тоже получает только от хаба, поэтому все процессы
+             видят сообщения в одном порядке - порядке, в котором их принял хаб;
+- postgres - PostgreSQL LISTEN/NOTIFY через отдельные соединения asyncpg.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import uuid
+from abc import ABC, abstractmethod
+from itertools import count
+from typing import Callable, Optional
+
+from database import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# memory | unix | postgres
+BROADCAST_BACKEND = os.getenv("BROADCAST_BACKEND", "memory")
+BROADCAST_SOCKET_PATH = os.getenv("BROADCAST_SOCKET_PATH", "/tmp/event_registration_broadcast.sock")
+BROADCAST_CHANNEL = os.getenv("BROADCAST_CHANNEL", "event_registration_broadcast")
+# Сколько исходящих сообщений процесс держит, пока ретранслятор/БД недоступны
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "10000"))
+
+RECONNECT_DELAY = 0.2
+
+Deliver = Callable[[int, str], None]
+
+
+class Broker(ABC):
+    """Бэкенд рассылки: неполный бэкенд не создаётся вовсе, а не падает на первой публикации."""
+
+    name = "memory"
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    @abstractmethod
+    async def start(self) -> None:
+        """Подключается к транспорту; вызывается при старте приложения."""
+
+    @abstractmethod
+    async def stop(self) -> None:
+        """Досылает очередь, если может, и отключается."""
+
+    @abstractmethod
+    async def publish(self, event_id: int, message: str) -> None:
+        """Доставляет сообщение в deliver всех процессов, включая текущий."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class InProcessBroker(Broker):
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, event_id: int, message: str) -> None:
+        self.published += 1
+        self.deliver(event_id, message)
+
+
+class _QueuedBroker(Broker):
+    """Общая часть межпроцессных бэкендов: publish только ставит сообщение в очередь."""
+
+    def __init__(self, deliver: Deliver, queue_size: int = BROADCAST_QUEUE_SIZE):
+        super().__init__(deliver)
+        self._outbox: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=queue_size)
+
+    def _enqueue(self, event_id: int, message: str) -> None:
+        try:
+            self._outbox.put_nowait((event_id, message))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+# --- UNIX-сокет ---
+
+_FRAME_HEADER = struct.Struct("!II")  # event_id, длина полезной нагрузки
+
+
+def _encode_frame(event_id: int, message: str) -> bytes:
+    data = message.encode("utf-8")
+    return _FRAME_HEADER.pack(event_id, len(data)) + data
+
+
+# Хаб отвечает им подключившемуся процессу, когда уже добавил его в рассылку
+_HELLO_FRAME = _FRAME_HEADER.pack(0, 0)
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Optional[tuple[int, str]]:
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+        event_id, length = _FRAME_HEADER.unpack(header)
+        data = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return event_id, data.decode("utf-8")
+
+
+class UnixSocketBroker(_QueuedBroker):
+    name = "unix"
+    # Клиент, у которого в буфере сокета скопилось больше, считается зависшим
+    MAX_PEER_BUFFER = 8 * 1024 * 1024
+
+    def __init__(self, deliver: Deliver, path: str = BROADCAST_SOCKET_PATH, queue_size: int = BROADCAST_QUEUE_SIZE):
+        super().__init__(deliver, queue_size)
+        self.path = path
+        self.role: Optional[str] = None
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._ready = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._runner = asyncio.create_task(self._run())
+        await self._ready.wait()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        for writer in list(self._peers):
+            writer.close()
+        self._peers.clear()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.role = None
+
+    async def publish(self, event_id: int, message: str) -> None:
+        self.published += 1
+        if self.role == "hub":
+            self._relay(event_id, message)
+        else:
+            # Локальная доставка - когда хаб вернёт сообщение обратно
+            self._enqueue(event_id, message)
+
+    def _relay(self, event_id: int, message: str) -> None:
+        """Хаб: доставка своим сокетам и всем процессам-клиентам в порядке приёма."""
+        self.deliver(event_id, message)
+        self._forward(_encode_frame(event_id, message))
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            if self._try_lock():
+                await self._serve()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                # Хаб ещё не поднял сокет или только что упал
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            # Без подтверждения хаба его рассылка могла бы пройти мимо нас
+            if await _read_frame(reader) is None:
+                writer.close()
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self.role = "client"
+            self._ready.set()
+            sender = asyncio.create_task(self._send_to_hub(writer))
+            try:
+                while (frame := await _read_frame(reader)) is not None:
+                    self.received += 1
+                    self.deliver(*frame)
+            finally:
+                sender.cancel()
+                writer.close()
+                self.role = None
+            logger.warning("Соединение с ретранслятором %s потеряно, переподключаемся", self.path)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _serve(self) -> None:
+        # Файл сокета мог остаться от упавшего хаба: блокировку держим мы, значит он ничей
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path)
+        self.role = "hub"
+        # Не отправленное упавшему хабу рассылаем сами; отправленное, но не разосланное
+        # им, теряется - устройства догоняют состояние через /sync
+        while not self._outbox.empty():
+            self._relay(*self._outbox.get_nowait())
+        self._ready.set()
+        await asyncio.Event().wait()
+
+    async def _send_to_hub(self, writer: asyncio.StreamWriter) -> None:
+        while True:
+            event_id, message = await self._outbox.get()
+            writer.write(_encode_frame(event_id, message))
+            await writer.drain()
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        writer.write(_HELLO_FRAME)
+        try:
+            while (frame := await _read_frame(reader)) is not None:
+                self.received += 1
+                # Отправителю тоже: свои сообщения клиент получает только от хаба
+                self._relay(*frame)
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    def _forward(self, data: bytes) -> None:
+        for peer in list(self._peers):
+            if peer.transport.get_write_buffer_size() > self.MAX_PEER_BUFFER:
+                logger.warning("Процесс-подписчик ретранслятора не успевает читать, отключаем")
+                self.dropped += 1
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(data)
+
+    def stats(self) -> dict:
+        data = super().stats()
+        data["role"] = self.role
+        data["peers"] = len(self._peers)
+        return data
+
+
+# --- PostgreSQL LISTEN/NOTIFY ---
+
+# NOTIFY ограничивает полезную нагрузку 8000 байт: длинные сообщения режем на фрагменты
+# (1900 символов - не больше 7600 байт даже для 4-байтовых символов UTF-8)
+NOTIFY_CHUNK_CHARS = 1900
+MAX_PENDING_FRAGMENTS = 1000
+
+
+def _asyncpg_dsn(url: str) -> str:
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+class PostgresNotifyBroker(_QueuedBroker):
+    name = "postgres"
+
+    def __init__(
+        self,
+        deliver: Deliver,
+        dsn: str = DATABASE_URL,
+        channel: str = BROADCAST_CHANNEL,
+        queue_size: int = BROADCAST_QUEUE_SIZE,
+    ):
+        super().__init__(deliver, queue_size)
+        self.dsn = _asyncpg_dsn(dsn)
+        self.channel = channel
+        self._instance = uuid.uuid4().hex[:8]
+        self._message_ids = count()
+        self._pending: dict[str, list[Optional[str]]] = {}
+        self._listen_conn = None
+        self._publish_conn = None
+        self._sender: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self._listen()
+        self._sender = asyncio.create_task(self._send_loop())
+
+    async def stop(self) -> None:
+        if self._sender is not None:
+            self._sender.cancel()
+            self._sender = None
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        self._listen_conn = self._publish_conn = None
+
+    async def publish(self, event_id: int, message: str) -> None:
+        # Локальная доставка тоже идёт через NOTIFY - порядок сообщений одинаков во всех процессах
+        self.published += 1
+        self._enqueue(event_id, message)
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+        self._listen_conn.add_termination_listener(self._on_listen_lost)
+
+    def _on_listen_lost(self, connection) -> None:
+        logger.warning("Соединение LISTEN %s потеряно, переподключаемся", self.channel)
+        asyncio.get_running_loop().create_task(self._relisten())
+
+    async def _relisten(self) -> None:
+        while True:
+            try:
+                await self._listen()
+                return
+            except Exception:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _fragments(self, event_id: int, message: str) -> list[str]:
+        chunks = [message[i:i + NOTIFY_CHUNK_CHARS] for i in range(0, len(message), NOTIFY_CHUNK_CHARS)] or [""]
+        message_id = f"{self._instance}-{next(self._message_ids)}"
+        return [f"{event_id}:{message_id}:{index}:{len(chunks)}|{chunk}" for index, chunk in enumerate(chunks)]
+
+    async def _send_loop(self) -> None:
+        import asyncpg
+
+        while True:
+            event_id, message = await self._outbox.get()
+            try:
+                if self._publish_conn is None or self._publish_conn.is_closed():
+                    self._publish_conn = await asyncpg.connect(self.dsn)
+                for fragment in self._fragments(event_id, message):
+                    await self._publish_conn.execute("SELECT pg_notify($1, $2)", self.channel, fragment)
+            except Exception:
+                logger.exception("Не удалось опубликовать сообщение в канал %s", self.channel)
+                self.dropped += 1
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        header, _, chunk = payload.partition("|")
+        try:
+            event_id, message_id, index, total = header.split(":")
+            event_id, index, total = int(event_id), int(index), int(total)
+        except ValueError:
+            logger.warning("Некорректное уведомление в канале %s", channel)
+            return
+        if total == 1:
+            message = chunk
+        else:
+            parts = self._pending.setdefault(message_id, [None] * total)
+            parts[index] = chunk
+            if any(part is None for part in parts):
+                while len(self._pending) > MAX_PENDING_FRAGMENTS:
+                    self._pending.pop(next(iter(self._pending)))
+                return
+            message = "".join(self._pending.pop(message_id))
+        self.received += 1
+        self.deliver(event_id, message)
+
+
+def create_broker(deliver: Deliver, backend: str = BROADCAST_BACKEND) -> Broker:
+    if backend == "memory":
+        return InProcessBroker(deliver)
+    if backend == "unix":
+        return UnixSocketBroker(deliver)
+    if backend == "postgres":
+        if not DATABASE_URL.startswith("postgresql"):
+            raise ValueError("BROADCAST_BACKEND=postgres требует DATABASE_URL на PostgreSQL")
+        return PostgresNotifyBroker(deliver)
+    raise ValueError(f"Неизвестный BROADCAST_BACKEND: {backend}")
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import DateTime, Integer, literal
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import models
+from database import dialect_insert
+from change_feed import record_changes
+
+# SQLite до 3.32 ограничивает запрос 999 параметрами - режем явные списки ID на куски
+ID_CHUNK_SIZE = 500
+
+_INSERT_COLUMNS = ["event_id", "participant_id", "registered_by_user_id", "registration_time"]
+
+
+def chunk_ids(ids: list[int], size: int = ID_CHUNK_SIZE) -> Iterable[list[int]]:
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _insert_registrations(db: AsyncSession, source):
+    """INSERT ... SELECT ... ON CONFLICT DO NOTHING: уникальный индекс (event_id, participant_id)
+    отсекает уже зарегистрированных, в том числе при конкурентных вызовах."""
+    return (
+        dialect_insert(db, models.Registration)
+        .from_select(_INSERT_COLUMNS, source)
+        .on_conflict_do_nothing(index_elements=["event_id", "participant_id"])
+        .returning(
+            models.Registration.id,
+            models.Registration.participant_id,
+            models.Registration.registration_time,
+        )
+    )
+
+
+async def bulk_register(
+    db: AsyncSession,
+    event_id: int,
+    registered_by_user_id: int,
+    participant_ids: Iterable[int] = (),
+    directory_id: Optional[int] = None,
+) -> list[Row]:
+    """
+    Регистрирует участников (явный список и/или членов справочника) постоянным числом запросов:
+    INSERT ... SELECT отбирает существующих участников, ON CONFLICT пропускает уже
+    зарегистрированных, RETURNING отдаёт созданные строки. Возвращает (id, participant_id, registration_time)
+    по возрастанию id. Коммит - на стороне вызывающего кода.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    constants = (
+        literal(event_id, Integer),
+        literal(registered_by_user_id, Integer),
+        literal(now, DateTime),
+    )
+    inserted: list[Row] = []
+
+    if directory_id is not None:
+        members = (
+            select(
+                constants[0],
+                models.DirectoryMembership.participant_id,
+                constants[1],
+                constants[2],
+            )
+            .join(models.Participant, models.Participant.id == models.DirectoryMembership.participant_id)
+            .filter(models.DirectoryMembership.directory_id == directory_id)
+            .distinct()
+        )
+        result = await db.execute(_insert_registrations(db, members))
+        inserted.extend(result.all())
+
+    for chunk in chunk_ids(sorted(set(participant_ids))):
+        explicit = select(
+            constants[0],
+            models.Participant.id,
+            constants[1],
+            constants[2],
+        ).filter(models.Participant.id.in_(chunk))
+        result = await db.execute(_insert_registrations(db, explicit))
+        inserted.extend(result.all())
+
+    inserted.sort(key=lambda row: row.id)
+    await record_changes(
+        db,
+        event_id,
+        models.RegistrationChangeAction.REGISTERED,
+        [(row.id, row.participant_id, None) for row in inserted],
+    )
+    return inserted
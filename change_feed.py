@@ -0,0 +1,163 @@
+"""
+Журнал изменений регистраций для курсорной синхронизации планшетов.
+
+Курсор - номер seq внутри мероприятия, а не автоинкрементный id: на PostgreSQL id
+выдаются в одном порядке, а транзакции коммитятся в другом, и клиент, получивший
+id 6, навсегда пропустил бы id 5 из транзакции, закоммиченной позже. seq выдаётся
+из строки event_change_sequences мероприятия: UPDATE блокирует её до коммита, поэтому
+следующая транзакция получит номер только после коммита предыдущей, и номера видны
+клиентам строго по порядку. Номер берётся последним действием перед коммитом, чтобы
+блокировка держалась как можно меньше и всегда бралась после блокировок строк регистраций.
+
+В той же строке ведутся счётчики регистраций и прибывших: они меняются тем же UPSERT,
+что выдаёт номера, и возвращаются через RETURNING, поэтому кадр stats (stats_snapshot)
+точен во всех воркерах и не требует count(*) по регистрациям под блокировкой.
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import func, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import models
+from database import dialect_insert
+from messages import StatsUpdate
+
+# Ключ session.info: event_id -> счётчики после последнего изменения в этой сессии
+_STATS_KEY = "event_stats"
+
+
+# Изменение числа регистраций по типу записи журнала
+_REGISTERED_DELTA = {
+    models.RegistrationChangeAction.REGISTERED: 1,
+    models.RegistrationChangeAction.DELETED: -1,
+}
+
+
+async def _reserve_seqs(db: AsyncSession, event_id: int, count: int, registered: int, arrived: int) -> int:
+    """
+    Резервирует count номеров журнала мероприятия, сдвигает счётчики на registered/arrived
+    и возвращает первый номер. Итоговые счётчики запоминаются для stats_snapshot.
+    """
+    sequence = models.EventChangeSequence
+    stmt = (
+        dialect_insert(db, sequence)
+        .values(event_id=event_id, last_seq=count, registered=registered, arrived=arrived)
+        .on_conflict_do_update(
+            index_elements=["event_id"],
+            set_={
+                "last_seq": sequence.last_seq + count,
+                "registered": sequence.registered + registered,
+                "arrived": sequence.arrived + arrived,
+            },
+        )
+        .returning(sequence.last_seq, sequence.registered, sequence.arrived)
+    )
+    last_seq, total, arrived_total = (await db.execute(stmt)).one()
+    db.info.setdefault(_STATS_KEY, {})[event_id] = StatsUpdate(
+        total_registrants=total, arrived_participants=arrived_total, change_seq=last_seq,
+    )
+    return last_seq - count + 1
+
+
+async def record_change(
+    db: AsyncSession,
+    event_id: int,
+    action: models.RegistrationChangeAction,
+    registration_id: int,
+    participant_id: int,
+    arrival_time: Optional[datetime] = None,
+    arrived: int = 0,
+) -> None:
+    """Добавляет запись в журнал изменений. Коммит - на стороне вызывающего кода."""
+    await record_changes(db, event_id, action, [(registration_id, participant_id, arrival_time)], arrived)
+
+
+async def record_changes(
+    db: AsyncSession,
+    event_id: int,
+    action: models.RegistrationChangeAction,
+    rows: Iterable[tuple[int, int, Optional[datetime]]],
+    arrived: int = 0,
+) -> None:
+    """
+    Пакетная запись изменений одним INSERT. rows: (registration_id, participant_id, arrival_time).
+    Число регистраций сдвигается по action, число прибывших - на arrived: его знает только
+    вызывающий код (повторная отметка пришедшего ничего не меняет).
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    registered = _REGISTERED_DELTA.get(action, 0) * len(rows)
+    first_seq = await _reserve_seqs(db, event_id, len(rows), registered, arrived)
+    values = [
+        {
+            "event_id": event_id,
+            "seq": first_seq + offset,
+            "registration_id": registration_id,
+            "participant_id": participant_id,
+            "action": action.value,
+            "arrival_time": arrival_time,
+        }
+        for offset, (registration_id, participant_id, arrival_time) in enumerate(rows)
+    ]
+    await db.execute(insert(models.RegistrationChange), values)
+
+
+async def fetch_changes(
+    db: AsyncSession,
+    event_id: int,
+    cursor: int,
+    limit: int,
+) -> tuple[Sequence[models.RegistrationChange], bool]:
+    """Возвращает изменения мероприятия с номером seq больше cursor (по возрастанию) и флаг has_more."""
+    stmt = (
+        select(models.RegistrationChange)
+        .filter(
+            models.RegistrationChange.event_id == event_id,
+            models.RegistrationChange.seq > cursor,
+        )
+        .order_by(models.RegistrationChange.seq)
+        .limit(limit + 1)
+    )
+    result = await db.execute(stmt)
+    changes = result.scalars().all()
+    return changes[:limit], len(changes) > limit
+
+
+async def event_counts(db: AsyncSession, event_id: int) -> tuple[int, int, int]:
+    """
+    (регистраций, прибывших, номер последнего изменения) точным подсчётом по индексу
+    (event_id, arrival_time). Для чтения вне пишущих транзакций - там счётчики даёт stats_snapshot.
+    """
+    last_seq = (
+        select(models.EventChangeSequence.last_seq)
+        .filter(models.EventChangeSequence.event_id == event_id)
+        .scalar_subquery()
+    )
+    stmt = select(
+        func.count(),
+        func.count(models.Registration.arrival_time),
+        func.coalesce(last_seq, 0),
+    ).select_from(models.Registration).filter(models.Registration.event_id == event_id)
+    total, arrived, change_seq = (await db.execute(stmt)).one()
+    return total, arrived, change_seq
+
+
+async def stats_snapshot(db: AsyncSession, event_id: int) -> StatsUpdate:
+    """
+    Кадр stats для рассылки после коммита. Вызывается в пишущей транзакции после
+    record_change(s): счётчики берутся из RETURNING того же UPSERT, без запроса к БД.
+    change_seq позволяет клиенту отбросить кадр, обогнанный более свежим.
+    """
+    stats = db.info.get(_STATS_KEY, {}).pop(event_id, None)
+    if stats is None:
+        # В этой транзакции журнал не писался - читаем строку счётчиков
+        sequence = models.EventChangeSequence
+        row = (await db.execute(
+            select(sequence.last_seq, sequence.registered, sequence.arrived).filter(sequence.event_id == event_id)
+        )).first()
+        last_seq, total, arrived = row if row is not None else (0, 0, 0)
+        stats = StatsUpdate(total_registrants=total, arrived_participants=arrived, change_seq=last_seq)
+    return stats
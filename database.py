@@ -5,36 +5,48 @@ from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.future import select
-from passlib.context import CryptContext
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-DATABASE_URL = os.environ.get(
-    "DATABASE_URL",
-    "sqlite+aiosqlite:///./sql_app.db",
-)
+from db_pool import InstrumentedAsyncQueuePool, instrument_engine
+from db_settings import DatabaseSettings, engine_options
+from sqlite_profile import create_engines, routing_sessionmaker
 
-IS_SQLITE = DATABASE_URL.startswith("sqlite")
+settings = DatabaseSettings.from_env()
+DATABASE_URL = settings.url
 
-Base = declarative_base()
+IS_SQLITE = settings.is_sqlite
 
-engine_config: dict = {}
-if IS_SQLITE:
-    engine_config["connect_args"] = {"check_same_thread": False}
+Base = declarative_base()
 
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    **engine_config,
-)
+if settings.sqlite_production:
+    # engine - единственное пишущее соединение, read_engine - пул читателей
+    engine, read_engine = create_engines(settings, poolclass=InstrumentedAsyncQueuePool)
+    instrument_engine(read_engine.sync_engine)
+    AsyncSessionLocal = routing_sessionmaker(
+        engine, read_engine, autocommit=False, autoflush=False, expire_on_commit=False,
+    )
+else:
+    engine = create_async_engine(
+        DATABASE_URL,
+        **engine_options(settings, poolclass=InstrumentedAsyncQueuePool),
+    )
+    read_engine = None
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=engine,
+        class_=AsyncSession,
+        expire_on_commit=False,
+    )
+instrument_engine(engine.sync_engine)
 
-AsyncSessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def dialect_insert(db: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей сессии (SQLite / PostgreSQL)."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(model)
+    return sqlite_insert(model)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -42,15 +54,15 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-
 async def init_db(db: AsyncSession) -> None:
     import models
+    import search_index
+    from passwords import hash_password_async
 
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # Для уже существующей таблицы participants after_create не срабатывает
+        await conn.run_sync(search_index.ensure_search_index)
 
     stmt_admin = select(models.SystemUser).filter(models.SystemUser.role == "Admin")
     result_admin = await db.execute(stmt_admin)
@@ -67,7 +79,7 @@ async def init_db(db: AsyncSession) -> None:
                 username=admin_username,
                 role="Admin",
                 full_name=admin_full_name,
-                hashed_password=get_password_hash(admin_password),
+                hashed_password=await hash_password_async(admin_password),
             )
             db.add(admin)
             await db.commit()
@@ -0,0 +1,100 @@
+"""
+Инструментированный пул соединений: сколько соединений выдано, сколько сверх
+pool_size, и гистограмма времени ожидания свободного соединения.
+"""
+import time
+from bisect import bisect_left
+from typing import Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Верхние границы корзин гистограммы ожидания, мс (последняя корзина - всё, что дольше)
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.waits = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def record_wait(self, wait_ms: float) -> None:
+        self.wait_histogram[bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+        self.waits += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def histogram(self) -> dict[str, int]:
+        labels = [f"<={bound}ms" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+        return dict(zip(labels, self.wait_histogram))
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool, замеряющий время получения соединения из пула."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record_wait((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        # Пересозданный пул (engine.dispose()) продолжает копить те же счётчики
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Подключает счётчики новых и инвалидированных соединений к инструментированному пулу."""
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedAsyncQueuePool):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        engine.pool.metrics.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        engine.pool.metrics.invalidations += 1
+
+
+def pool_stats(engine: Engine) -> dict:
+    pool = engine.pool
+    data: dict = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        data.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow,
+            timeout_seconds=pool.timeout(),
+        )
+    metrics: Optional[PoolMetrics] = getattr(pool, "metrics", None)
+    if metrics is not None:
+        data.update(
+            connects=metrics.connects,
+            invalidations=metrics.invalidations,
+            timeouts=metrics.timeouts,
+            waits=metrics.waits,
+            avg_wait_ms=round(metrics.total_wait_ms / metrics.waits, 3) if metrics.waits else None,
+            max_wait_ms=round(metrics.max_wait_ms, 3),
+            wait_histogram=metrics.histogram(),
+        )
+    return data
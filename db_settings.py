@@ -0,0 +1,109 @@
+"""
+Настройки подключения к БД из переменных окружения.
+
+Всё, что раньше было зашито в database.py (echo=True, пул по умолчанию), задаётся
+здесь: логирование SQL, параметры пула, таймауты запросов и аргументы подключения
+SQLite. engine_options() превращает настройки в аргументы create_async_engine.
+"""
+import os
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from sqlalchemy.pool import Pool
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str = "sqlite+aiosqlite:///./sql_app.db"
+    # Логирование каждого SQL-запроса (синхронно в stdout) - только для отладки
+    echo: bool = False
+    pool_size: int = 5
+    max_overflow: int = 10
+    # Сколько секунд ждать свободное соединение, прежде чем выдать ошибку
+    pool_timeout: float = 30.0
+    # Пересоздавать соединения старше N секунд (-1 - не пересоздавать)
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    # Таймаут одного запроса (PostgreSQL statement_timeout); None - без ограничения
+    statement_timeout_ms: Optional[int] = None
+    # Сколько SQLite ждёт снятия блокировки записи, секунды
+    sqlite_busy_timeout: float = 5.0
+    # production - WAL, прагмы на каждом соединении и единственное пишущее соединение
+    # (см. sqlite_profile.py); default - поведение SQLite по умолчанию
+    sqlite_profile: str = "default"
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_cache_size_kib: int = 64 * 1024
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.url.startswith("sqlite")
+
+    @property
+    def is_memory_sqlite(self) -> bool:
+        # sqlite+aiosqlite:///:memory: или sqlite+aiosqlite:// без пути к файлу
+        return self.is_sqlite and (":memory:" in self.url or self.url.endswith("://"))
+
+    @property
+    def sqlite_production(self) -> bool:
+        return self.is_sqlite and not self.is_memory_sqlite and self.sqlite_profile == "production"
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        timeout = _env_float("DB_STATEMENT_TIMEOUT_MS", None)
+        return cls(
+            url=os.environ.get("DATABASE_URL", cls.url),
+            echo=_env_bool("DB_ECHO", cls.echo),
+            pool_size=int(os.getenv("DB_POOL_SIZE", cls.pool_size)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", cls.max_overflow)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", cls.pool_timeout)),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", cls.pool_recycle)),
+            pool_pre_ping=_env_bool("DB_POOL_PRE_PING", cls.pool_pre_ping),
+            statement_timeout_ms=int(timeout) if timeout else None,
+            sqlite_busy_timeout=float(os.getenv("SQLITE_BUSY_TIMEOUT", cls.sqlite_busy_timeout)),
+            sqlite_profile=os.getenv("SQLITE_PROFILE", cls.sqlite_profile),
+            sqlite_mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", cls.sqlite_mmap_size)),
+            sqlite_cache_size_kib=int(os.getenv("SQLITE_CACHE_SIZE_KIB", cls.sqlite_cache_size_kib)),
+        )
+
+
+def engine_options(settings: DatabaseSettings, poolclass: Optional[type[Pool]] = None) -> dict[str, Any]:
+    """Аргументы create_async_engine для настроек settings."""
+    options: dict[str, Any] = {"echo": settings.echo, "pool_pre_ping": settings.pool_pre_ping}
+
+    if settings.is_sqlite:
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": settings.sqlite_busy_timeout,
+        }
+    elif settings.statement_timeout_ms:
+        # asyncpg: серверный statement_timeout плюс клиентский таймаут с запасом
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(settings.statement_timeout_ms)},
+            "command_timeout": settings.statement_timeout_ms / 1000 + 1,
+        }
+
+    # SQLite в памяти живёт в одном соединении (StaticPool) - параметры пула к нему неприменимы
+    if not settings.is_memory_sqlite:
+        options.update(
+            pool_size=settings.pool_size,
+            max_overflow=settings.max_overflow,
+            pool_timeout=settings.pool_timeout,
+            pool_recycle=settings.pool_recycle,
+        )
+        if poolclass is not None:
+            options["poolclass"] = poolclass
+    return options
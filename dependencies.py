@@ -1,31 +1,40 @@
 import os
 from datetime import datetime, timedelta, UTC
-from typing import Optional
+from typing import Optional, Union
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 import models
 import schemas
 from database import get_db
+# Реэкспорт: хэширование паролей живёт в passwords, но остаётся доступным отсюда
+from passwords import get_password_hash, verify_password  # noqa: F401
+from token_versions import token_versions
+from user_cache import user_cache
 
 # --- Конфигурация ---
 SECRET_KEY = os.getenv("SECRET_KEY", "MY_SUPER_SECRET_DEV_KEY_CHANGE_ME")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# db - пользователь читается из system_users (через кэш); claims - права проверяются
+# только по подписанным claims токена и таблице версий токенов, без чтения пользователя
+AUTH_MODE = os.getenv("AUTH_MODE", "db")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- Auth Helpers ---
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+def token_claims(user: models.SystemUser) -> dict:
+    """Claims токена доступа: всё, что нужно обработчикам в режиме AUTH_MODE=claims."""
+    return {
+        "sub": user.username,
+        "uid": user.id,
+        "role": user.role,
+        "name": user.full_name,
+        "ver": user.token_version,
+    }
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
@@ -37,7 +46,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db),
-) -> models.SystemUser:
+) -> Union[models.SystemUser, schemas.TokenData]:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -48,15 +57,32 @@ async def get_current_user(
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
+        token_data = schemas.TokenData(
+            username=username,
+            id=payload.get("uid"),
+            role=payload.get("role"),
+            full_name=payload.get("name"),
+            # Токены, выданные до появления версий, считаются версией 0
+            token_version=payload.get("ver", 0),
+        )
+    except (JWTError, ValueError):
         raise credentials_exception
 
-    stmt = select(models.SystemUser).filter(models.SystemUser.username == token_data.username)
-    result = await db.execute(stmt)
-    user = result.scalars().first()
+    if AUTH_MODE == "claims":
+        if token_data.id is None or token_data.role is None:
+            raise credentials_exception
+        if not await token_versions.is_current(db, token_data.id, token_data.token_version):
+            raise credentials_exception
+        return token_data
+
+    user = await user_cache.get(db, token_data.username, token_data.token_version)
     if user is None:
-        raise credentials_exception
+        stmt = select(models.SystemUser).filter(models.SystemUser.username == token_data.username)
+        result = await db.execute(stmt)
+        user = result.scalars().first()
+        if user is None or user.token_version != token_data.token_version:
+            raise credentials_exception
+        user_cache.put(user, token_data.token_version)
     return user
 
 async def get_current_admin(
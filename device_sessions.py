@@ -0,0 +1,148 @@
+"""
+Refresh-токены долгоживущих сессий устройств.
+
+Токен имеет вид "<id сессии>.<случайная строка>": продление access-токена - одно чтение
+device_sessions по первичному ключу (вместе с пользователем) и одно условное UPDATE,
+без bcrypt. При каждом продлении токен заменяется новым (ротация); повторное
+предъявление уже заменённого токена завершает сессию. Исключение - первые
+REFRESH_REUSE_GRACE_SECONDS после замены: так выглядят обычные гонки (две вкладки с общим
+localStorage, повтор запроса после потерянного ответа), и такой запрос получает 401, но
+сессию не трогает.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import models
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "30"))
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _hash(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+def _parse(refresh_token: str) -> Optional[tuple[int, str]]:
+    session_id, _, secret = refresh_token.partition(".")
+    if not session_id.isdigit() or not secret:
+        return None
+    return int(session_id), secret
+
+
+async def create_session(db: AsyncSession, user: models.SystemUser) -> str:
+    """Открывает сессию устройства и возвращает её refresh-токен (коммит - за вызывающим)."""
+    now = _utcnow()
+    # Заодно убираем истёкшие сессии пользователя, чтобы таблица не росла
+    await db.execute(
+        delete(models.DeviceSession).where(
+            models.DeviceSession.user_id == user.id,
+            models.DeviceSession.expires_at <= now,
+        )
+    )
+    secret = secrets.token_urlsafe(32)
+    session = models.DeviceSession(
+        user_id=user.id,
+        token_hash=_hash(secret),
+        token_version=user.token_version,
+        created_at=now,
+        last_used_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+    db.add(session)
+    await db.flush()
+    return f"{session.id}.{secret}"
+
+
+async def rotate_session(db: AsyncSession, refresh_token: str) -> Optional[tuple[models.SystemUser, str]]:
+    """
+    Проверяет refresh-токен и заменяет его новым.
+    Возвращает (пользователь, новый refresh-токен) или None, если токен недействителен.
+    """
+    parsed = _parse(refresh_token)
+    if parsed is None:
+        return None
+    session_id, secret = parsed
+    stmt = (
+        select(models.DeviceSession, models.SystemUser)
+        .join(models.SystemUser, models.DeviceSession.user_id == models.SystemUser.id)
+        .filter(models.DeviceSession.id == session_id)
+    )
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        return None
+    session, user = row
+    token_hash = _hash(secret)
+    now = _utcnow()
+
+    if not hmac.compare_digest(session.token_hash, token_hash):
+        if session.previous_token_hash and hmac.compare_digest(session.previous_token_hash, token_hash):
+            # last_used_at - момент последней замены токена
+            if now - session.last_used_at < timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+                return None
+            logger.warning("Повторно предъявлен заменённый refresh-токен сессии %s, сессия завершена", session_id)
+            await db.delete(session)
+            await db.commit()
+        return None
+    if session.expires_at <= now or session.token_version != user.token_version:
+        await db.delete(session)
+        await db.commit()
+        return None
+
+    new_secret = secrets.token_urlsafe(32)
+    # Условие по старому хэшу: из двух одновременных продлений одним токеном проходит одно
+    result = await db.execute(
+        update(models.DeviceSession)
+        .where(models.DeviceSession.id == session_id, models.DeviceSession.token_hash == token_hash)
+        .values(
+            token_hash=_hash(new_secret),
+            previous_token_hash=token_hash,
+            last_used_at=now,
+            expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    if result.rowcount != 1:
+        return None
+    return user, f"{session_id}.{new_secret}"
+
+
+async def revoke_session(db: AsyncSession, refresh_token: str) -> bool:
+    """Завершает сессию по её refresh-токену (текущему или только что заменённому)."""
+    parsed = _parse(refresh_token)
+    if parsed is None:
+        return False
+    session_id, secret = parsed
+    token_hash = _hash(secret)
+    result = await db.execute(
+        delete(models.DeviceSession).where(
+            models.DeviceSession.id == session_id,
+            or_(
+                models.DeviceSession.token_hash == token_hash,
+                models.DeviceSession.previous_token_hash == token_hash,
+            ),
+        )
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def revoke_user_sessions(db: AsyncSession, user_id: int) -> int:
+    """Завершает все сессии пользователя (коммит - за вызывающим)."""
+    result = await db.execute(delete(models.DeviceSession).where(models.DeviceSession.user_id == user_id))
+    return result.rowcount
@@ -0,0 +1,113 @@
+"""
+Фоновая отправка WebSocket-сообщений после коммита.
+
+Обработчики вызывают dispatcher.enqueue сразу после await db.commit(), без других
+await между ними, - так порядок очереди совпадает с порядком коммитов. Кодирование
+и публикация в брокер выполняются одной фоновой задачей строго по очереди, поэтому
+сообщения каждого мероприятия доставляются в порядке коммитов, а HTTP-ответ не ждёт
+рассылки.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Union
+
+from manager import manager
+from messages import BroadcastMessage
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "10000"))
+
+
+class BroadcastDispatcher:
+    def __init__(self, max_size: int = DISPATCH_QUEUE_SIZE):
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._total_lag_ms = 0.0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # Очередь и задача привязаны к циклу событий: при новом цикле (перезапуск
+        # приложения, тесты) создаются заново
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._worker = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    def enqueue(self, event_id: int, message: Union[BroadcastMessage, str]) -> None:
+        """Ставит сообщение в очередь рассылки; вызывать сразу после коммита."""
+        queue = self._ensure_worker()
+        try:
+            queue.put_nowait((event_id, message, time.monotonic()))
+        except asyncio.QueueFull:
+            # Клиенты догонят состояние через resync / /sync
+            self.dropped += 1
+            logger.warning("Очередь рассылки переполнена, сообщение мероприятия %s отброшено", event_id)
+            return
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            event_id, message, enqueued_at = await queue.get()
+            try:
+                await manager.broadcast(message, event_id)
+                self.dispatched += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Не удалось разослать сообщение мероприятия %s", event_id)
+            finally:
+                lag_ms = (time.monotonic() - enqueued_at) * 1000
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+                self._total_lag_ms += lag_ms
+                queue.task_done()
+
+    async def join(self) -> None:
+        """Ждёт, пока очередь текущего цикла событий опустеет."""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    async def stop(self) -> None:
+        await self.join()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._queue = None
+        self._loop = None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        processed = self.dispatched + self.failed
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "avg_lag_ms": round(self._total_lag_ms / processed, 3) if processed else None,
+            "max_lag_ms": round(self.max_lag_ms, 3),
+        }
+
+
+dispatcher = BroadcastDispatcher()
@@ -21,8 +21,35 @@ function log(msg, type = 'info') {
     }
 }
 
+// --- TOKEN REFRESH ---
+// Один запрос продления на все параллельные вызовы api(): refresh-токен одноразовый
+let refreshInFlight = null;
+
+function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return Promise.resolve(false);
+    if (!refreshInFlight) {
+        refreshInFlight = fetch(`${API_URL}/token/refresh`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ refresh_token: refreshToken })
+        })
+            .then(async res => {
+                // Токен уже заменила другая вкладка: её пара лежит в общем localStorage
+                if (!res.ok) return localStorage.getItem('refresh_token') !== refreshToken;
+                const data = await res.json();
+                localStorage.setItem('token', data.access_token);
+                localStorage.setItem('refresh_token', data.refresh_token);
+                return true;
+            })
+            .catch(() => false)
+            .finally(() => { refreshInFlight = null; });
+    }
+    return refreshInFlight;
+}
+
 // --- API WRAPPER ---
-async function api(endpoint, method = 'GET', body = null) {
+async function api(endpoint, method = 'GET', body = null, retried = false) {
     const token = localStorage.getItem('token');
     const headers = {};
 
@@ -40,6 +67,10 @@ async function api(endpoint, method = 'GET', body = null) {
         });
 
         if (res.status === 401) {
+            // Access-токен истёк: продлеваем сессию и повторяем запрос один раз
+            if (!retried && await refreshAccessToken()) {
+                return api(endpoint, method, body, true);
+            }
             log('Сессия истекла. Перенаправление...', 'error');
             setTimeout(logout, 1000);
             throw new Error("Unauthorized");
@@ -166,8 +197,16 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 function logout() {
+    const refreshToken = localStorage.getItem('refresh_token');
     localStorage.removeItem('token');
-    window.location.href = 'login.php';
+    localStorage.removeItem('refresh_token');
+    const done = () => { window.location.href = 'login.php'; };
+    if (!refreshToken) return done();
+    fetch(`${API_URL}/token/revoke`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ refresh_token: refreshToken })
+    }).catch(() => {}).finally(done);
 }
 
 // --- GLOBAL DELETE HANDLER ---
@@ -30,6 +30,8 @@ document.getElementById('login-form').addEventListener('submit', async (e) => {
         if (res.ok) {
             const data = await res.json();
             localStorage.setItem('token', data.access_token);
+            // Продление сессии планшета без повторного ввода пароля
+            if (data.refresh_token) localStorage.setItem('refresh_token', data.refresh_token);
             
             // Если роль пришла, можно сохранить
             if(data.role) localStorage.setItem('role', data.role);
@@ -6,9 +6,13 @@
 
 let currentEventId = null;
 let isUnregisterMode = false;
-let currentStats = { total: 0, arrived: 0 };
-let syncInterval = null;
+let currentStats = { total: 0, arrived: 0, changeSeq: -1 };
 let socket = null;
+// Последний полученный кадр: при переподключении сервер дошлёт только пропущенное
+let wsResume = { eventId: null, epoch: null, seq: null };
+// Пост одной делегации: reg_actual.php?directories=3&directories=5 - сервер присылает
+// регистрации и отметки только участников этих справочников
+const WS_DIRECTORIES = new URLSearchParams(window.location.search).getAll('directories');
 const WS_URL = 'wss://reg.iltumen.ru/api/ws/events';
 
 document.addEventListener('DOMContentLoaded', () => {
@@ -44,7 +48,6 @@ async function initPage() {
                 loadEventParticipants(); 
                 
                 connectWebSocket(currentEventId);
-                startBackupSyncLoop(); 
             } else { showNoActiveEvent(); }
         } else { showNoActiveEvent(); }
     } catch (e) { console.error(e); showNoActiveEvent(); }
@@ -52,21 +55,38 @@ async function initPage() {
 
 function connectWebSocket(eventId) {
     if (socket) socket.close();
-    socket = new WebSocket(`${WS_URL}/${eventId}`);
-    socket.onopen = () => { loadEventStats(); loadEventParticipants(); };
+    if (wsResume.eventId !== eventId) wsResume = { eventId, epoch: null, seq: null };
+    const resuming = wsResume.epoch !== null && wsResume.seq !== null;
+    const params = new URLSearchParams();
+    if (resuming) { params.set('since', wsResume.seq); params.set('epoch', wsResume.epoch); }
+    WS_DIRECTORIES.forEach(id => params.append('directories', id));
+    const query = params.toString() ? `?${params}` : '';
+    socket = new WebSocket(`${WS_URL}/${eventId}${query}`);
+    socket.onopen = () => { if (!resuming) { loadEventStats(); loadEventParticipants(); } };
     socket.onmessage = (event) => {
         try {
             const data = JSON.parse(event.data);
-            handleWebSocketMessage(data);
+            if (data.type === 'ping') { socket.send('{"type": "pong"}'); return; }
+            if (data.seq !== undefined) { wsResume.epoch = data.epoch; wsResume.seq = data.seq; }
+            if (data.type === 'resync_required') {
+                // Пропущенное уже выпало из буфера сервера - перечитываем список целиком
+                loadEventStats();
+                loadEventParticipants(true);
+                return;
+            }
+            // Пачка из окна склейки на сервере - одна перерисовка на всю пачку
+            handleWebSocketMessages(data.type === 'batch' ? data.messages : [data]);
         } catch (e) { console.error(e); }
     };
     socket.onclose = () => { setTimeout(() => { if (currentEventId) connectWebSocket(currentEventId); }, 3000); };
     socket.onerror = (error) => { socket.close(); };
 }
 
-function handleWebSocketMessage(data) {
-    loadEventStats();
-    if (['new_registrations', 'arrival_update', 'deleted_registration'].includes(data.type)) {
+function handleWebSocketMessages(messages) {
+    // Счётчики сервер присылает сам кадром stats. Кадры разных воркеров могут прийти
+    // не по порядку - применяем только более свежий по номеру изменения change_seq
+    messages.filter(m => m.type === 'stats').forEach(applyStats);
+    if (messages.some(m => ['new_registrations', 'arrival_update', 'deleted_registration'].includes(m.type))) {
         const searchInput = document.getElementById('list-search-input');
         // Если пользователь что-то пишет (поле не пустое и в фокусе), не мешаем ему обновлением
         if (document.activeElement === searchInput && searchInput.value.trim() !== '') return;
@@ -74,28 +94,21 @@ function handleWebSocketMessage(data) {
     }
 }
 
-function startBackupSyncLoop() {
-    if (syncInterval) clearInterval(syncInterval);
-    syncInterval = setInterval(() => {
-        loadEventStats();
-        const searchInput = document.getElementById('list-search-input');
-        if (document.activeElement === searchInput && searchInput.value.trim() !== '') return;
-        loadEventParticipants(true);
-    }, 30000); 
-}
-
 async function loadEventStats() {
     try {
         const res = await api('/events/active/stats');
-        if (res.ok) {
-            const stats = await res.json();
-            currentStats.total = stats.total_registrants;
-            currentStats.arrived = stats.arrived_participants;
-            renderStats();
-        }
+        if (res.ok) applyStats(await res.json());
     } catch (e) { console.error(e); }
 }
 
+function applyStats(stats) {
+    if (stats.change_seq < currentStats.changeSeq) return;
+    currentStats.total = stats.total_registrants;
+    currentStats.arrived = stats.arrived_participants;
+    currentStats.changeSeq = stats.change_seq;
+    renderStats();
+}
+
 function renderStats() {
     const counterEl = document.getElementById('arrival-counter');
     if (counterEl) {
@@ -213,7 +226,6 @@ window.handleSetArrival = async function(participantId, participantName) {
                 searchInput.focus();
             }
             updateSystemStatus(`Зарегистрирован: <strong>${participantName}</strong>`);
-            loadEventStats(); 
             
             // ВАЖНО: Принудительно обновляем список, чтобы показать всех (без фильтра)
             loadEventParticipants(true); 
@@ -233,7 +245,6 @@ window.handleUnsetArrival = async function(participantId, participantName) {
                 searchInput.focus();
             }
             updateSystemStatus(`Снята регистрация: <strong>${participantName}</strong>`);
-            loadEventStats(); 
             
             // ВАЖНО: Принудительно обновляем список
             loadEventParticipants(true); 
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class IdempotencyStore:
+    """
+    Ограниченное по размеру хранилище результатов запросов по ключу идемпотентности.
+    Записи старше ttl_seconds считаются протухшими; при переполнении вытесняются самые старые.
+
+    Обработчик резервирует ключ (begin) до работы с БД: одновременный запрос с тем же
+    ключом ждёт результата первого, а не выполняется второй раз. Хранилище живёт в памяти
+    процесса: при нескольких воркерах повтор, попавший в другой процесс, выполнится
+    заново. Это безопасно для отметок прибытия и регистрации (повтор не создаёт дублей,
+    см. bulk_registration), но ответ может отличаться - например, временем прибытия.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Зарезервированные ключи, результат которых ещё вычисляется
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _evict_expired(self, now: float) -> None:
+        # Записи упорядочены по времени вставки - протухшие всегда в начале
+        while self._entries:
+            key, (stored_at, _) = next(iter(self._entries.items()))
+            if now - stored_at < self.ttl_seconds:
+                break
+            del self._entries[key]
+
+    def get(self, key: Optional[Hashable]) -> Any:
+        if key is None:
+            return None
+        self._evict_expired(time.monotonic())
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    async def begin(self, key: Optional[Hashable]) -> Any:
+        """
+        Сохранённый результат по ключу (дождавшись запроса, который его сейчас вычисляет)
+        или None - тогда ключ зарезервирован за вызывающим до put или release.
+        """
+        if key is None:
+            return None
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            pending = self._in_flight.get(key)
+            if pending is None:
+                self._in_flight[key] = asyncio.get_running_loop().create_future()
+                return None
+            # Владелец ключа завершился: либо результат уже сохранён, либо он упал
+            # и ключ можно резервировать заново
+            await asyncio.shield(pending)
+
+    def release(self, key: Optional[Hashable]) -> None:
+        """Снимает резерв без результата (запрос завершился ошибкой); после put - ничего не делает."""
+        pending = self._in_flight.pop(key, None)
+        if pending is not None and not pending.done():
+            pending.set_result(None)
+
+    def put(self, key: Optional[Hashable], value: Any) -> None:
+        if key is None:
+            return
+        now = time.monotonic()
+        self._evict_expired(now)
+        self._entries.pop(key, None)
+        self._entries[key] = (now, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.release(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._in_flight.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def scoped_key(scope: str, event_id: int, user_id: Optional[int], key: Optional[str]) -> Optional[tuple]:
+    """
+    Ключ хранилища: один и тот же Idempotency-Key в разных эндпоинтах, мероприятиях и у
+    разных пользователей не пересекается - чужой ответ по совпавшему ключу не отдаётся.
+    """
+    if not key:
+        return None
+    return (scope, event_id, user_id, key)
+
+
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600")),
+)
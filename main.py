@@ -1,16 +1,36 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from typing import List, Optional
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from sqlalchemy.future import select
 from database import init_db, AsyncSessionLocal
 from manager import manager
+from dispatcher import dispatcher
+from roster_cache import roster_cache
+import models
 
 # Импортируем роутеры
-from routers import auth, system_users, events, participants, directories, registrations, reports
+from routers import auth, system_users, events, participants, directories, registrations, reports, metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with AsyncSessionLocal() as session:
         await init_db(session)
+        # Прогреваем ростер активного мероприятия
+        result = await session.execute(
+            select(models.Event.id).filter(models.Event.registration_active == True)
+        )
+        active_event_id = result.scalars().first()
+        if active_event_id is not None:
+            await roster_cache.load(session, active_event_id)
+    # Рассылка WebSocket между воркерами (BROADCAST_BACKEND)
+    await manager.start_broker()
+    # Heartbeat и закрытие полуоткрытых соединений
+    manager.start_reaper()
     yield
+    # Дослать сообщения, поставленные в очередь до остановки
+    await dispatcher.stop()
+    await manager.stop_reaper()
+    await manager.stop_broker()
 
 app = FastAPI(
     title="Event Registration API (Hybrid)",
@@ -29,13 +49,32 @@ app.include_router(participants.router, tags=["Participants"])
 app.include_router(events.router, tags=["Events"])
 app.include_router(registrations.router, tags=["Registrations"])
 app.include_router(reports.router, tags=["Reports"]) 
+app.include_router(metrics.router, tags=["Metrics"])
 
 # WebSocket
 @app.websocket("/ws/events/{event_id}")
-async def websocket_endpoint(websocket: WebSocket, event_id: int):
-    await manager.connect(websocket, event_id)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    event_id: int,
+    since: Optional[int] = None,
+    epoch: Optional[str] = None,
+    encoding: str = "json",
+    directories: Optional[List[int]] = Query(None),
+):
+    # since/epoch - последний полученный кадр: сервер дошлёт пропущенное;
+    # encoding=msgpack - бинарные кадры вместо JSON;
+    # directories=1&directories=2 - только участники этих справочников
+    await manager.connect(
+        websocket, event_id, since=since, epoch=epoch, encoding=encoding, directories=directories,
+    )
     try:
         while True:
-            await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            # Любое входящее сообщение (в т.ч. pong) продлевает жизнь соединения
+            manager.touch(websocket, event_id)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, event_id)
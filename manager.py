@@ -1,30 +1,426 @@
-from typing import List
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from typing import FrozenSet, Iterable, Optional, Union
+
 from fastapi import WebSocket
 
+from broker import BROADCAST_BACKEND, Broker, InProcessBroker, create_broker
+from messages import (
+    BINARY_ENCODING,
+    BINARY_ENCODING_AVAILABLE,
+    BroadcastMessage,
+    encode_message,
+    routed_directory_ids,
+    to_binary,
+)
+
+logger = logging.getLogger(__name__)
+
+# Таймаут отправки одного сообщения клиенту, секунды
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Размер исходящей очереди на одно соединение
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+# Что делать при переполнении очереди: drop - выбросить накопленные сообщения и отправить
+# клиенту resync_required (он перечитает состояние), disconnect - отключить медленного
+# клиента (он переподключится и досинхронизируется)
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop")
+
+# Окно склейки сообщений мероприятия в один кадр {"type": "batch", "messages": [...]}, мс;
+# 0 - каждое сообщение уходит отдельным кадром
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "0"))
+# Кадр отправляется досрочно, как только в окне набралось столько сообщений
+WS_COALESCE_MAX_BATCH = int(os.getenv("WS_COALESCE_MAX_BATCH", "100"))
+
+# Сколько последних кадров мероприятия хранится для досылки при переподключении (?since=<seq>)
+WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "1000"))
+
+# Период heartbeat: сервер шлёт {"type": "ping"}, клиент отвечает любым сообщением (pong)
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+# Соединение, от которого столько секунд ничего не приходило, считается полуоткрытым и закрывается
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+
+_UNRESOLVED = object()
+
+# 1013 Try Again Later: клиент не успевает принимать сообщения
+SLOW_CLIENT_CLOSE_CODE = 1013
+# 1001 Going Away: клиент не отвечает на heartbeat
+IDLE_CLIENT_CLOSE_CODE = 1001
+
+PING_MESSAGE = '{"type": "ping"}'
+
+
+class Frame:
+    """Кадр рассылки: JSON-текст и его бинарная форма, собираемая один раз на всех подписчиков."""
+
+    __slots__ = ("seq", "text", "_binary", "_directory_ids")
+
+    def __init__(self, seq: int, text: str):
+        self.seq = seq
+        self.text = text
+        self._binary: Optional[bytes] = None
+        self._directory_ids = _UNRESOLVED
+
+    def matches(self, directories: FrozenSet[int]) -> bool:
+        """Касается ли кадр хотя бы одного участника из справочников directories."""
+        # Справочники приходят в самом сообщении - кадр разбирается один раз на процесс
+        if self._directory_ids is _UNRESOLVED:
+            self._directory_ids = routed_directory_ids(self.text)
+        return self._directory_ids is None or not self._directory_ids.isdisjoint(directories)
+
+    def payload(self, binary: bool) -> Union[str, bytes]:
+        if not binary:
+            return self.text
+        if self._binary is None:
+            self._binary = to_binary(self.text)
+        return self._binary
+
+
+class ClientConnection:
+    """Соединение с собственной ограниченной очередью и задачей-писателем."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        event_id: int,
+        queue_size: int,
+        binary: bool = False,
+        directories: Optional[FrozenSet[int]] = None,
+    ):
+        self.websocket = websocket
+        self.event_id = event_id
+        self.binary = binary
+        # Подписка только на участников этих справочников (None - на всё мероприятие)
+        self.directories = directories
+        self.queue: asyncio.Queue[Union[str, bytes]] = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.slow = False
+        self.last_seen = asyncio.get_running_loop().time()
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, List[WebSocket]] = {}
+    def __init__(
+        self,
+        send_timeout: float = WS_SEND_TIMEOUT,
+        queue_size: int = WS_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        coalesce_window_ms: float = WS_COALESCE_WINDOW_MS,
+        coalesce_max_batch: int = WS_COALESCE_MAX_BATCH,
+        replay_buffer_size: int = WS_REPLAY_BUFFER_SIZE,
+        heartbeat_interval: float = WS_HEARTBEAT_INTERVAL,
+        idle_timeout: float = WS_IDLE_TIMEOUT,
+    ):
+        if overflow_policy not in ("drop", "disconnect"):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow_policy}")
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.coalesce_window = coalesce_window_ms / 1000
+        self.coalesce_max_batch = coalesce_max_batch
+        # event_id -> сообщения, ждущие закрытия окна склейки, и таймер окна
+        self._pending: dict[int, list[str]] = {}
+        self._flush_timers: dict[int, asyncio.TimerHandle] = {}
+        # Номера кадров действуют в пределах процесса: epoch отличает этот процесс
+        # (и его перезапуск) от других воркеров
+        self.epoch = uuid.uuid4().hex[:12]
+        self.replay_buffer_size = replay_buffer_size
+        self._seq: dict[int, int] = {}
+        self._history: dict[int, deque[Frame]] = {}
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._reaper: Optional[asyncio.Task] = None
+        # event_id -> {websocket: соединение}: подключение и отключение за O(1)
+        self.active_connections: dict[int, dict[WebSocket, ClientConnection]] = {}
+        # Ссылки на фоновые задачи закрытия, чтобы их не собрал GC
+        self._closing: set[asyncio.Task] = set()
+        self.sent_messages = 0
+        self.dropped_messages = 0
+        self.slow_clients = 0
+        self.disconnected_clients = 0
+        self.reaped_clients = 0
+        self.filtered_frames = 0
+        self.batches_sent = 0
+        self.coalesced_messages = 0
+        self.replayed_frames = 0
+        self.resyncs = 0
+        # До запуска межпроцессного брокера (и в тестах) рассылка идёт внутри процесса
+        self.broker: Broker = InProcessBroker(self.deliver)
+
+    async def start_broker(self, backend: str = BROADCAST_BACKEND) -> None:
+        broker = create_broker(self.deliver, backend)
+        await broker.start()
+        self.broker = broker
+
+    async def stop_broker(self) -> None:
+        broker, self.broker = self.broker, InProcessBroker(self.deliver)
+        await broker.stop()
 
-    async def connect(self, websocket: WebSocket, event_id: int):
+    def start_reaper(self) -> None:
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop_reaper(self) -> None:
+        if self._reaper is None:
+            return
+        self._reaper.cancel()
+        try:
+            await self._reaper
+        except asyncio.CancelledError:
+            pass
+        self._reaper = None
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            self.reap()
+
+    def reap(self) -> None:
+        """Закрывает молчащие дольше idle_timeout соединения, остальным отправляет ping."""
+        now = asyncio.get_running_loop().time()
+        ping = Frame(0, PING_MESSAGE)
+        for connections in list(self.active_connections.values()):
+            for conn in list(connections.values()):
+                if now - conn.last_seen > self.idle_timeout:
+                    self.reaped_clients += 1
+                    self._drop_client(conn, IDLE_CLIENT_CLOSE_CODE)
+                elif conn.queue.empty():
+                    # ping не нумеруется и не попадает в буфер досылки. Непустой очереди ping
+                    # не нужен: данные и так проверят соединение, а при переполнении ping
+                    # вытеснил бы настоящее сообщение
+                    conn.queue.put_nowait(ping.payload(conn.binary))
+
+    def touch(self, websocket: WebSocket, event_id: int) -> None:
+        """Отмечает входящее сообщение (pong или любое другое) от клиента."""
+        conn = self.active_connections.get(event_id, {}).get(websocket)
+        if conn is not None:
+            conn.last_seen = asyncio.get_running_loop().time()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        event_id: int,
+        since: Optional[int] = None,
+        epoch: Optional[str] = None,
+        encoding: str = "json",
+        directories: Optional[Iterable[int]] = None,
+    ):
+        """
+        Подключает клиента. Если передан since (seq и epoch последнего полученного кадра),
+        досылаются пропущенные кадры или resync_required, когда их уже нет в буфере
+        (или клиент пришёл из другого процесса). encoding=msgpack - бинарные кадры,
+        если сервер их поддерживает (иначе JSON). directories - получать new_registrations
+        и arrival_update только по участникам этих справочников.
+        """
         await websocket.accept()
-        if event_id not in self.active_connections:
-            self.active_connections[event_id] = []
-        self.active_connections[event_id].append(websocket)
+        binary = encoding == BINARY_ENCODING and BINARY_ENCODING_AVAILABLE
+        scope = frozenset(directories) if directories else None
+        conn = ClientConnection(websocket, event_id, self.queue_size, binary=binary, directories=scope)
+        if since is not None:
+            missed = self._missed_frames(event_id, since, epoch)
+            if missed is None:
+                self.resyncs += 1
+                conn.queue.put_nowait(self._resync_payload(event_id, binary))
+            else:
+                for frame in missed:
+                    if self._routed(frame, conn):
+                        self.replayed_frames += 1
+                        conn.queue.put_nowait(frame.payload(binary))
+        # Между досылкой и регистрацией нет await - новые кадры не обгонят досланные
+        conn.writer = asyncio.create_task(self._writer(conn))
+        self.active_connections.setdefault(event_id, {})[websocket] = conn
 
     def disconnect(self, websocket: WebSocket, event_id: int):
-        if event_id in self.active_connections:
-            if websocket in self.active_connections[event_id]:
-                self.active_connections[event_id].remove(websocket)
-            if not self.active_connections[event_id]:
-                del self.active_connections[event_id]
-
-    async def broadcast(self, message: str, event_id: int):
-        if event_id in self.active_connections:
-            active_sockets = self.active_connections[event_id][:]
-            for connection in active_sockets:
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    self.disconnect(connection, event_id)
+        connections = self.active_connections.get(event_id)
+        if connections is None:
+            return
+        conn = connections.pop(websocket, None)
+        if not connections:
+            del self.active_connections[event_id]
+        if conn is not None:
+            conn.closed = True
+            if conn.writer is not None and conn.writer is not asyncio.current_task():
+                conn.writer.cancel()
+
+    async def broadcast(self, message: Union[BroadcastMessage, str], event_id: int):
+        """
+        Публикует сообщение через брокер во все процессы; не ждёт отправки клиентам.
+        Типизированное сообщение кодируется здесь один раз.
+        """
+        if not isinstance(message, str):
+            message = encode_message(message)
+        await self.broker.publish(event_id, message)
+
+    def deliver(self, event_id: int, message: str) -> None:
+        """Раскладывает сообщение по очередям клиентов этого процесса (с учётом окна склейки)."""
+        # Кадры нумеруются и буферизуются даже без подключённых клиентов -
+        # именно их досылают устройствам после обрыва связи
+        if self.coalesce_window <= 0:
+            self._fan_out(event_id, message)
+            return
+        pending = self._pending.setdefault(event_id, [])
+        pending.append(message)
+        if len(pending) >= self.coalesce_max_batch:
+            self._flush(event_id)
+        elif event_id not in self._flush_timers:
+            self._flush_timers[event_id] = asyncio.get_running_loop().call_later(
+                self.coalesce_window, self._flush, event_id
+            )
+
+    def _flush(self, event_id: int) -> None:
+        timer = self._flush_timers.pop(event_id, None)
+        if timer is not None:
+            timer.cancel()
+        messages = self._pending.pop(event_id, None)
+        if not messages:
+            return
+        if len(messages) == 1:
+            self._fan_out(event_id, messages[0])
+            return
+        # Сообщения уже закодированы в JSON - склеиваем строки без повторной сериализации
+        self.batches_sent += 1
+        self.coalesced_messages += len(messages)
+        self._fan_out(event_id, '{"type": "batch", "messages": [' + ", ".join(messages) + "]}")
+
+    def _fan_out(self, event_id: int, message: str) -> None:
+        frame = self._stamp(event_id, message)
+        connections = self.active_connections.get(event_id)
+        if not connections:
+            return
+        # Все подписчики получают один и тот же объект str/bytes
+        for conn in list(connections.values()):
+            if self._routed(frame, conn):
+                self._enqueue(conn, frame.payload(conn.binary))
+
+    def _routed(self, frame: Frame, conn: ClientConnection) -> bool:
+        if conn.directories is None or frame.matches(conn.directories):
+            return True
+        self.filtered_frames += 1
+        return False
+
+    def _stamp(self, event_id: int, message: str) -> Frame:
+        """Добавляет в JSON-объект кадра поля seq/epoch и кладёт кадр в кольцевой буфер мероприятия."""
+        seq = self._seq.get(event_id, 0) + 1
+        self._seq[event_id] = seq
+        frame = Frame(seq, f'{{"seq": {seq}, "epoch": "{self.epoch}", ' + message[1:])
+        history = self._history.get(event_id)
+        if history is None:
+            history = self._history[event_id] = deque(maxlen=self.replay_buffer_size)
+        history.append(frame)
+        return frame
+
+    def _missed_frames(self, event_id: int, since: int, epoch: Optional[str]) -> Optional[list[Frame]]:
+        """Кадры после since или None, если клиенту нужна полная пересинхронизация."""
+        current = self._seq.get(event_id, 0)
+        if epoch != self.epoch or since < 0 or since > current:
+            return None
+        if since == current:
+            return []
+        history = self._history.get(event_id)
+        if not history or history[0].seq > since + 1:
+            return None
+        missed = [frame for frame in history if frame.seq > since]
+        # Досылка не должна сама переполнить очередь
+        if len(missed) > self.queue_size:
+            return None
+        return missed
+
+    def _resync_payload(self, event_id: int, binary: bool) -> Union[str, bytes]:
+        """Кадр resync_required с номером последнего кадра: клиент перечитывает состояние и продолжает с него."""
+        current = self._seq.get(event_id, 0)
+        resync = json.dumps({"type": "resync_required", "epoch": self.epoch, "seq": current})
+        return Frame(current, resync).payload(binary)
+
+    def _enqueue(self, conn: ClientConnection, message: Union[str, bytes]) -> None:
+        try:
+            conn.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        self._mark_slow(conn)
+        self.dropped_messages += conn.queue.qsize() + 1
+        if self.overflow_policy == "disconnect":
+            self.disconnected_clients += 1
+            self._drop_client(conn, SLOW_CLIENT_CLOSE_CODE)
+            return
+        # drop: у клиента уже дыра в номерах кадров - молча выбросить старые нельзя.
+        # Очередь заменяется одним resync_required, следующие кадры идут за ним по порядку
+        while not conn.queue.empty():
+            conn.queue.get_nowait()
+        self.resyncs += 1
+        conn.queue.put_nowait(self._resync_payload(conn.event_id, conn.binary))
+
+    def _mark_slow(self, conn: ClientConnection) -> None:
+        if not conn.slow:
+            conn.slow = True
+            self.slow_clients += 1
+
+    def _drop_client(self, conn: ClientConnection, code: int) -> None:
+        if conn.closed:
+            return
+        self.disconnect(conn.websocket, conn.event_id)
+        task = asyncio.create_task(self._close_socket(conn.websocket, code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close_socket(self, websocket: WebSocket, code: int) -> None:
+        try:
+            await asyncio.wait_for(websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+    async def _writer(self, conn: ClientConnection) -> None:
+        while not conn.closed:
+            message = await conn.queue.get()
+            try:
+                if isinstance(message, bytes):
+                    send = conn.websocket.send_bytes(message)
+                else:
+                    send = conn.websocket.send_text(message)
+                await asyncio.wait_for(send, self.send_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("WebSocket-клиент мероприятия %s не принял сообщение за %.1f с, отключаем",
+                               conn.event_id, self.send_timeout)
+                self._mark_slow(conn)
+                self.dropped_messages += conn.queue.qsize() + 1
+                self.disconnected_clients += 1
+                self._drop_client(conn, SLOW_CLIENT_CLOSE_CODE)
+                return
+            except Exception:
+                self.disconnect(conn.websocket, conn.event_id)
+                return
+            self.sent_messages += 1
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connection_count(),
+            "connections_by_event": {
+                event_id: len(connections) for event_id, connections in self.active_connections.items()
+            },
+            "queued_messages": sum(
+                conn.queue.qsize()
+                for connections in self.active_connections.values()
+                for conn in connections.values()
+            ),
+            "sent_messages": self.sent_messages,
+            "dropped_messages": self.dropped_messages,
+            "slow_clients": self.slow_clients,
+            "disconnected_clients": self.disconnected_clients,
+            "reaped_clients": self.reaped_clients,
+            "filtered_frames": self.filtered_frames,
+            "batches_sent": self.batches_sent,
+            "coalesced_messages": self.coalesced_messages,
+            "replayed_frames": self.replayed_frames,
+            "resyncs": self.resyncs,
+            "broker": self.broker.stats(),
+        }
+
 
 manager = ConnectionManager()
@@ -0,0 +1,116 @@
+"""
+Типизированные сообщения WebSocket-рассылки.
+
+Сообщение кодируется в JSON один раз (сериализатор pydantic-core) при публикации;
+дальше процессы и подписчики работают с готовой строкой. Клиенты, подключившиеся
+с ?encoding=msgpack, получают бинарные кадры MessagePack - их кадр тоже собирается
+один раз на всех подписчиков (если установлен пакет msgpack).
+"""
+import json
+from datetime import datetime
+from typing import List, Literal, Optional, Set, Union
+
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # бинарные кадры необязательны
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BINARY_ENCODING = "msgpack"
+BINARY_ENCODING_AVAILABLE = msgpack is not None
+
+
+class NewRegistrations(BaseModel):
+    type: Literal["new_registrations"] = "new_registrations"
+    registrar_id: int
+    registrar_name: str
+    ids: List[int]
+    participant_ids: List[int]
+    # Справочники участников сообщения: по ним кадр адресуется подписчикам справочников
+    # в любом процессе, без индекса в памяти
+    directory_ids: List[int] = []
+
+
+class ArrivalUpdate(BaseModel):
+    type: Literal["arrival_update"] = "arrival_update"
+    registration_id: int
+    participant_id: int
+    arrival_time: Optional[datetime] = None
+    action: Literal["set", "unset"]
+    directory_ids: List[int] = []
+
+
+class ArrivalItem(BaseModel):
+    registration_id: int
+    participant_id: int
+    arrival_time: Optional[datetime] = None
+
+
+class ReplayArrivalItem(ArrivalItem):
+    action: Literal["set", "unset"]
+
+
+class ArrivalBatchUpdate(BaseModel):
+    type: Literal["arrival_update"] = "arrival_update"
+    action: Literal["set", "unset", "replay"]
+    items: List[Union[ReplayArrivalItem, ArrivalItem]]
+    directory_ids: List[int] = []
+
+
+class DeletedRegistration(BaseModel):
+    type: Literal["deleted_registration"] = "deleted_registration"
+    registration_id: int
+    participant_id: int
+
+
+class StatsUpdate(BaseModel):
+    """Текущие счётчики мероприятия; рассылается после каждого их изменения."""
+    type: Literal["stats"] = "stats"
+    total_registrants: int
+    arrived_participants: int
+    # Номер последнего изменения журнала (change_feed), учтённого в счётчиках: кадр с
+    # меньшим номером, пришедший позже, устарел
+    change_seq: int
+
+
+BroadcastMessage = Union[NewRegistrations, ArrivalUpdate, ArrivalBatchUpdate, DeletedRegistration, StatsUpdate]
+
+
+def encode_message(message: BroadcastMessage) -> str:
+    return message.model_dump_json()
+
+
+def _loads(frame: str):
+    return orjson.loads(frame) if orjson is not None else json.loads(frame)
+
+
+# Сообщения, которые можно адресовать подписчикам по справочникам участников;
+# остальные (удаление, счётчики) получают все подписчики мероприятия
+ROUTABLE_TYPES = ("new_registrations", "arrival_update")
+
+
+def _collect_directory_ids(message: dict, ids: Set[int]) -> bool:
+    kind = message.get("type")
+    if kind == "batch":
+        return all(_collect_directory_ids(inner, ids) for inner in message["messages"])
+    if kind not in ROUTABLE_TYPES or "directory_ids" not in message:
+        return False
+    ids.update(message["directory_ids"])
+    return True
+
+
+def routed_directory_ids(frame: str) -> Optional[Set[int]]:
+    """Справочники участников, которых касается кадр; None - кадр адресован всем подписчикам."""
+    ids: Set[int] = set()
+    return ids if _collect_directory_ids(_loads(frame), ids) else None
+
+
+def to_binary(frame: str) -> bytes:
+    """Перекодирует готовый JSON-кадр в MessagePack."""
+    return msgpack.packb(_loads(frame), use_bin_type=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Boolean, DateTime, ForeignKey, Text, func
+from sqlalchemy import Integer, String, Boolean, DateTime, ForeignKey, Text, Index, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from datetime import datetime
 from enum import Enum
@@ -10,6 +10,12 @@ class SystemUserRole(str, Enum):
     REGISTRAR = "Registrar"
     PARTICIPANT = "Participant"
 
+class RegistrationChangeAction(str, Enum):
+    REGISTERED = "registered"
+    ARRIVAL_SET = "arrival_set"
+    ARRIVAL_UNSET = "arrival_unset"
+    DELETED = "deleted"
+
 class SystemUser(Base):
     __tablename__ = "system_users"
 
@@ -19,6 +25,8 @@ class SystemUser(Base):
     hashed_password: Mapped[str] = mapped_column(String)
     full_name: Mapped[str | None] = mapped_column(String, nullable=True)
     last_sync_time: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Увеличивается при смене роли или пароля: выданные ранее токены перестают действовать
+    token_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
 class Event(Base):
     __tablename__ = "events"
@@ -44,6 +52,10 @@ class Event(Base):
 
 class Participant(Base):
     __tablename__ = "participants"
+    __table_args__ = (
+        # Алфавитный порядок keyset-поиска: (full_name, id)
+        Index("ix_participants_full_name_id", "full_name", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     event_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("events.id"), index=True, nullable=True)
@@ -71,6 +83,13 @@ class Participant(Base):
 
 class Registration(Base):
     __tablename__ = "registrations"
+    __table_args__ = (
+        # Один участник - одна регистрация на мероприятие; заодно индекс для поиска по паре
+        Index("ix_registrations_event_id_participant_id", "event_id", "participant_id", unique=True),
+        Index("ix_registrations_participant_id", "participant_id"),
+        # Сортировка по времени прибытия с тай-брейком по участнику (keyset-поиск) и подсчёт прибывших
+        Index("ix_registrations_event_id_arrival_time", "event_id", "arrival_time", "participant_id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     event_id: Mapped[int] = mapped_column(Integer, ForeignKey("events.id"))
@@ -89,6 +108,48 @@ class Registration(Base):
     
     registered_by: Mapped["SystemUser"] = relationship("SystemUser")
 
+class RegistrationChange(Base):
+    """Журнал изменений регистраций. seq - курсор синхронизации планшетов (см. change_feed)."""
+    __tablename__ = "registration_changes"
+    __table_args__ = (
+        Index("ix_registration_changes_event_id_seq", "event_id", "seq", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("events.id", ondelete="CASCADE"))
+    # Номер изменения в мероприятии: растёт в порядке коммитов, а не выдачи id
+    seq: Mapped[int] = mapped_column(Integer)
+    registration_id: Mapped[int] = mapped_column(Integer)
+    participant_id: Mapped[int] = mapped_column(Integer)
+    action: Mapped[str] = mapped_column(String)
+    arrival_time: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+class EventChangeSequence(Base):
+    """Последний выданный номер журнала изменений мероприятия и текущие счётчики регистраций."""
+    __tablename__ = "event_change_sequences"
+
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    last_seq: Mapped[int] = mapped_column(Integer, default=0)
+    registered: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    arrived: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+class DeviceSession(Base):
+    """Долгоживущая сессия устройства (планшета). Refresh-токен хранится только как SHA-256."""
+    __tablename__ = "device_sessions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("system_users.id", ondelete="CASCADE"), index=True)
+    token_hash: Mapped[str] = mapped_column(String(64))
+    # Хэш предыдущего (уже заменённого) токена: его повторное предъявление - признак утечки
+    previous_token_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    # Версия токенов пользователя на момент входа: смена роли или пароля завершает сессию
+    token_version: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    last_used_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
@@ -116,6 +177,10 @@ class Directory(Base):
 
 class DirectoryMembership(Base):
     __tablename__ = "directory_memberships"
+    __table_args__ = (
+        # Справочники участника: адресация WebSocket-кадров и списки участников
+        Index("ix_directory_memberships_participant_id", "participant_id", "directory_id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     directory_id: Mapped[int] = mapped_column(Integer, ForeignKey("directories.id"))
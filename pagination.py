@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional
+
+from fastapi import HTTPException
+
+# Заголовок ответа с курсором следующей страницы (тело ответа остаётся списком)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(payload: dict[str, Any]) -> str:
+    """Непрозрачный токен курсора: base64url от компактного JSON."""
+    raw = json.dumps(payload, separators=(",", ":"), default=_json_default).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> dict[str, Any]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+    return payload
+
+
+def parse_cursor_datetime(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается в курсоре")
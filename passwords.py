@@ -0,0 +1,40 @@
+"""
+Хэширование паролей (bcrypt).
+
+bcrypt намеренно медленный, поэтому в асинхронных обработчиках хэш считается в
+отдельном пуле потоков ограниченного размера (bcrypt отпускает GIL) - цикл событий
+и WebSocket-рассылка не замирают, когда вся смена логинится одновременно.
+Стоимость задаётся BCRYPT_ROUNDS; хэши с другой стоимостью пересчитываются при
+следующем успешном входе.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """(пароль верен, новый хэш или None); новый хэш - если сменились схема или BCRYPT_ROUNDS."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
@@ -0,0 +1,147 @@
+import ipaddress
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from fastapi import Request
+
+
+class TokenBucketLimiter:
+    """
+    Ограничитель частоты «token bucket» в памяти процесса: у каждого ключа до burst
+    попыток подряд, дальше - refill_per_second попыток в секунду. Число отслеживаемых
+    ключей ограничено max_keys: вытесняются только полностью восстановившиеся корзины
+    (они ничем не отличаются от новых), ограниченные - никогда. Если места нет, новым
+    ключам отказывается, пока какая-нибудь корзина не восстановится.
+    """
+
+    def __init__(self, burst: float = 10.0, refill_per_second: float = 10 / 60, max_keys: int = 10000):
+        self.burst = burst
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        # ключ -> (токенов осталось, время последнего пересчёта)
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+        # Раньше этого момента восстановившихся корзин нет - вытеснять нечего
+        self._next_evictable = 0.0
+        self.allowed = 0
+        self.rejected = 0
+        self.overflow_rejected = 0
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.burst
+        tokens, updated_at = entry
+        return min(self.burst, tokens + (now - updated_at) * self.refill_per_second)
+
+    def _evict(self, now: float) -> None:
+        """Удаляет восстановившиеся корзины, пока ключей не станет меньше max_keys."""
+        if now < self._next_evictable:
+            return
+        next_evictable = float("inf")
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            if len(self._buckets) < self.max_keys:
+                return
+            full_at = updated_at + (self.burst - tokens) / self.refill_per_second
+            if full_at <= now:
+                del self._buckets[key]
+            else:
+                next_evictable = min(next_evictable, full_at)
+        if len(self._buckets) >= self.max_keys:
+            self._next_evictable = next_evictable
+
+    def acquire(self, key: Hashable) -> float:
+        """Списывает попытку. Возвращает 0, если она разрешена, иначе - сколько секунд ждать."""
+        now = time.monotonic()
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            self._evict(now)
+            if len(self._buckets) >= self.max_keys:
+                self.rejected += 1
+                self.overflow_rejected += 1
+                return max(self._next_evictable - now, 1 / self.refill_per_second)
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            return (1 - tokens) / self.refill_per_second
+        self.allowed += 1
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        return 0.0
+
+    def check(self, key: Hashable) -> float:
+        """Как acquire, но без списания: попытку спишет acquire, если она окажется неудачной."""
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        if tokens >= 1:
+            return 0.0
+        self.rejected += 1
+        return (1 - tokens) / self.refill_per_second
+
+    def clear(self) -> None:
+        self._buckets.clear()
+        self._next_evictable = 0.0
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "keys": len(self._buckets),
+            "throttled_keys": sum(1 for key in self._buckets if self._tokens(key, now) < 1),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "overflow_rejected": self.overflow_rejected,
+            "burst": self.burst,
+            "refill_per_minute": round(self.refill_per_second * 60, 3),
+        }
+
+
+def _parse_networks(value: str) -> list:
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+# Адреса обратных прокси (например, того, что отдаёт API под /api), которым можно верить
+# в X-Forwarded-For. Пусто - заголовок игнорируется, клиент - адрес TCP-соединения
+TRUSTED_PROXIES = _parse_networks(os.getenv("TRUSTED_PROXIES", ""))
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    Адрес клиента: если запрос пришёл от доверенного прокси, X-Forwarded-For читается
+    справа налево до первого адреса, не принадлежащего доверенным прокси.
+    """
+    address = request.client.host if request.client else None
+    if address is None or not _is_trusted(address):
+        return address
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not _is_trusted(hop):
+            break
+    return address
+
+
+# Попытки входа с одного адреса клиента (под любыми логинами): отклонённая попытка не
+# доходит ни до БД, ни до bcrypt. За одним NAT площадки входит вся смена регистраторов
+# разом, поэтому запас по умолчанию рассчитан на неё, а не на одного человека
+login_ip_limiter = TokenBucketLimiter(
+    burst=float(os.getenv("LOGIN_IP_RATE_BURST", "100")),
+    refill_per_second=float(os.getenv("LOGIN_IP_RATE_PER_MINUTE", "60")) / 60,
+    max_keys=int(os.getenv("LOGIN_RATE_MAX_KEYS", "10000")),
+)
+# Неудачные попытки входа под одним логином с одного адреса (ключ - (логин, адрес)):
+# подбор пароля упирается в лимит, а чужие ошибки не блокируют вход владельцу логина
+login_limiter = TokenBucketLimiter(
+    burst=float(os.getenv("LOGIN_RATE_BURST", "10")),
+    refill_per_second=float(os.getenv("LOGIN_RATE_PER_MINUTE", "10")) / 60,
+    max_keys=int(os.getenv("LOGIN_RATE_MAX_KEYS", "10000")),
+)
@@ -0,0 +1,331 @@
+"""
+Кэш состава (ростера) мероприятия в памяти процесса.
+
+Для каждого закэшированного мероприятия хранится компактная строка на регистрацию
+и битовая карта прибытия по слотам строк. Кэш прогревается при активации мероприятия
+(или при первом чтении), а обработчики регистрации/прибытия/отмены обновляют его
+инкрементально после коммита. Всё, что меняет данные участников, справочников или
+пользователей, просто сбрасывает затронутые ростеры.
+
+Кэш знает только об изменениях своего процесса, поэтому включён лишь при
+BROADCAST_BACKEND=memory (один воркер). При рассылке между воркерами список участников
+читается из БД.
+Поиск по подстроке всегда идёт в БД через индекс (search_index).
+"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import islice
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import models
+from broker import BROADCAST_BACKEND
+from bulk_registration import chunk_ids
+from search_index import participant_search_filter
+
+RosterChange = Callable[["EventRoster"], None]
+
+
+@dataclass(slots=True)
+class RosterEntry:
+    registration_id: int
+    participant_id: int
+    full_name: str
+    email: str
+    phone: Optional[str]
+    note: Optional[str]
+    registered_by_full_name: str
+    registered_by_role: str
+    directories: tuple[tuple[int, str], ...]
+    arrival_time: Optional[datetime]
+    slot: int = -1
+
+
+class EventRoster:
+    def __init__(self, event_id: int):
+        self.event_id = event_id
+        # participant_id -> строка; порядок вставки = порядок регистрации
+        self.entries: dict[int, RosterEntry] = {}
+        self._arrived = bytearray()
+        self._free_slots: list[int] = []
+        self._next_slot = 0
+        self.arrived_count = 0
+
+    def _is_arrived(self, slot: int) -> bool:
+        return bool(self._arrived[slot >> 3] & (1 << (slot & 7)))
+
+    def _set_arrived_bit(self, slot: int, arrived: bool) -> None:
+        if arrived == self._is_arrived(slot):
+            return
+        self._arrived[slot >> 3] ^= 1 << (slot & 7)
+        self.arrived_count += 1 if arrived else -1
+
+    def add(self, entry: RosterEntry) -> None:
+        self.remove(entry.participant_id)
+        if self._free_slots:
+            entry.slot = self._free_slots.pop()
+        else:
+            entry.slot = self._next_slot
+            self._next_slot += 1
+            if (entry.slot >> 3) >= len(self._arrived):
+                self._arrived.append(0)
+        self.entries[entry.participant_id] = entry
+        self._set_arrived_bit(entry.slot, entry.arrival_time is not None)
+
+    def remove(self, participant_id: int) -> None:
+        entry = self.entries.pop(participant_id, None)
+        if entry is None:
+            return
+        self._set_arrived_bit(entry.slot, False)
+        self._free_slots.append(entry.slot)
+
+    def set_arrival(self, participant_id: int, arrival_time: Optional[datetime]) -> None:
+        entry = self.entries.get(participant_id)
+        if entry is None:
+            return
+        entry.arrival_time = arrival_time
+        self._set_arrived_bit(entry.slot, arrival_time is not None)
+
+    @property
+    def total_count(self) -> int:
+        return len(self.entries)
+
+    def first(self, limit: int) -> list[RosterEntry]:
+        return list(islice(self.entries.values(), limit))
+
+
+def _roster_query():
+    return select(
+        models.Registration.id.label("registration_id"),
+        models.Participant.id.label("participant_id"),
+        models.Participant.full_name,
+        models.Participant.email,
+        models.Participant.phone,
+        models.Participant.note,
+        models.Registration.arrival_time,
+        models.SystemUser.username.label("registered_by_full_name"),
+        models.SystemUser.role.label("registered_by_role"),
+    ).join(
+        models.Registration,
+        models.Participant.id == models.Registration.participant_id,
+    ).join(
+        models.SystemUser,
+        models.Registration.registered_by_user_id == models.SystemUser.id,
+    )
+
+
+async def _load_directories(db: AsyncSession, condition) -> dict[int, list[tuple[int, str]]]:
+    stmt = select(
+        models.DirectoryMembership.participant_id,
+        models.Directory.id,
+        models.Directory.name,
+    ).join(
+        models.Directory,
+        models.DirectoryMembership.directory_id == models.Directory.id,
+    ).filter(condition)
+    dirs_map: dict[int, list[tuple[int, str]]] = {}
+    for p_id, d_id, d_name in (await db.execute(stmt)).all():
+        dirs_map.setdefault(p_id, []).append((d_id, d_name))
+    return dirs_map
+
+
+def _entries_from_rows(rows, dirs_map) -> Iterable[RosterEntry]:
+    for row in rows:
+        yield RosterEntry(
+            registration_id=row.registration_id,
+            participant_id=row.participant_id,
+            full_name=row.full_name,
+            email=row.email,
+            phone=row.phone,
+            note=row.note,
+            registered_by_full_name=row.registered_by_full_name,
+            registered_by_role=row.registered_by_role,
+            directories=tuple(dirs_map.get(row.participant_id, ())),
+            arrival_time=row.arrival_time,
+        )
+
+
+async def search_entries(db: AsyncSession, event_id: int, query: Optional[str], limit: int) -> list[RosterEntry]:
+    """Строки ростера из БД: поиск по индексу участников и при выключенном кэше."""
+    stmt = _roster_query().filter(models.Registration.event_id == event_id)
+    if query:
+        stmt = stmt.filter(participant_search_filter(db, query))
+    rows = (await db.execute(stmt.order_by(models.Registration.id).limit(limit))).all()
+    if not rows:
+        return []
+    participant_ids = [row.participant_id for row in rows]
+    dirs_map = await _load_directories(db, models.DirectoryMembership.participant_id.in_(participant_ids))
+    return list(_entries_from_rows(rows, dirs_map))
+
+
+class RosterCache:
+    def __init__(self, max_events: int = 4, enabled: bool = True):
+        self.max_events = max_events
+        self.enabled = enabled
+        self._rosters: OrderedDict[int, EventRoster] = OrderedDict()
+        # Загрузка одна на мероприятие: остальные читатели ждут её результат
+        self._loading: dict[int, asyncio.Future] = {}
+        # Изменения, закоммиченные во время загрузки, - применяются к снимку перед
+        # сохранением; None - снимок устарел целиком (сброс), в кэш он не попадёт
+        self._pending: dict[int, Optional[list[RosterChange]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _apply(self, event_id: int, change: RosterChange) -> None:
+        pending = self._pending.get(event_id)
+        if pending is not None:
+            pending.append(change)
+        roster = self._rosters.get(event_id)
+        if roster is not None:
+            change(roster)
+
+    def _discard_pending(self, event_id: Optional[int] = None) -> None:
+        for loading_id in self._pending:
+            if event_id is None or loading_id == event_id:
+                self._pending[loading_id] = None
+
+    def get(self, event_id: int) -> Optional[EventRoster]:
+        roster = self._rosters.get(event_id)
+        if roster is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._rosters.move_to_end(event_id)
+        return roster
+
+    async def load(self, db: AsyncSession, event_id: int) -> Optional[EventRoster]:
+        """Загружает ростер из БД; None - кэш выключен."""
+        if not self.enabled:
+            return None
+        while (future := self._loading.get(event_id)) is not None:
+            # None - загрузка не удалась или отменена: пробуем сами
+            roster = await asyncio.shield(future)
+            if roster is not None:
+                return roster
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[event_id] = future
+        self._pending[event_id] = []
+        roster = None
+        try:
+            stmt = _roster_query().filter(models.Registration.event_id == event_id).order_by(models.Registration.id)
+            rows = (await db.execute(stmt)).all()
+            registered = select(models.Registration.participant_id).filter(models.Registration.event_id == event_id)
+            dirs_map = await _load_directories(db, models.DirectoryMembership.participant_id.in_(registered))
+
+            roster = EventRoster(event_id)
+            for entry in _entries_from_rows(rows, dirs_map):
+                roster.add(entry)
+            self.loads += 1
+
+            pending = self._pending[event_id]
+            if pending is not None:
+                # Изменения применяются по порядку коммитов и идемпотентны, так что
+                # уже попавшие в снимок строки повторно ничего не портят
+                for change in pending:
+                    change(roster)
+                self._rosters[event_id] = roster
+                self._rosters.move_to_end(event_id)
+                while len(self._rosters) > self.max_events:
+                    self._rosters.popitem(last=False)
+        finally:
+            del self._loading[event_id]
+            del self._pending[event_id]
+            future.set_result(roster)
+        return roster
+
+    async def get_or_load(self, db: AsyncSession, event_id: int) -> Optional[EventRoster]:
+        if not self.enabled:
+            return None
+        roster = self.get(event_id)
+        if roster is None:
+            roster = await self.load(db, event_id)
+        return roster
+
+    async def load_new_entries(
+        self, db: AsyncSession, event_id: int, participant_ids: list[int]
+    ) -> Optional[list[RosterEntry]]:
+        """
+        Читает строки новых регистраций в текущей транзакции (до коммита), чтобы после
+        коммита добавить их в ростер без await. None - ростер мероприятия не закэширован.
+        """
+        if event_id not in self._rosters and event_id not in self._loading:
+            return None
+        entries: list[RosterEntry] = []
+        for chunk in chunk_ids(participant_ids):
+            stmt = _roster_query().filter(
+                models.Registration.event_id == event_id,
+                models.Registration.participant_id.in_(chunk),
+            ).order_by(models.Registration.id)
+            rows = (await db.execute(stmt)).all()
+            dirs_map = await _load_directories(db, models.DirectoryMembership.participant_id.in_(chunk))
+            entries.extend(_entries_from_rows(rows, dirs_map))
+        return entries
+
+    def add_entries(self, event_id: int, entries: Optional[list[RosterEntry]]) -> None:
+        """Добавляет в закэшированный ростер строки, прочитанные load_new_entries."""
+        if entries is None:
+            if event_id in self._rosters or event_id in self._loading:
+                # Ростер начали загружать, пока шла транзакция, - новых строк в нём может не быть
+                self.invalidate(event_id)
+            return
+
+        def add(roster: EventRoster) -> None:
+            for entry in entries:
+                roster.add(entry)
+
+        self._apply(event_id, add)
+
+    def set_arrivals(self, event_id: int, arrivals: Iterable[tuple[int, Optional[datetime]]]) -> None:
+        """arrivals: (participant_id, arrival_time или None)."""
+        arrivals = list(arrivals)
+
+        def set_arrivals(roster: EventRoster) -> None:
+            for participant_id, arrival_time in arrivals:
+                roster.set_arrival(participant_id, arrival_time)
+
+        self._apply(event_id, set_arrivals)
+
+    def remove_registration(self, event_id: int, participant_id: int) -> None:
+        self._apply(event_id, lambda roster: roster.remove(participant_id))
+
+    def invalidate(self, event_id: Optional[int] = None) -> None:
+        """Сбрасывает ростер мероприятия (или все ростеры, если event_id не задан)."""
+        if event_id is None:
+            self._rosters.clear()
+        else:
+            self._rosters.pop(event_id, None)
+        self._discard_pending(event_id)
+        self.invalidations += 1
+
+    def invalidate_participant(self, participant_id: int) -> None:
+        # Загружаемые сейчас снимки могли прочитать старые данные участника
+        self._discard_pending()
+        for event_id, roster in list(self._rosters.items()):
+            if participant_id in roster.entries:
+                self.invalidate(event_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "events": {
+                event_id: {"registered": r.total_count, "arrived": r.arrived_count}
+                for event_id, r in self._rosters.items()
+            },
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+        }
+
+
+roster_cache = RosterCache(enabled=BROADCAST_BACKEND == "memory")
+
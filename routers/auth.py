@@ -1,5 +1,6 @@
+import math
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -7,28 +8,82 @@ from sqlalchemy.future import select
 import models
 import schemas
 from database import get_db
-from dependencies import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from device_sessions import create_session, rotate_session, revoke_session
+from dependencies import create_access_token, token_claims, ACCESS_TOKEN_EXPIRE_MINUTES
+from passwords import verify_and_update_async
+from rate_limit import client_ip, login_ip_limiter, login_limiter
 
 router = APIRouter()
 
 @router.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db),
 ):
+    # Лимиты попыток проверяются до запроса к БД и bcrypt: сначала по адресу клиента,
+    # затем по неудачным попыткам этого логина с этого адреса. Лимит логина списывается
+    # только при неверном пароле, поэтому перебор с чужого адреса не блокирует владельца
+    address = client_ip(request)
+    account_key = (form_data.username, address)
+    retry_after = login_ip_limiter.acquire(address) or login_limiter.check(account_key)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много попыток входа. Повторите позже.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
     stmt = select(models.SystemUser).filter(models.SystemUser.username == form_data.username)
     result = await db.execute(stmt)
     user = result.scalars().first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = (
+        await verify_and_update_async(form_data.password, user.hashed_password) if user else (False, None)
+    )
+    if not verified:
+        login_limiter.acquire(account_key)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash is not None:
+        # Хэш с прежней стоимостью (BCRYPT_ROUNDS сменили) пересчитывается при входе
+        user.hashed_password = new_hash
+    refresh_token = await create_session(db, user)
+    await db.commit()
     
+    return _token_response(user, refresh_token)
+
+@router.post("/token/refresh", response_model=schemas.Token)
+async def refresh_access_token(
+    request: schemas.RefreshTokenRequest,
+    db: AsyncSession = Depends(get_db),
+):
+    """Новый access-токен по refresh-токену сессии устройства (без пароля); refresh-токен заменяется."""
+    rotated = await rotate_session(db, request.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Сессия устройства недействительна, требуется повторный вход.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, refresh_token = rotated
+    return _token_response(user, refresh_token)
+
+@router.post("/token/revoke", status_code=204)
+async def revoke_refresh_token(
+    request: schemas.RefreshTokenRequest,
+    db: AsyncSession = Depends(get_db),
+):
+    """Выход с устройства: завершает его сессию. Неизвестный токен не считается ошибкой."""
+    await revoke_session(db, request.refresh_token)
+    return None
+
+def _token_response(user: models.SystemUser, refresh_token: str) -> dict:
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username, "role": user.role},
+        data=token_claims(user),
         expires_delta=access_token_expires,
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
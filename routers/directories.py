@@ -8,6 +8,8 @@ import models
 import schemas
 from database import get_db
 from dependencies import get_current_operator_or_admin, get_current_registrar_or_admin
+from search_index import participant_search_filter
+from roster_cache import roster_cache
 
 router = APIRouter()
 
@@ -49,6 +51,7 @@ async def update_directory(
 
     await db.commit()
     await db.refresh(directory)
+    roster_cache.invalidate()
     return directory
 
 @router.delete("/directories/{directory_id}", status_code=204)
@@ -63,6 +66,7 @@ async def delete_directory(
 
     await db.delete(directory)
     await db.commit()
+    roster_cache.invalidate()
     return None
 
 @router.post("/directories/add-member/", response_model=schemas.DirectoryMembershipCreate)
@@ -84,6 +88,7 @@ async def add_member_to_directory(
     except Exception:
         raise HTTPException(status_code=400, detail="Участник уже состоит в этом справочнике.")
     
+    roster_cache.invalidate_participant(membership.participant_id)
     return membership
 
 @router.delete("/directories/{directory_id}/members/{participant_id}", status_code=204)
@@ -105,6 +110,7 @@ async def remove_member_from_directory(
 
     await db.delete(membership)
     await db.commit()
+    roster_cache.invalidate_participant(participant_id)
     return None
 
 @router.get("/directories/{directory_id}/members/", response_model=List[schemas.ParticipantRead])
@@ -129,12 +135,7 @@ async def list_directory_members(
     )
 
     if query:
-        search_pattern = f"%{query}%"
-        stmt = stmt.filter(
-            (models.Participant.full_name.ilike(search_pattern)) |
-            (models.Participant.email.ilike(search_pattern)) |
-            (models.Participant.note.ilike(search_pattern))
-        )
+        stmt = stmt.filter(participant_search_filter(db, query))
 
     stmt = stmt.limit(limit).offset(offset)
 
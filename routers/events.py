@@ -2,11 +2,12 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func  # Добавлен импорт func
 import models
 import schemas
 from database import get_db
 from dependencies import get_current_user, get_current_operator_or_admin, get_current_registrar_or_admin
+from change_feed import event_counts
+from roster_cache import roster_cache
 
 router = APIRouter()
 
@@ -46,25 +47,15 @@ async def get_active_event_stats(
     if not active_event:
         raise HTTPException(status_code=404, detail="Нет активного мероприятия")
 
-    # Считаем общее количество регистраций
-    stmt_total = select(func.count()).select_from(models.Registration).filter(
-        models.Registration.event_id == active_event.id
-    )
-    result_total = await db.execute(stmt_total)
-    total = result_total.scalar() or 0
-
-    # Считаем количество пришедших
-    stmt_arrived = select(func.count()).select_from(models.Registration).filter(
-        models.Registration.event_id == active_event.id,
-        models.Registration.arrival_time.is_not(None)
-    )
-    result_arrived = await db.execute(stmt_arrived)
-    arrived = result_arrived.scalar() or 0
+    # Счётчики - из БД, а не из ростера процесса: при нескольких воркерах он знает
+    # только о своих изменениях
+    total, arrived, change_seq = await event_counts(db, active_event.id)
 
     return schemas.EventStats(
         event_title=active_event.title,
         total_registrants=total,
-        arrived_participants=arrived
+        arrived_participants=arrived,
+        change_seq=change_seq,
     )
 
 @router.post("/events/", response_model=schemas.EventRead)
@@ -92,6 +83,8 @@ async def create_event(
     db.add(db_event)
     await db.commit()
     await db.refresh(db_event)
+    if db_event.registration_active:
+        await roster_cache.load(db, db_event.id)
     return db_event
 
 @router.put("/events/{event_id}", response_model=schemas.EventRead)
@@ -124,11 +117,15 @@ async def update_event(
     if "event_date" in update_data and update_data["event_date"] and update_data["event_date"].tzinfo is not None:
         update_data["event_date"] = update_data["event_date"].replace(tzinfo=None)
 
+    was_active = event.registration_active
     for key, value in update_data.items():
         setattr(event, key, value)
 
     await db.commit()
     await db.refresh(event)
+    if event.registration_active and not was_active:
+        # Прогреваем ростер к началу регистрации
+        await roster_cache.load(db, event.id)
     return event
 
 @router.get("/events/{event_id}", response_model=schemas.EventRead)
@@ -150,4 +147,5 @@ async def delete_event(
     
     await db.delete(event)
     await db.commit()
+    roster_cache.invalidate(event_id)
     return None
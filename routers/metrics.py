@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends
+
+import models
+from database import engine, read_engine
+from db_pool import pool_stats
+from dependencies import get_current_admin
+from dispatcher import dispatcher
+from idempotency import idempotency_store
+from manager import manager
+from rate_limit import login_ip_limiter, login_limiter
+from roster_cache import roster_cache
+from token_versions import token_versions
+from user_cache import user_cache
+
+router = APIRouter()
+
+@router.get("/metrics/")
+async def get_metrics(
+    admin_user: models.SystemUser = Depends(get_current_admin),
+):
+    """Внутренние счётчики процесса (кэши, хранилища) для диагностики."""
+    return {
+        "roster_cache": roster_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "token_versions": token_versions.stats(),
+        "login_limiter": login_limiter.stats(),
+        "login_ip_limiter": login_ip_limiter.stats(),
+        "database_pool": pool_stats(engine.sync_engine),
+        # Пул читателей есть только в профиле SQLITE_PROFILE=production
+        "database_read_pool": pool_stats(read_engine.sync_engine) if read_engine is not None else None,
+        "idempotency_store": {
+            "entries": len(idempotency_store),
+            "hits": idempotency_store.hits,
+            "misses": idempotency_store.misses,
+        },
+        "websocket": manager.stats(),
+        "dispatcher": dispatcher.stats(),
+    }
@@ -8,6 +8,10 @@ import models
 import schemas
 from database import get_db
 from dependencies import get_current_operator_or_admin, get_current_registrar_or_admin, participant_to_schema
+from change_feed import record_change, stats_snapshot
+from dispatcher import dispatcher
+from search_index import participant_search_filter
+from roster_cache import roster_cache
 
 router = APIRouter()
 
@@ -105,17 +109,12 @@ async def search_participants(
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
 ):
-    search_pattern = f"%{query}%"
     stmt = (
         select(models.Participant)
         .options(
             selectinload(models.Participant.directory_memberships).joinedload(models.DirectoryMembership.directory)
         )
-        .filter(
-            (models.Participant.full_name.ilike(search_pattern)) |
-            (models.Participant.email.ilike(search_pattern)) |
-            (models.Participant.note.ilike(search_pattern))
-        )
+        .filter(participant_search_filter(db, query))
         .limit(limit)
     )
     result = await db.execute(stmt)
@@ -153,6 +152,7 @@ async def update_participant(
 
     await db.commit()
     await db.refresh(participant)
+    roster_cache.invalidate_participant(participant_id)
     
     return participant
 
@@ -165,7 +165,28 @@ async def delete_participant(
     participant = await db.get(models.Participant, participant_id)
     if not participant:
         raise HTTPException(status_code=404, detail="Участник не найден")
-        
+
+    # Регистрации удаляются каскадно - фиксируем "надгробия" для курсорной синхронизации.
+    # Номера журнала берутся после удаления и по возрастанию event_id (см. change_feed)
+    stmt_regs = (
+        select(models.Registration.id, models.Registration.event_id, models.Registration.arrival_time)
+        .filter(models.Registration.participant_id == participant_id)
+        .order_by(models.Registration.event_id)
+        .with_for_update()
+    )
+    registrations = (await db.execute(stmt_regs)).all()
     await db.delete(participant)
+    await db.flush()
+    stats = {}
+    for reg_id, event_id, arrival_time in registrations:
+        await record_change(
+            db, event_id, models.RegistrationChangeAction.DELETED,
+            reg_id, participant_id, arrived=-1 if arrival_time else 0,
+        )
+        stats[event_id] = await stats_snapshot(db, event_id)
+
     await db.commit()
+    roster_cache.invalidate_participant(participant_id)
+    for event_id, event_stats in stats.items():
+        dispatcher.enqueue(event_id, event_stats)
     return None
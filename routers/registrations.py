@@ -1,23 +1,38 @@
-import json
-import io
 from typing import List, Optional
 from datetime import datetime, timezone, UTC
 
-from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Header, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload, selectinload
-from sqlalchemy import and_, or_, desc, asc, nulls_last
+from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, or_, desc, asc, nulls_last, exists, update, delete, bindparam
 
+import messages
 import models
 import schemas
 from database import get_db
 from dependencies import get_current_registrar_or_admin, get_current_operator_or_admin
-from manager import manager
+from dispatcher import dispatcher
+from change_feed import record_change, record_changes, fetch_changes, stats_snapshot
+from bulk_registration import bulk_register, chunk_ids
+from idempotency import idempotency_store, scoped_key
+from roster_cache import roster_cache, search_entries
+from search_index import participant_search_filter
+from stats_export import ExportFormat, MEDIA_TYPES, stream_event_stats
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, parse_cursor_datetime
 
 router = APIRouter()
 
+async def _store_last_sync_time(db: AsyncSession, user_id: int, server_time_naive: datetime) -> None:
+    # UPDATE по id: в режиме AUTH_MODE=claims current_user - не ORM-объект
+    await db.execute(
+        update(models.SystemUser)
+        .where(models.SystemUser.id == user_id)
+        .values(last_sync_time=server_time_naive)
+    )
+    await db.commit()
+
 @router.post("/events/{event_id}/sync/", response_model=schemas.SyncResponse)
 async def sync_registrations(
     event_id: int,
@@ -27,6 +42,9 @@ async def sync_registrations(
 ):
     # 1. Генерируем "наивное" время UTC для работы с БД (чтобы не было ошибки offset-naive vs aware)
     server_time_naive = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    if sync_req.cursor is not None:
+        return await _sync_by_cursor(event_id, sync_req, server_time_naive, db, current_user)
     
     # 2. Формируем запрос с selectinload для избежания MissingGreenlet при валидации
     stmt = (
@@ -61,178 +79,535 @@ async def sync_registrations(
         registrations_pydantic.append(schemas.RegistrationRead.model_validate(reg))
 
     # 4. Обновляем время пользователя (naive datetime!)
-    current_user.last_sync_time = server_time_naive
-    await db.commit()
+    await _store_last_sync_time(db, current_user.id, server_time_naive)
+
+    return schemas.SyncResponse(
+        new_registrations=registrations_pydantic,
+        server_time=server_time_naive,
+    )
+
+async def _sync_by_cursor(
+    event_id: int,
+    sync_req: schemas.SyncRequest,
+    server_time_naive: datetime,
+    db: AsyncSession,
+    current_user: models.SystemUser,
+) -> schemas.SyncResponse:
+    """
+    Курсорная синхронизация: клиент присылает номер последнего полученного изменения
+    и получает упорядоченные дельты после него (включая удаления-"надгробия").
+    """
+    changes, has_more = await fetch_changes(db, event_id, sync_req.cursor, sync_req.limit)
+
+    # Полные данные нужны только для новых регистраций, которые ещё существуют
+    registered_ids = {
+        c.registration_id for c in changes
+        if c.action == models.RegistrationChangeAction.REGISTERED.value
+    }
+    registrations_pydantic = []
+    if registered_ids:
+        stmt = (
+            select(models.Registration)
+            .options(selectinload(models.Registration.registered_by))
+            .filter(models.Registration.id.in_(registered_ids))
+            .order_by(models.Registration.id)
+        )
+        result = await db.execute(stmt)
+        registrations_pydantic = [
+            schemas.RegistrationRead.model_validate(reg) for reg in result.scalars().all()
+        ]
+
+    changes_pydantic = [
+        schemas.RegistrationChangeRead(
+            seq=c.seq,
+            action=c.action,
+            registration_id=c.registration_id,
+            participant_id=c.participant_id,
+            arrival_time=c.arrival_time,
+        )
+        for c in changes
+    ]
+
+    await _store_last_sync_time(db, current_user.id, server_time_naive)
 
     return schemas.SyncResponse(
         new_registrations=registrations_pydantic,
         server_time=server_time_naive,
+        changes=changes_pydantic,
+        cursor=changes[-1].seq if changes else sync_req.cursor,
+        has_more=has_more,
     )
 
+async def _arrived_before(db: AsyncSession, event_id: int, participant_ids: List[int]) -> set[int]:
+    """
+    Кто из участников уже отмечен прибывшим - по этому считается сдвиг счётчика прибывших.
+    Строки регистраций блокируются до коммита, чтобы одновременная отметка не сбила счётчик.
+    """
+    arrived: set[int] = set()
+    for chunk in chunk_ids(sorted(set(participant_ids))):
+        stmt = (
+            select(models.Registration.participant_id, models.Registration.arrival_time)
+            .filter(
+                models.Registration.event_id == event_id,
+                models.Registration.participant_id.in_(chunk),
+            )
+            .order_by(models.Registration.participant_id)
+            .with_for_update()
+        )
+        arrived.update(p_id for p_id, arrival_time in (await db.execute(stmt)).all() if arrival_time is not None)
+    return arrived
+
+async def _directory_ids(db: AsyncSession, participant_ids: List[int]) -> list[int]:
+    """Справочники участников - для адресации кадра подписчикам справочников."""
+    directory_ids: set[int] = set()
+    for chunk in chunk_ids(sorted(set(participant_ids))):
+        stmt = select(models.DirectoryMembership.directory_id).filter(
+            models.DirectoryMembership.participant_id.in_(chunk)
+        ).distinct()
+        directory_ids.update((await db.execute(stmt)).scalars().all())
+    return sorted(directory_ids)
+
 @router.post("/events/{event_id}/register/", response_model=List[schemas.RegistrationRead])
 async def register_users(
     event_id: int,
     participant_ids: Optional[List[int]] = Body(None),
     directory_id: Optional[int] = Body(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_operator_or_admin),
 ):
-    reg_user_id = current_user.id
-    reg_username = current_user.username
-    reg_role = current_user.role
-    reg_fullname = current_user.full_name
-
-    event = await db.get(models.Event, event_id)
-    if not event:
-        raise HTTPException(status_code=404, detail=f"Мероприятие {event_id} не найдено.")
+    cache_key = scoped_key("register", event_id, current_user.id, idempotency_key)
+    cached = await idempotency_store.begin(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        reg_user_id = current_user.id
+        reg_username = current_user.username
+        reg_role = current_user.role
+        reg_fullname = current_user.full_name
+
+        event = await db.get(models.Event, event_id)
+        if not event:
+            raise HTTPException(status_code=404, detail=f"Мероприятие {event_id} не найдено.")
     
-    if not event.registration_active:
-        raise HTTPException(status_code=403, detail="Регистрация закрыта.")
-
-    target_participant_ids = set(participant_ids or [])
-
-    if directory_id:
-        directory = await db.get(models.Directory, directory_id)
-        if not directory:
-            raise HTTPException(status_code=404, detail=f"Справочник {directory_id} не найден.")
-        
-        stmt_dir_members = select(models.DirectoryMembership.participant_id).filter(
-            models.DirectoryMembership.directory_id == directory_id
-        )
-        result_members = await db.execute(stmt_dir_members)
-        target_participant_ids.update(result_members.scalars().all())
-
-    if not target_participant_ids:
-        raise HTTPException(status_code=400, detail="Не указаны участники.")
-
-    stmt_existing = select(models.Registration.participant_id).filter(
-        models.Registration.event_id == event_id,
-        models.Registration.participant_id.in_(target_participant_ids)
-    )
-    result_existing = await db.execute(stmt_existing)
-    existing_ids = set(result_existing.scalars().all())
-
-    participants_to_register = target_participant_ids - existing_ids
-    successful_registrations: list[models.Registration] = []
-
-    for p_id in participants_to_register:
-        if not await db.get(models.Participant, p_id):
-            continue
-        
-        db_registration = models.Registration(
-            event_id=event_id,
-            participant_id=p_id,
-            registered_by_user_id=reg_user_id,
+        if not event.registration_active:
+            raise HTTPException(status_code=403, detail="Регистрация закрыта.")
+
+        if directory_id:
+            directory = await db.get(models.Directory, directory_id)
+            if not directory:
+                raise HTTPException(status_code=404, detail=f"Справочник {directory_id} не найден.")
+
+        if not participant_ids:
+            has_members = False
+            if directory_id:
+                stmt_members = select(
+                    exists().where(models.DirectoryMembership.directory_id == directory_id)
+                )
+                has_members = (await db.execute(stmt_members)).scalar()
+            if not has_members:
+                raise HTTPException(status_code=400, detail="Не указаны участники.")
+
+        successful_registrations = await bulk_register(
+            db,
+            event_id,
+            reg_user_id,
+            participant_ids=participant_ids or [],
+            directory_id=directory_id,
         )
-        db.add(db_registration)
-        successful_registrations.append(db_registration)
-
-    await db.commit()
-
-    response_data: list[dict] = []
-    for reg in successful_registrations:
-        await db.refresh(reg)
-        response_data.append(
-            {
-                "id": reg.id,
-                "event_id": reg.event_id,
-                "participant_id": reg.participant_id,
-                "registered_by_user_id": reg.registered_by_user_id,
-                "registration_time": reg.registration_time,
-                "arrival_time": reg.arrival_time,
-                "registered_by": {
-                    "id": reg_user_id,
-                    "username": reg_username,
-                    "full_name": reg_fullname,
-                    "role": reg_role,
-                },
-            }
+        # Строки для ростера читаются до коммита: после него ростер обновляется и сообщение
+        # ставится в очередь без await, чтобы не нарушить порядок рассылки
+        new_entries = await roster_cache.load_new_entries(
+            db, event_id, [reg.participant_id for reg in successful_registrations]
         )
+        stats = await stats_snapshot(db, event_id) if successful_registrations else None
+        directory_ids = await _directory_ids(db, [reg.participant_id for reg in successful_registrations])
+        await db.commit()
+        roster_cache.add_entries(event_id, new_entries)
+        if successful_registrations:
+            dispatcher.enqueue(event_id, messages.NewRegistrations(
+                registrar_id=reg_user_id,
+                registrar_name=reg_username,
+                ids=[r.id for r in successful_registrations],
+                participant_ids=[r.participant_id for r in successful_registrations],
+                directory_ids=directory_ids,
+            ))
+            dispatcher.enqueue(event_id, stats)
+
+        response_data: list[dict] = []
+        for reg in successful_registrations:
+            response_data.append(
+                {
+                    "id": reg.id,
+                    "event_id": event_id,
+                    "participant_id": reg.participant_id,
+                    "registered_by_user_id": reg_user_id,
+                    "registration_time": reg.registration_time,
+                    "arrival_time": None,
+                    "registered_by": {
+                        "id": reg_user_id,
+                        "username": reg_username,
+                        "full_name": reg_fullname,
+                        "role": reg_role,
+                    },
+                }
+            )
 
-    if successful_registrations:
-        notify_data = {
-            "type": "new_registrations",
-            "registrar_id": reg_user_id,
-            "registrar_name": reg_username,
-            "ids": [r.id for r in successful_registrations],
-            "participant_ids": [r.participant_id for r in successful_registrations],
-        }
-        await manager.broadcast(json.dumps(notify_data), event_id)
-
-    return response_data
+        idempotency_store.put(cache_key, response_data)
+        return response_data
+    finally:
+        idempotency_store.release(cache_key)
 
 @router.put("/events/{event_id}/participants/{participant_id}/arrival", response_model=schemas.RegistrationRead)
 async def set_participant_arrival(
     event_id: int,
     participant_id: int,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
 ):
-    stmt = (
-        select(models.Registration)
-        .filter(
-            models.Registration.event_id == event_id,
-            models.Registration.participant_id == participant_id,
+    cache_key = scoped_key(f"arrival_set:{participant_id}", event_id, current_user.id, idempotency_key)
+    cached = await idempotency_store.begin(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        # Сохраняем наивное UTC-время. UPDATE ... RETURNING - без гонки "прочитал-записал"
+        now_utc_naive = datetime.now(timezone.utc).replace(tzinfo=None)
+        was_arrived = bool(await _arrived_before(db, event_id, [participant_id]))
+        stmt = (
+            update(models.Registration)
+            .where(
+                models.Registration.event_id == event_id,
+                models.Registration.participant_id == participant_id,
+            )
+            .values(arrival_time=now_utc_naive)
+            .returning(models.Registration.id)
+            .execution_options(synchronize_session=False)
         )
-        .options(selectinload(models.Registration.registered_by))
-    )
-    result = await db.execute(stmt)
-    registration = result.scalars().first()
+        reg_id = (await db.execute(stmt)).scalar_one_or_none()
 
-    if not registration:
-        raise HTTPException(
-            status_code=404,
-            detail="Участник не зарегистрирован на это мероприятие",
-        )
+        if reg_id is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Участник не зарегистрирован на это мероприятие",
+            )
 
-    # Сохраняем наивное UTC-время
-    now_utc_naive = datetime.now(timezone.utc).replace(tzinfo=None)
-    registration.arrival_time = now_utc_naive
-    
-    await db.commit()
-    await db.refresh(registration)
-
-    notify_data = {
-        "type": "arrival_update",
-        "registration_id": registration.id,
-        "participant_id": participant_id,
-        "arrival_time": registration.arrival_time.isoformat(),
-        "action": "set",
-    }
-    await manager.broadcast(json.dumps(notify_data), event_id)
+        await record_change(
+            db, event_id, models.RegistrationChangeAction.ARRIVAL_SET,
+            reg_id, participant_id, now_utc_naive, arrived=0 if was_arrived else 1,
+        )
+        stats = await stats_snapshot(db, event_id)
+        directory_ids = await _directory_ids(db, [participant_id])
+        await db.commit()
+        dispatcher.enqueue(event_id, messages.ArrivalUpdate(
+            registration_id=reg_id,
+            participant_id=participant_id,
+            arrival_time=now_utc_naive,
+            action="set",
+            directory_ids=directory_ids,
+        ))
+        dispatcher.enqueue(event_id, stats)
+        roster_cache.set_arrivals(event_id, [(participant_id, now_utc_naive)])
+
+        stmt_reg = (
+            select(models.Registration)
+            .filter(models.Registration.id == reg_id)
+            .options(selectinload(models.Registration.registered_by))
+        )
+        registration = (await db.execute(stmt_reg)).scalars().one()
 
-    return registration
+        response = schemas.RegistrationRead.model_validate(registration)
+        idempotency_store.put(cache_key, response)
+        return response
+    finally:
+        idempotency_store.release(cache_key)
 
 @router.delete("/events/{event_id}/participants/{participant_id}/arrival", status_code=204)
 async def unset_participant_arrival(
     event_id: int,
     participant_id: int,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
 ):
-    stmt = select(models.Registration).filter(
-        models.Registration.event_id == event_id,
-        models.Registration.participant_id == participant_id
-    )
-    result = await db.execute(stmt)
-    registration = result.scalars().first()
+    cache_key = scoped_key(f"arrival_unset:{participant_id}", event_id, current_user.id, idempotency_key)
+    if await idempotency_store.begin(cache_key) is not None:
+        return None
+
+    try:
+        was_arrived = bool(await _arrived_before(db, event_id, [participant_id]))
+        stmt = (
+            update(models.Registration)
+            .where(
+                models.Registration.event_id == event_id,
+                models.Registration.participant_id == participant_id,
+            )
+            .values(arrival_time=None)
+            .returning(models.Registration.id)
+            .execution_options(synchronize_session=False)
+        )
+        reg_id = (await db.execute(stmt)).scalar_one_or_none()
 
-    if not registration:
-        raise HTTPException(status_code=404, detail="Регистрация не найдена.")
+        if reg_id is None:
+            raise HTTPException(status_code=404, detail="Регистрация не найдена.")
 
-    reg_id = registration.id
-    registration.arrival_time = None
-    await db.commit()
+        await record_change(
+            db, event_id, models.RegistrationChangeAction.ARRIVAL_UNSET,
+            reg_id, participant_id, arrived=-1 if was_arrived else 0,
+        )
+        stats = await stats_snapshot(db, event_id)
+        directory_ids = await _directory_ids(db, [participant_id])
+        await db.commit()
+        roster_cache.set_arrivals(event_id, [(participant_id, None)])
     
-    notify_data = {
-        "type": "arrival_update",
-        "registration_id": reg_id,
-        "participant_id": participant_id,
-        "arrival_time": None,
-        "action": "unset",
-    }
-    await manager.broadcast(json.dumps(notify_data), event_id)
-    return None
+        dispatcher.enqueue(event_id, messages.ArrivalUpdate(
+            registration_id=reg_id,
+            participant_id=participant_id,
+            arrival_time=None,
+            action="unset",
+            directory_ids=directory_ids,
+        ))
+        dispatcher.enqueue(event_id, stats)
+        idempotency_store.put(cache_key, True)
+        return None
+    finally:
+        idempotency_store.release(cache_key)
+
+@router.post("/events/{event_id}/arrivals/batch", response_model=List[schemas.ArrivalBatchResult])
+async def set_arrivals_batch(
+    event_id: int,
+    batch: schemas.ArrivalBatchRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
+):
+    """
+    Пакетная отметка (или снятие) прибытия для списка участников:
+    один UPDATE на пачку, один коммит и одно агрегированное уведомление arrival_update.
+    """
+    cache_key = scoped_key("arrivals_batch", event_id, current_user.id, idempotency_key)
+    cached = await idempotency_store.begin(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        set_arrival = batch.action == "set"
+        arrival_time = datetime.now(timezone.utc).replace(tzinfo=None) if set_arrival else None
+        requested_ids = list(dict.fromkeys(batch.participant_ids))
+        previously_arrived = await _arrived_before(db, event_id, requested_ids)
+
+        updated: dict[int, int] = {}
+        for chunk in chunk_ids(requested_ids):
+            stmt = (
+                update(models.Registration)
+                .where(
+                    models.Registration.event_id == event_id,
+                    models.Registration.participant_id.in_(chunk),
+                )
+                .values(arrival_time=arrival_time)
+                .returning(models.Registration.participant_id, models.Registration.id)
+                .execution_options(synchronize_session=False)
+            )
+            result = await db.execute(stmt)
+            updated.update(result.tuples().all())
+
+        action = (
+            models.RegistrationChangeAction.ARRIVAL_SET if set_arrival
+            else models.RegistrationChangeAction.ARRIVAL_UNSET
+        )
+        await record_changes(
+            db, event_id, action,
+            [(reg_id, p_id, arrival_time) for p_id, reg_id in updated.items()],
+            arrived=(len(updated) if set_arrival else 0) - len(previously_arrived),
+        )
+        stats = await stats_snapshot(db, event_id) if updated else None
+        directory_ids = await _directory_ids(db, list(updated))
+        await db.commit()
+        roster_cache.set_arrivals(event_id, [(p_id, arrival_time) for p_id in updated])
+
+        results = []
+        for p_id in requested_ids:
+            reg_id = updated.get(p_id)
+            if reg_id is None:
+                results.append(schemas.ArrivalBatchResult(participant_id=p_id, status="not_registered"))
+            else:
+                results.append(
+                    schemas.ArrivalBatchResult(
+                        participant_id=p_id,
+                        status="ok",
+                        registration_id=reg_id,
+                        arrival_time=arrival_time,
+                    )
+                )
+
+        if updated:
+            dispatcher.enqueue(event_id, messages.ArrivalBatchUpdate(
+                action=batch.action,
+                items=[
+                    messages.ArrivalItem(registration_id=reg_id, participant_id=p_id, arrival_time=arrival_time)
+                    for p_id, reg_id in updated.items()
+                ],
+                directory_ids=directory_ids,
+            ))
+            dispatcher.enqueue(event_id, stats)
+
+        idempotency_store.put(cache_key, results)
+        return results
+    finally:
+        idempotency_store.release(cache_key)
+
+@router.post("/events/{event_id}/arrivals/replay", response_model=List[schemas.ArrivalReplayResult])
+async def replay_arrivals(
+    event_id: int,
+    replay: schemas.ArrivalReplayRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
+):
+    """
+    Проигрывание офлайн-очереди планшета. Каждый элемент несёт свой Idempotency-Key
+    и время действия на устройстве. Уже обработанные ключи отвечаются из хранилища без
+    обращения к БД; новые применяются одной транзакцией в порядке client_time
+    (для участника побеждает последнее действие), с одним уведомлением на всю пачку.
+    """
+    now_utc_naive = datetime.now(timezone.utc).replace(tzinfo=None)
+    # Ключи резервируются в одном порядке во всех запросах - две пачки с общими ключами
+    # не ждут друг друга по кругу
+    cached_results: dict[str, schemas.ArrivalReplayResult] = {}
+    reserved: list[tuple] = []
+    try:
+        for key in sorted({item.idempotency_key for item in replay.items}):
+            cache_key = scoped_key("replay", event_id, current_user.id, key)
+            cached = await idempotency_store.begin(cache_key)
+            if cached is not None:
+                cached_results[key] = cached
+            else:
+                reserved.append(cache_key)
+        return await _apply_replay(db, event_id, current_user.id, replay, cached_results, now_utc_naive)
+    finally:
+        for cache_key in reserved:
+            idempotency_store.release(cache_key)
+
+async def _apply_replay(
+    db: AsyncSession,
+    event_id: int,
+    user_id: int,
+    replay: schemas.ArrivalReplayRequest,
+    cached_results: dict[str, schemas.ArrivalReplayResult],
+    now_utc_naive: datetime,
+) -> list[schemas.ArrivalReplayResult]:
+    results: dict[str, schemas.ArrivalReplayResult] = {}
+    fresh: list[schemas.ArrivalReplayItem] = []
+    for item in replay.items:
+        cached = cached_results.get(item.idempotency_key)
+        if cached is not None or item.idempotency_key in results:
+            original = cached or results[item.idempotency_key]
+            results.setdefault(item.idempotency_key, original.model_copy(update={"status": "duplicate"}))
+            continue
+        # Заглушка, чтобы повтор ключа внутри той же пачки тоже считался дублем
+        results[item.idempotency_key] = schemas.ArrivalReplayResult(
+            idempotency_key=item.idempotency_key,
+            participant_id=item.participant_id,
+            status="not_registered",
+        )
+        fresh.append(item)
+
+    if not fresh:
+        return [results[item.idempotency_key] for item in replay.items]
+
+    def _client_time(item: schemas.ArrivalReplayItem) -> datetime:
+        client_time = item.client_time
+        if client_time.tzinfo:
+            client_time = client_time.astimezone(timezone.utc).replace(tzinfo=None)
+        # Часы планшета могут спешить - будущее время не принимаем
+        return min(client_time, now_utc_naive)
+
+    # Итоговое состояние каждого участника - по последнему действию на устройстве
+    fresh.sort(key=_client_time)
+    final_state: dict[int, Optional[datetime]] = {}
+    for item in fresh:
+        final_state[item.participant_id] = _client_time(item) if item.action == "set" else None
+
+    # Строки блокируются до коммита: по прежнему состоянию считается сдвиг счётчика прибывших
+    registration_ids: dict[int, int] = {}
+    previously_arrived: set[int] = set()
+    for chunk in chunk_ids(sorted(final_state)):
+        stmt = (
+            select(models.Registration.participant_id, models.Registration.id, models.Registration.arrival_time)
+            .filter(
+                models.Registration.event_id == event_id,
+                models.Registration.participant_id.in_(chunk),
+            )
+            .order_by(models.Registration.participant_id)
+            .with_for_update()
+        )
+        for p_id, reg_id, arrival_time in (await db.execute(stmt)).all():
+            registration_ids[p_id] = reg_id
+            if arrival_time is not None:
+                previously_arrived.add(p_id)
+
+    if registration_ids:
+        registrations_table = models.Registration.__table__
+        stmt_update = (
+            update(registrations_table)
+            .where(
+                registrations_table.c.event_id == event_id,
+                registrations_table.c.participant_id == bindparam("b_participant_id"),
+            )
+            .values(arrival_time=bindparam("b_arrival_time"))
+        )
+        await db.execute(
+            stmt_update,
+            [
+                {"b_participant_id": p_id, "b_arrival_time": final_state[p_id]}
+                for p_id in registration_ids
+            ],
+        )
+        applied_set = [(reg_id, p_id, final_state[p_id]) for p_id, reg_id in registration_ids.items() if final_state[p_id]]
+        applied_unset = [(reg_id, p_id, None) for p_id, reg_id in registration_ids.items() if not final_state[p_id]]
+        await record_changes(
+            db, event_id, models.RegistrationChangeAction.ARRIVAL_SET, applied_set,
+            arrived=sum(p_id not in previously_arrived for _, p_id, _ in applied_set),
+        )
+        await record_changes(
+            db, event_id, models.RegistrationChangeAction.ARRIVAL_UNSET, applied_unset,
+            arrived=-sum(p_id in previously_arrived for _, p_id, _ in applied_unset),
+        )
+        stats = await stats_snapshot(db, event_id)
+        directory_ids = await _directory_ids(db, list(registration_ids))
+        await db.commit()
+        roster_cache.set_arrivals(event_id, [(p_id, final_state[p_id]) for p_id in registration_ids])
+
+    for item in fresh:
+        reg_id = registration_ids.get(item.participant_id)
+        if reg_id is not None:
+            results[item.idempotency_key] = schemas.ArrivalReplayResult(
+                idempotency_key=item.idempotency_key,
+                participant_id=item.participant_id,
+                status="ok",
+                registration_id=reg_id,
+                arrival_time=final_state[item.participant_id],
+            )
+        idempotency_store.put(scoped_key("replay", event_id, user_id, item.idempotency_key), results[item.idempotency_key])
+
+    if registration_ids:
+        dispatcher.enqueue(event_id, messages.ArrivalBatchUpdate(
+            action="replay",
+            items=[
+                messages.ReplayArrivalItem(
+                    registration_id=reg_id,
+                    participant_id=p_id,
+                    arrival_time=final_state[p_id],
+                    action="set" if final_state[p_id] else "unset",
+                )
+                for p_id, reg_id in registration_ids.items()
+            ],
+            directory_ids=directory_ids,
+        ))
+        dispatcher.enqueue(event_id, stats)
+
+    return [results[item.idempotency_key] for item in replay.items]
 
 @router.delete("/events/{event_id}/participants/{participant_id}", status_code=204)
 async def unregister_participant(
@@ -241,26 +616,34 @@ async def unregister_participant(
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_operator_or_admin),
 ):
-    stmt = select(models.Registration).filter(
-        models.Registration.event_id == event_id,
-        models.Registration.participant_id == participant_id
+    stmt = (
+        delete(models.Registration)
+        .where(
+            models.Registration.event_id == event_id,
+            models.Registration.participant_id == participant_id,
+        )
+        .returning(models.Registration.id, models.Registration.arrival_time)
+        .execution_options(synchronize_session=False)
     )
-    result = await db.execute(stmt)
-    registration = result.scalars().first()
+    deleted = (await db.execute(stmt)).first()
 
-    if not registration:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Регистрация не найдена.")
 
-    reg_id = registration.id
-    await db.delete(registration)
+    reg_id, arrival_time = deleted
+    await record_change(
+        db, event_id, models.RegistrationChangeAction.DELETED,
+        reg_id, participant_id, arrived=-1 if arrival_time else 0,
+    )
+    stats = await stats_snapshot(db, event_id)
     await db.commit()
+    roster_cache.remove_registration(event_id, participant_id)
 
-    notify_data = {
-        "type": "deleted_registration",
-        "registration_id": reg_id,
-        "participant_id": participant_id,
-    }
-    await manager.broadcast(json.dumps(notify_data), event_id)
+    dispatcher.enqueue(event_id, messages.DeletedRegistration(
+        registration_id=reg_id,
+        participant_id=participant_id,
+    ))
+    dispatcher.enqueue(event_id, stats)
     return None
 
 @router.get("/events/{event_id}/participants/", response_model=List[schemas.ParticipantStatus])
@@ -271,72 +654,73 @@ async def get_event_participants(
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
 ):
-    stmt = select(
-        models.Participant.id,
-        models.Participant.full_name,
-        models.Participant.email,
-        models.Participant.phone,
-        models.Participant.note,
-        models.Registration.arrival_time,
-        models.SystemUser.username.label("registered_by_full_name"),
-        models.SystemUser.role.label("registered_by_role"),
-    ).join(
-        models.Registration,
-        models.Participant.id == models.Registration.participant_id,
-    ).join(
-        models.SystemUser,
-        models.Registration.registered_by_user_id == models.SystemUser.id,
-    ).filter(models.Registration.event_id == event_id)
-
-    if query:
-        search_pattern = f"%{query}%"
-        stmt = stmt.filter(
-            or_(
-                models.Participant.full_name.ilike(search_pattern),
-                models.Participant.email.ilike(search_pattern),
-                models.Participant.note.ilike(search_pattern),
-            )
+    # Поиск идёт через индекс в БД; полный список активного мероприятия - из кэша
+    # процесса, если он включён (один воркер)
+    roster = None if query else await roster_cache.get_or_load(db, event_id)
+    entries = roster.first(limit) if roster is not None else await search_entries(db, event_id, query, limit)
+    return [
+        schemas.ParticipantStatus(
+            id=entry.participant_id,
+            full_name=entry.full_name,
+            email=entry.email,
+            phone=entry.phone,
+            note=entry.note,
+            directories=[{"id": d_id, "name": d_name} for d_id, d_name in entry.directories],
+            arrival_time=entry.arrival_time,
+            registered_by_full_name=entry.registered_by_full_name,
+            registered_by_role=entry.registered_by_role,
         )
-
-    stmt = stmt.limit(limit)
-    result = await db.execute(stmt)
-    rows = result.all()
-
-    participants_status = []
-    if rows:
-        participant_ids = [row.id for row in rows]
-        stmt_dirs = select(
-            models.DirectoryMembership.participant_id,
-            models.Directory.id.label("dir_id"),
-            models.Directory.name.label("dir_name"),
-        ).join(
-            models.Directory,
-            models.DirectoryMembership.directory_id == models.Directory.id,
-        ).filter(models.DirectoryMembership.participant_id.in_(participant_ids))
-        
-        dirs_result = await db.execute(stmt_dirs)
-        dirs_map = {}
-        for p_id, d_id, d_name in dirs_result.all():
-            if p_id not in dirs_map:
-                dirs_map[p_id] = []
-            dirs_map[p_id].append({"id": d_id, "name": d_name})
-
-        for row in rows:
-            p_dirs = dirs_map.get(row.id, [])
-            status_obj = schemas.ParticipantStatus(
-                id=row.id,
-                full_name=row.full_name,
-                email=row.email,
-                phone=row.phone,
-                note=row.note,
-                directories=p_dirs,
-                arrival_time=row.arrival_time,
-                registered_by_full_name=row.registered_by_full_name,
-                registered_by_role=row.registered_by_role,
-            )
-            participants_status.append(status_obj)
-
-    return participants_status
+        for entry in entries
+    ]
+
+def _decode_keyset(cursor: str, sort_by: str, filter_arrived: bool) -> tuple:
+    """Ключ последней строки (значение сортировки, id участника) из курсора."""
+    payload = decode_cursor(cursor)
+    key = payload.get("k")
+    if payload.get("s") != sort_by or payload.get("f") != filter_arrived:
+        raise HTTPException(status_code=400, detail="Курсор выдан для другой сортировки или фильтра.")
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[1], int):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации.")
+    last_value, last_id = key
+    if sort_by != "alphabet":
+        last_value = parse_cursor_datetime(last_value)
+    return last_value, last_id
+
+def _keyset_segments(sort_by: str, filter_arrived: bool, key: Optional[tuple]) -> list[tuple]:
+    """
+    Отрезки keyset-выборки: (условие, порядок). Каждый отрезок - диапазон одного индекса:
+    алфавит - participants (full_name, id); время прибытия - registrations
+    (event_id, arrival_time, participant_id), причём непустые arrival_time и пустые
+    (они идут в конце) - разные отрезки, иначе OR ... IS NULL не даёт взять диапазон индекса.
+    Условие "после ключа" дублируется границей по первой колонке - её индекс берёт как диапазон.
+    """
+    if sort_by == "alphabet":
+        name, tie = models.Participant.full_name, models.Participant.id
+        condition = None
+        if key is not None:
+            last_name, last_id = key
+            condition = and_(name >= last_name, or_(name > last_name, and_(name == last_name, tie > last_id)))
+        return [(condition, (name.asc(), tie.asc()))]
+
+    arrival, tie = models.Registration.arrival_time, models.Registration.participant_id
+    last_time, last_id = key if key is not None else (None, None)
+    segments = []
+    if key is None or last_time is not None:
+        condition = arrival.isnot(None)
+        if last_time is not None:
+            if sort_by == "arrival_time_desc":
+                bound, beyond = arrival <= last_time, arrival < last_time
+            else:
+                bound, beyond = arrival >= last_time, arrival > last_time
+            condition = and_(condition, bound, or_(beyond, and_(arrival == last_time, tie > last_id)))
+        order = desc(arrival) if sort_by == "arrival_time_desc" else asc(arrival)
+        segments.append((condition, (order, tie.asc())))
+    if not filter_arrived:
+        condition = arrival.is_(None)
+        if key is not None and last_time is None:
+            condition = and_(condition, tie > last_id)
+        segments.append((condition, (tie.asc(),)))
+    return segments
 
 @router.get(
     "/events/{event_id}/registrations/search",
@@ -344,6 +728,7 @@ async def get_event_participants(
 )
 async def search_event_registrations(
     event_id: int,
+    response: Response,
     query: Optional[str] = Query(None, description="Поиск по имени, email или примечанию"),
     sort_by: str = Query(
         "alphabet",
@@ -352,8 +737,11 @@ async def search_event_registrations(
     filter_arrived: bool = Query(
         False, description="Если True, вернет только тех, у кого есть дата прибытия"
     ),
-    page: int = Query(1, ge=1, description="Номер страницы"),
+    page: int = Query(1, ge=1, description="Номер страницы (если курсор не передан)"),
     limit: int = Query(50, ge=1, le=500, description="Количество записей на странице"),
+    cursor: Optional[str] = Query(
+        None, description="Курсор следующей страницы из заголовка X-Next-Cursor предыдущего ответа"
+    ),
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_registrar_or_admin),
 ):
@@ -376,34 +764,46 @@ async def search_event_registrations(
 
     # Поиск
     if query:
-        search_pattern = f"%{query}%"
-        stmt = stmt.filter(
-            or_(
-                models.Participant.full_name.ilike(search_pattern),
-                models.Participant.email.ilike(search_pattern),
-                models.Participant.note.ilike(search_pattern),
-            )
-        )
+        stmt = stmt.filter(participant_search_filter(db, query))
 
     # Фильтр только прибывших
     if filter_arrived:
         stmt = stmt.filter(models.Registration.arrival_time.isnot(None))
 
-    # Сортировка
-    if sort_by == "arrival_time_desc":
-        stmt = stmt.order_by(nulls_last(desc(models.Registration.arrival_time)))
-    elif sort_by == "arrival_time_asc":
-        stmt = stmt.order_by(nulls_last(asc(models.Registration.arrival_time)))
-    else:
+    # Сортировка (id участника - уникальный "тай-брейк" для стабильных страниц)
+    if sort_by not in ("arrival_time_desc", "arrival_time_asc"):
         # По умолчанию по алфавиту
-        stmt = stmt.order_by(models.Participant.full_name.asc())
-
-    # Пагинация
-    offset = (page - 1) * limit
-    stmt = stmt.offset(offset).limit(limit)
-
-    result = await db.execute(stmt)
-    rows = result.all()
+        sort_by = "alphabet"
+
+    if cursor or page == 1:
+        # Пагинация по курсору (keyset) - стоимость страницы не зависит от её номера.
+        # Отрезки читаются по очереди, пока страница (плюс одна строка) не наберётся
+        key = _decode_keyset(cursor, sort_by, filter_arrived) if cursor else None
+        rows = []
+        for condition, order in _keyset_segments(sort_by, filter_arrived, key):
+            segment = stmt if condition is None else stmt.filter(condition)
+            segment = segment.order_by(*order).limit(limit + 1 - len(rows))
+            rows.extend((await db.execute(segment)).all())
+            if len(rows) > limit:
+                break
+    else:
+        arrival = models.Registration.arrival_time
+        if sort_by == "arrival_time_desc":
+            stmt = stmt.order_by(nulls_last(desc(arrival)), models.Participant.id.asc())
+        elif sort_by == "arrival_time_asc":
+            stmt = stmt.order_by(nulls_last(asc(arrival)), models.Participant.id.asc())
+        else:
+            stmt = stmt.order_by(models.Participant.full_name.asc(), models.Participant.id.asc())
+        stmt = stmt.offset((page - 1) * limit).limit(limit + 1)
+        rows = (await db.execute(stmt)).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        sort_key = last.full_name if sort_by == "alphabet" else last.arrival_time
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            {"s": sort_by, "f": filter_arrived, "k": [sort_key, last.id]}
+        )
 
     participants_status = []
     if rows:
@@ -444,61 +844,19 @@ async def search_event_registrations(
 @router.get("/events/{event_id}/stats/file")
 async def download_event_stats_file(
     event_id: int,
+    format: ExportFormat = Query("txt", description="Формат выгрузки: txt, csv или jsonl"),
     db: AsyncSession = Depends(get_db),
     current_user: models.SystemUser = Depends(get_current_operator_or_admin),
 ):
-    # 1. Получаем мероприятие
     event = await db.get(models.Event, event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Мероприятие не найдено")
 
-    # 2. Загружаем регистрации с участниками
-    stmt = (
-        select(models.Registration)
-        .options(joinedload(models.Registration.participant))
-        .filter(models.Registration.event_id == event_id)
-    )
-    result = await db.execute(stmt)
-    registrations = result.scalars().all()
-
-    # 3. Сортировка: Сначала пришедшие (по времени), затем непришедшие
-    # Ключ сортировки: (False, дата) для пришедших, (True, None) для отсутствующих
-    sorted_regs = sorted(
-        registrations,
-        key=lambda r: (r.arrival_time is None, r.arrival_time)
-    )
-
-    # 4. Формирование текста
-    output = io.StringIO()
-    output.write(f"Статистика по мероприятию: {event.title}\n")
-    output.write(f"Дата формирования отчета: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n")
-    output.write("-" * 60 + "\n")
-    output.write(f"{'ФИО Участника':<40} | {'Время прихода'}\n")
-    output.write("-" * 60 + "\n")
-
-    arrived_count = 0
-    total_count = len(registrations)
-
-    for reg in sorted_regs:
-        arrival_str = "Не пришел"
-        if reg.arrival_time:
-            arrival_str = reg.arrival_time.strftime("%Y-%m-%d %H:%M:%S")
-            arrived_count += 1
-        
-        output.write(f"{reg.participant.full_name:<40} | {arrival_str}\n")
-
-    output.write("-" * 60 + "\n")
-    output.write(f"ИТОГО ЗАПЛАНИРОВАНО (всего регистраций): {total_count}\n")
-    output.write(f"ИТОГО РЕАЛЬНО ПРИШЛО: {arrived_count}\n")
-    
-    # 5. Подготовка к отправке
-    filename = f"stats_{event_id}_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
-    
-    def iterfile():
-        yield output.getvalue().encode("utf-8")
-
+    # Строки читаются серверным курсором и отдаются по мере чтения;
+    # сессия запроса живёт до конца отправки ответа
+    filename = f"stats_{event_id}_{datetime.now().strftime('%Y%m%d_%H%M')}.{format}"
     return StreamingResponse(
-        iterfile(),
-        media_type="text/plain",
+        stream_event_stats(db, event, format),
+        media_type=MEDIA_TYPES[format],
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
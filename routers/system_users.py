@@ -6,7 +6,12 @@ from sqlalchemy.future import select
 import models
 import schemas
 from database import get_db
-from dependencies import get_current_admin, get_password_hash
+from dependencies import get_current_admin
+from device_sessions import revoke_user_sessions
+from passwords import hash_password_async
+from roster_cache import roster_cache
+from token_versions import token_versions
+from user_cache import user_cache
 
 router = APIRouter()
 
@@ -21,7 +26,7 @@ async def create_system_user(
     if result.scalars().first():
         raise HTTPException(status_code=400, detail="Пользователь с таким именем уже существует.")
     
-    hashed_pwd = get_password_hash(user.password)
+    hashed_pwd = await hash_password_async(user.password)
     db_user = models.SystemUser(
         username=user.username,
         full_name=user.full_name,
@@ -31,6 +36,7 @@ async def create_system_user(
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
+    token_versions.set(db_user.id, db_user.token_version)
     return db_user
 
 @router.get("/system-users/", response_model=List[schemas.SystemUserRead])
@@ -53,17 +59,28 @@ async def update_system_user(
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
+    revoke_tokens = False
     if user_update.full_name is not None:
         user.full_name = user_update.full_name
     if user_update.role is not None:
         if user.id == admin_user.id and user_update.role != models.SystemUserRole.ADMIN:
              raise HTTPException(status_code=400, detail="Нельзя снять права администратора с самого себя.")
+        revoke_tokens = revoke_tokens or user.role != user_update.role
         user.role = user_update.role
     if user_update.password is not None:
-        user.hashed_password = get_password_hash(user_update.password)
+        user.hashed_password = await hash_password_async(user_update.password)
+        revoke_tokens = True
+    # Смена роли или пароля отзывает выданные токены и сессии устройств
+    if revoke_tokens:
+        user.token_version += 1
+        await revoke_user_sessions(db, user.id)
         
     await db.commit()
     await db.refresh(user)
+    token_versions.set(user.id, user.token_version)
+    user_cache.invalidate(user.username)
+    # В ростерах хранится логин и роль регистрировавшего
+    roster_cache.invalidate()
     return user
 
 @router.delete("/system-users/{user_id}", status_code=204)
@@ -79,6 +96,26 @@ async def delete_system_user(
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
         
+    username = user.username
+    # ON DELETE CASCADE в SQLite без PRAGMA foreign_keys не срабатывает
+    await revoke_user_sessions(db, user_id)
     await db.delete(user)
     await db.commit()
+    token_versions.discard(user_id)
+    user_cache.invalidate(username)
+    roster_cache.invalidate()
+    return None
+
+@router.delete("/system-users/{user_id}/sessions", status_code=204)
+async def revoke_system_user_sessions(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    admin_user: models.SystemUser = Depends(get_current_admin),
+):
+    """Завершает все сессии устройств пользователя (например, при потере планшета)."""
+    user = await db.get(models.SystemUser, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    await revoke_user_sessions(db, user_id)
+    await db.commit()
     return None
@@ -1,14 +1,24 @@
-from pydantic import BaseModel, EmailStr, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, ConfigDict, Field
+from typing import Optional, List, Literal
 from datetime import datetime
-from models import SystemUserRole
+from models import SystemUserRole, RegistrationChangeAction
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    # Для продления через /token/refresh без повторного ввода пароля
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
+    """Проверенные claims токена; в режиме AUTH_MODE=claims заменяет пользователя из БД."""
     username: Optional[str] = None
+    id: Optional[int] = None
+    role: Optional[SystemUserRole] = None
+    full_name: Optional[str] = None
+    token_version: int = 0
 
 class SystemUserBase(BaseModel):
     username: str
@@ -84,6 +94,7 @@ class EventStats(BaseModel):
     event_title: str
     total_registrants: int
     arrived_participants: int
+    change_seq: int = 0
 
 class DirectoryBase(BaseModel):
     name: str
@@ -121,6 +132,34 @@ class RegistrationRead(RegistrationBase):
     registered_by: Optional[SystemUserRead] = None
     model_config = ConfigDict(from_attributes=True)
 
+class ArrivalBatchRequest(BaseModel):
+    """Пакетная отметка прибытия: один запрос и один коммит на всю пачку."""
+    participant_ids: List[int] = Field(..., min_length=1, max_length=5000)
+    action: Literal["set", "unset"] = "set"
+
+class ArrivalBatchResult(BaseModel):
+    participant_id: int
+    status: Literal["ok", "not_registered"]
+    registration_id: Optional[int] = None
+    arrival_time: Optional[datetime] = None
+
+class ArrivalReplayItem(BaseModel):
+    """Действие из офлайн-очереди планшета."""
+    idempotency_key: str = Field(..., min_length=1, max_length=200)
+    participant_id: int
+    action: Literal["set", "unset"] = "set"
+    client_time: datetime
+
+class ArrivalReplayRequest(BaseModel):
+    items: List[ArrivalReplayItem] = Field(..., min_length=1, max_length=5000)
+
+class ArrivalReplayResult(BaseModel):
+    idempotency_key: str
+    participant_id: int
+    status: Literal["ok", "duplicate", "not_registered"]
+    registration_id: Optional[int] = None
+    arrival_time: Optional[datetime] = None
+
 class ParticipantStatus(ParticipantRead):
     arrival_time: Optional[datetime] = None
     registered_by_full_name: str
@@ -131,7 +170,22 @@ class ParticipantStatus(ParticipantRead):
 class SyncRequest(BaseModel):
     last_sync_time: Optional[datetime] = None
     known_registration_ids: Optional[List[int]] = None
+    # Курсорный режим: номер последнего полученного изменения (0 - с самого начала).
+    # Если задан, last_sync_time и known_registration_ids игнорируются.
+    cursor: Optional[int] = Field(None, ge=0)
+    limit: int = Field(1000, ge=1, le=5000)
+
+class RegistrationChangeRead(BaseModel):
+    seq: int
+    action: RegistrationChangeAction
+    registration_id: int
+    participant_id: int
+    arrival_time: Optional[datetime] = None
 
 class SyncResponse(BaseModel):
     new_registrations: List[RegistrationRead]
     server_time: datetime
+    # Заполняются только в курсорном режиме
+    changes: List[RegistrationChangeRead] = []
+    cursor: Optional[int] = None
+    has_more: bool = False
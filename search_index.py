@@ -0,0 +1,138 @@
+"""
+Индекс полнотекстового поиска участников.
+
+SQLite: внешняя (content=) FTS5-таблица participants_fts с токенизатором trigram,
+синхронизируется триггерами на participants при создании, изменении и удалении.
+PostgreSQL: GIN-индексы pg_trgm по full_name/email/note - их использует обычный ILIKE.
+Короткие запросы на SQLite сравниваются через функцию casefold(): встроенные LIKE и
+lower() SQLite не различают регистр только для ASCII, а trigram - и для кириллицы.
+"""
+import sqlite3
+from functools import lru_cache
+
+from sqlalchemy import Integer, column, event, func, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+FTS_TABLE = "participants_fts"
+# trigram-токенизатор не находит подстроки короче трёх символов - для них обычный ILIKE
+MIN_FTS_QUERY_LENGTH = 3
+
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "full_name, email, note, content='participants', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS participants_fts_ai AFTER INSERT ON participants BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, full_name, email, note) "
+    "VALUES (new.id, new.full_name, new.email, new.note); END",
+    "CREATE TRIGGER IF NOT EXISTS participants_fts_ad AFTER DELETE ON participants BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name, email, note) "
+    "VALUES ('delete', old.id, old.full_name, old.email, old.note); END",
+    "CREATE TRIGGER IF NOT EXISTS participants_fts_au AFTER UPDATE ON participants BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name, email, note) "
+    "VALUES ('delete', old.id, old.full_name, old.email, old.note); "
+    f"INSERT INTO {FTS_TABLE}(rowid, full_name, email, note) "
+    "VALUES (new.id, new.full_name, new.email, new.note); END",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_participants_full_name_trgm ON participants USING gin (full_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_participants_email_trgm ON participants USING gin (email gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_participants_note_trgm ON participants USING gin (note gin_trgm_ops)",
+]
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+@event.listens_for(Engine, "connect")
+def _register_casefold(dbapi_connection, connection_record):
+    # create_function есть только у соединений SQLite (sqlite3 и адаптер aiosqlite)
+    if hasattr(dbapi_connection, "create_function"):
+        dbapi_connection.create_function("casefold", 1, _casefold, deterministic=True)
+
+
+@lru_cache(maxsize=1)
+def sqlite_fts_available() -> bool:
+    """FTS5 с trigram есть не во всех сборках SQLite (нужна 3.34+ с ENABLE_FTS5)."""
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE probe USING fts5(x, tokenize='trigram')")
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    return True
+
+
+def ensure_search_index(connection) -> None:
+    """Идемпотентно создаёт индекс поиска (синхронное соединение: run_sync / Alembic)."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        if not sqlite_fts_available():
+            return
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        for ddl in _SQLITE_DDL:
+            connection.execute(text(ddl))
+        if not exists:
+            # Индекс для уже существующих участников
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for ddl in _POSTGRES_DDL:
+            connection.execute(text(ddl))
+
+
+def drop_search_index(connection) -> None:
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        for trigger in ("participants_fts_ai", "participants_fts_ad", "participants_fts_au"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    elif dialect == "postgresql":
+        for index in ("ix_participants_full_name_trgm", "ix_participants_email_trgm", "ix_participants_note_trgm"):
+            connection.execute(text(f"DROP INDEX IF EXISTS {index}"))
+
+
+@event.listens_for(models.Participant.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    ensure_search_index(connection)
+
+
+@event.listens_for(models.Participant.__table__, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    drop_search_index(connection)
+
+
+def participant_search_filter(db: AsyncSession, query: str):
+    """
+    Условие поиска участника по подстроке в ФИО, email или примечании.
+    На SQLite с FTS5 - выборка rowid из participants_fts, короткие запросы - LIKE по
+    casefold(); на PostgreSQL - ILIKE (его ускоряют trigram-индексы).
+    """
+    term = query.strip()
+    is_sqlite = db.get_bind().dialect.name == "sqlite"
+    if is_sqlite and len(term) >= MIN_FTS_QUERY_LENGTH and sqlite_fts_available():
+        # Фраза в кавычках: trigram ищет её как подстроку во всех колонках
+        fts_query = '"' + term.replace('"', '""') + '"'
+        matches = (
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query")
+            .bindparams(fts_query=fts_query)
+            .columns(column("rowid", Integer))
+        )
+        return models.Participant.id.in_(matches)
+
+    columns = (models.Participant.full_name, models.Participant.email, models.Participant.note)
+    if is_sqlite:
+        # Та же нормализация регистра, что и у trigram: "ив" находит "Иванов"
+        search_pattern = f"%{term.casefold()}%"
+        return or_(*(func.casefold(col).like(search_pattern) for col in columns))
+
+    search_pattern = f"%{term}%"
+    return or_(*(col.ilike(search_pattern) for col in columns))
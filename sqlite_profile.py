@@ -0,0 +1,83 @@
+"""
+Производственный профиль SQLite (SQLITE_PROFILE=production).
+
+- На каждом соединении: journal_mode=WAL (читатели не блокируют писателя и наоборот),
+  synchronous=NORMAL (fsync только на контрольных точках WAL), busy_timeout,
+  mmap_size и cache_size.
+- Запись идёт через единственное соединение: пул писателя размером 1 сам служит
+  очередью записи, поэтому конкурирующие транзакции ждут в пуле, а не получают
+  "database is locked". Чтение - через отдельный пул соединений только для чтения.
+- RoutingSession выбирает соединение: flush и INSERT/UPDATE/DELETE - писатель; после
+  первой записи вся транзакция остаётся на писателе, чтобы видеть свои изменения.
+"""
+from typing import Any, Optional
+
+from sqlalchemy import Delete, Insert, Update, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import Pool
+
+from db_settings import DatabaseSettings, engine_options
+
+
+def install_pragmas(engine: Engine, settings: DatabaseSettings, read_only: bool = False) -> None:
+    pragmas = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout * 1000)}",
+        f"PRAGMA mmap_size={settings.sqlite_mmap_size}",
+        # Отрицательное значение - размер в КиБ, а не в страницах
+        f"PRAGMA cache_size=-{settings.sqlite_cache_size_kib}",
+    ]
+    if read_only:
+        # Запись мимо писателя - ошибка, а не скрытая конкуренция за блокировку
+        pragmas.append("PRAGMA query_only=ON")
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def create_engines(
+    settings: DatabaseSettings, poolclass: Optional[type[Pool]] = None
+) -> tuple[AsyncEngine, AsyncEngine]:
+    """(писатель, читатели) для файла SQLite из settings."""
+    writer_options: dict[str, Any] = engine_options(settings, poolclass=poolclass)
+    writer_options.update(pool_size=1, max_overflow=0)
+    writer = create_async_engine(settings.url, **writer_options)
+    install_pragmas(writer.sync_engine, settings)
+
+    reader = create_async_engine(settings.url, **engine_options(settings, poolclass=poolclass))
+    install_pragmas(reader.sync_engine, settings, read_only=True)
+    return writer, reader
+
+
+class RoutingSession(Session):
+    """Сессия, отправляющая запись писателю, а чтение - в пул читателей."""
+
+    writer: Engine
+    reader: Engine
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("writing") or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self.info["writing"] = True
+            return self.writer
+        return self.reader
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_writer(session, transaction):
+    # Новая транзакция снова начинает с читателей
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+def routing_sessionmaker(writer: AsyncEngine, reader: AsyncEngine, **kwargs) -> sessionmaker:
+    routing_class = type(
+        "BoundRoutingSession", (RoutingSession,), {"writer": writer.sync_engine, "reader": reader.sync_engine}
+    )
+    return sessionmaker(class_=AsyncSession, sync_session_class=routing_class, **kwargs)
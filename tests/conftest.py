@@ -9,6 +9,8 @@ from sqlalchemy.pool import StaticPool
 # 1. Настройка окружения
 os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///:memory:"
 os.environ["SECRET_KEY"] = "TEST_SECRET"
+# Минимальная стоимость bcrypt: тестам не нужна стойкость хэшей
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
 
 # 2. Импорты
 from database import Base, get_db
@@ -31,6 +33,16 @@ TestingSessionLocal = sessionmaker(
 
 @pytest_asyncio.fixture(scope="function")
 async def db_session():
+    # Кэши процесса не должны переживать пересоздание тестовой БД
+    from roster_cache import roster_cache
+    from rate_limit import login_ip_limiter, login_limiter
+    from token_versions import token_versions
+    from user_cache import user_cache
+    roster_cache.invalidate()
+    user_cache.invalidate()
+    token_versions.clear()
+    login_limiter.clear()
+    login_ip_limiter.clear()
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     async with TestingSessionLocal() as session:
@@ -115,3 +127,15 @@ async def operator_token_headers(client):
 
     token = resp.json()["access_token"]
     return {"Authorization": f"Bearer {token}"}
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # Потоки соединений aiosqlite не фоновые: без закрытия соединений процесс не завершится
+    import asyncio
+    from database import engine as app_engine
+
+    async def _dispose():
+        await engine.dispose()
+        await app_engine.dispose()
+
+    asyncio.run(_dispose())
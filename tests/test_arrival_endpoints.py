@@ -180,4 +180,93 @@ async def test_arrival_errors(
     )
     assert resp_fail.status_code == 404
     assert "не зарегистрирован" in resp_fail.json()["detail"]
-    
\ No newline at end of file
+    
+@pytest.mark.asyncio
+async def test_registration_pair_is_unique(
+    db_session: AsyncSession,
+    setup_event_and_participant
+):
+    """Уникальный индекс (event_id, participant_id) не даёт создать дубль регистрации."""
+    from sqlalchemy.exc import IntegrityError
+    from models import Registration
+
+    event, participant = setup_event_and_participant
+    user = SystemUser(username="dup_checker", role=SystemUserRole.OPERATOR, hashed_password="-")
+    db_session.add(user)
+    await db_session.commit()
+
+    db_session.add(Registration(event_id=event.id, participant_id=participant.id, registered_by_user_id=user.id))
+    await db_session.commit()
+
+    db_session.add(Registration(event_id=event.id, participant_id=participant.id, registered_by_user_id=user.id))
+    with pytest.raises(IntegrityError):
+        await db_session.commit()
+    await db_session.rollback()
+
+@pytest.mark.asyncio
+async def test_arrivals_batch(
+    client: AsyncClient,
+    registrar_token: str,
+    operator_token: str,
+    db_session: AsyncSession,
+    setup_event_and_participant,
+    monkeypatch
+):
+    """Пакетная отметка прибытия: результаты по каждому ID и одно уведомление на пачку."""
+    import json
+    from manager import manager
+    from dispatcher import dispatcher
+
+    event, participant = setup_event_and_participant
+    second = Participant(full_name="Jane Roe", email="jane@example.com")
+    db_session.add(second)
+    await db_session.commit()
+    await db_session.refresh(second)
+
+    headers_op = {"Authorization": f"Bearer {operator_token}"}
+    headers_reg = {"Authorization": f"Bearer {registrar_token}"}
+    await client.post(
+        f"/events/{event.id}/register/",
+        json={"participant_ids": [participant.id, second.id]},
+        headers=headers_op
+    )
+    await dispatcher.join()
+
+    broadcasts = []
+
+    async def fake_publish(event_id, message):
+        broadcasts.append((json.loads(message), event_id))
+
+    monkeypatch.setattr(manager.broker, "publish", fake_publish)
+
+    resp = await client.post(
+        f"/events/{event.id}/arrivals/batch",
+        json={"participant_ids": [participant.id, second.id, 999999]},
+        headers=headers_reg
+    )
+    assert resp.status_code == 200
+    results = {r["participant_id"]: r for r in resp.json()}
+    assert results[participant.id]["status"] == "ok"
+    assert results[second.id]["arrival_time"] is not None
+    assert results[999999]["status"] == "not_registered"
+
+    # Рассылка идёт в фоне после ответа
+    await dispatcher.join()
+    # Одно сообщение на всю пачку и обновлённые счётчики
+    assert [m["type"] for m, _ in broadcasts] == ["arrival_update", "stats"]
+    assert broadcasts[1][0]["arrived_participants"] == 2
+    message, event_id = broadcasts[0]
+    assert event_id == event.id
+    assert message["type"] == "arrival_update"
+    assert {item["participant_id"] for item in message["items"]} == {participant.id, second.id}
+
+    # Снятие отметки пачкой
+    resp = await client.post(
+        f"/events/{event.id}/arrivals/batch",
+        json={"participant_ids": [participant.id, second.id], "action": "unset"},
+        headers=headers_reg
+    )
+    assert all(r["status"] == "ok" and r["arrival_time"] is None for r in resp.json())
+
+    resp_search = await client.get(f"/events/{event.id}/registrations/search", headers=headers_reg)
+    assert all(item["arrival_time"] is None for item in resp_search.json())
@@ -0,0 +1,304 @@
+import asyncio
+import json
+
+import pytest
+
+from manager import ConnectionManager
+
+
+class FakeWebSocket:
+    """Заглушка WebSocket: send_text ждёт delay секунд (медленный клиент)."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+def _msg(i: int) -> str:
+    return json.dumps({"type": "arrival_update", "n": i})
+
+
+def _payloads(ws: FakeWebSocket) -> list:
+    """Номера n полученных сообщений."""
+    return [frame["n"] for frame in map(json.loads, ws.sent)]
+
+
+@pytest.mark.asyncio
+async def test_broadcast_does_not_wait_for_slow_client():
+    mgr = ConnectionManager(send_timeout=0.05, queue_size=10, overflow_policy="drop")
+    fast, slow = FakeWebSocket(), FakeWebSocket(delay=1.0)
+    await mgr.connect(fast, 1)
+    await mgr.connect(slow, 1)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for i in range(3):
+        await mgr.broadcast(_msg(i), 1)
+    assert loop.time() - started < 0.05
+
+    await asyncio.sleep(0.2)
+    assert _payloads(fast) == [0, 1, 2]
+    # Медленный клиент не уложился в таймаут отправки и отключён
+    assert slow.sent == []
+    assert slow.close_code == 1013
+    assert mgr.connection_count() == 1
+    stats = mgr.stats()
+    assert stats["slow_clients"] == 1
+    assert stats["disconnected_clients"] == 1
+    assert stats["dropped_messages"] == 3
+    mgr.disconnect(fast, 1)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_overflow_policies():
+    # drop: при переполнении накопленное выбрасывается, а клиент получает resync_required
+    # с номером последнего кадра и продолжает с него
+    mgr = ConnectionManager(send_timeout=5, queue_size=2, overflow_policy="drop")
+    ws = FakeWebSocket(delay=0.05)
+    await mgr.connect(ws, 1)
+    for i in range(5):
+        await mgr.broadcast(_msg(i), 1)
+    await asyncio.sleep(0.3)
+    await mgr.broadcast(_msg(5), 1)
+    await asyncio.sleep(0.1)
+    frames = [json.loads(message) for message in ws.sent]
+    assert frames[0] == {"type": "resync_required", "epoch": mgr.epoch, "seq": 5}
+    assert [(frame["seq"], frame["n"]) for frame in frames[1:]] == [(6, 5)]
+    stats = mgr.stats()
+    # 0, 1, 2, 3, 4 и первый resync_required (его вытеснил второй)
+    assert stats["dropped_messages"] == 6
+    assert stats["resyncs"] == 2
+    assert stats["slow_clients"] == 1
+    mgr.disconnect(ws, 1)
+
+    # disconnect: переполнение очереди отключает клиента
+    mgr = ConnectionManager(send_timeout=5, queue_size=2, overflow_policy="disconnect")
+    ws = FakeWebSocket(delay=0.05)
+    await mgr.connect(ws, 1)
+    for i in range(5):
+        await mgr.broadcast(_msg(i), 1)
+    await asyncio.sleep(0.1)
+    assert ws.close_code == 1013
+    assert mgr.connection_count() == 0
+    assert mgr.stats()["disconnected_clients"] == 1
+
+
+@pytest.mark.asyncio
+async def test_broadcast_coalescing_window():
+    mgr = ConnectionManager(send_timeout=5, queue_size=10, coalesce_window_ms=50, coalesce_max_batch=3)
+    ws = FakeWebSocket()
+    await mgr.connect(ws, 1)
+    epoch = mgr.epoch
+
+    # Одиночное сообщение уходит как есть после закрытия окна
+    await mgr.broadcast(_msg(0), 1)
+    await asyncio.sleep(0.01)
+    assert ws.sent == []
+    await asyncio.sleep(0.1)
+    assert [json.loads(m) for m in ws.sent] == [{"seq": 1, "epoch": epoch, "type": "arrival_update", "n": 0}]
+
+    # Сообщения внутри окна склеиваются; при достижении max_batch кадр уходит досрочно
+    ws.sent.clear()
+    for i in range(4):
+        await mgr.broadcast(_msg(i), 1)
+    await asyncio.sleep(0.01)
+    assert len(ws.sent) == 1
+    await asyncio.sleep(0.1)
+    frames = [json.loads(m) for m in ws.sent]
+    assert frames[0] == {
+        "seq": 2, "epoch": epoch, "type": "batch", "messages": [{"type": "arrival_update", "n": i} for i in range(3)],
+    }
+    assert frames[1] == {"seq": 3, "epoch": epoch, "type": "arrival_update", "n": 3}
+    assert mgr.stats()["batches_sent"] == 1
+    assert mgr.stats()["coalesced_messages"] == 3
+    mgr.disconnect(ws, 1)
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_missed_frames():
+    mgr = ConnectionManager(send_timeout=5, queue_size=10, replay_buffer_size=4)
+    ws = FakeWebSocket()
+    await mgr.connect(ws, 1)
+    await mgr.broadcast(_msg(0), 1)
+    await mgr.broadcast(_msg(1), 1)
+    await asyncio.sleep(0.05)
+    frames = [json.loads(m) for m in ws.sent]
+    assert [(f["seq"], f["epoch"]) for f in frames] == [(1, mgr.epoch), (2, mgr.epoch)]
+    mgr.disconnect(ws, 1)
+
+    # Пока клиент был отключён, вышло ещё два кадра - их дошлют перед новыми
+    await mgr.broadcast(_msg(2), 1)
+    await mgr.broadcast(_msg(3), 1)
+    ws = FakeWebSocket()
+    await mgr.connect(ws, 1, since=2, epoch=mgr.epoch)
+    await mgr.broadcast(_msg(4), 1)
+    await asyncio.sleep(0.05)
+    frames = [json.loads(m) for m in ws.sent]
+    assert [(f["seq"], f["n"]) for f in frames] == [(3, 2), (4, 3), (5, 4)]
+    mgr.disconnect(ws, 1)
+
+    # Чужой epoch (другой воркер или перезапуск) и выпавший из буфера разрыв - resync
+    for since, epoch in ((2, "other"), (0, mgr.epoch)):
+        ws = FakeWebSocket()
+        await mgr.connect(ws, 1, since=since, epoch=epoch)
+        await asyncio.sleep(0.05)
+        assert [json.loads(m) for m in ws.sent] == [{"type": "resync_required", "epoch": mgr.epoch, "seq": 5}]
+        mgr.disconnect(ws, 1)
+    assert mgr.stats()["resyncs"] == 2
+    assert mgr.stats()["replayed_frames"] == 2
+
+
+@pytest.mark.asyncio
+async def test_typed_message_encoded_once_for_all_subscribers(monkeypatch):
+    import manager as manager_module
+    from messages import DeletedRegistration
+
+    mgr = ConnectionManager(send_timeout=5, queue_size=10)
+    # Без пакета msgpack запрос бинарных кадров откатывается на JSON
+    monkeypatch.setattr(manager_module, "BINARY_ENCODING_AVAILABLE", False)
+    first, second = FakeWebSocket(), FakeWebSocket()
+    await mgr.connect(first, 1)
+    await mgr.connect(second, 1, encoding="msgpack")
+    await mgr.broadcast(DeletedRegistration(registration_id=7, participant_id=3), 1)
+    await asyncio.sleep(0.05)
+    assert first.sent[0] is second.sent[0]
+    assert json.loads(first.sent[0]) == {
+        "seq": 1, "epoch": mgr.epoch, "type": "deleted_registration", "registration_id": 7, "participant_id": 3,
+    }
+    mgr.disconnect(first, 1)
+    mgr.disconnect(second, 1)
+
+
+@pytest.mark.asyncio
+async def test_directory_routing_uses_message_directories():
+    from messages import ArrivalUpdate, DeletedRegistration
+
+    # Индекса в памяти нет: справочники участников приходят в самом сообщении,
+    # поэтому кадр из другого воркера маршрутизируется так же
+    mgr = ConnectionManager(send_timeout=5, queue_size=10)
+    scoped, everyone = FakeWebSocket(), FakeWebSocket()
+    await mgr.connect(scoped, 1, directories=[10])
+    await mgr.connect(everyone, 1)
+    await mgr.broadcast(ArrivalUpdate(registration_id=1, participant_id=2, action="set", directory_ids=[20]), 1)
+    await mgr.broadcast(ArrivalUpdate(registration_id=3, participant_id=4, action="set", directory_ids=[10, 20]), 1)
+    await mgr.broadcast('{"type": "arrival_update", "participant_id": 5}', 1)
+    await mgr.broadcast(DeletedRegistration(registration_id=1, participant_id=2), 1)
+    await asyncio.sleep(0.05)
+
+    def seqs(ws):
+        return [frame["seq"] for frame in map(json.loads, ws.sent)]
+
+    assert seqs(everyone) == [1, 2, 3, 4]
+    # Без directory_ids кадр доставляется всем; удаление - тоже всем
+    assert seqs(scoped) == [2, 3, 4]
+    assert mgr.stats()["filtered_frames"] == 1
+    mgr.disconnect(scoped, 1)
+    mgr.disconnect(everyone, 1)
+
+
+@pytest.mark.asyncio
+async def test_binary_frames():
+    msgpack = pytest.importorskip("msgpack")
+    from messages import ArrivalUpdate
+
+    class BinaryWebSocket(FakeWebSocket):
+        async def send_bytes(self, data: bytes):
+            self.sent.append(data)
+
+    mgr = ConnectionManager(send_timeout=5, queue_size=10)
+    first, second = BinaryWebSocket(), BinaryWebSocket()
+    await mgr.connect(first, 1, encoding="msgpack")
+    await mgr.connect(second, 1, encoding="msgpack")
+    await mgr.broadcast(ArrivalUpdate(registration_id=1, participant_id=2, action="unset"), 1)
+    await asyncio.sleep(0.05)
+    assert first.sent[0] is second.sent[0]
+    assert msgpack.unpackb(first.sent[0])["type"] == "arrival_update"
+    mgr.disconnect(first, 1)
+    mgr.disconnect(second, 1)
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_reaps_idle_connections():
+    mgr = ConnectionManager(send_timeout=5, queue_size=10, heartbeat_interval=0.05, idle_timeout=0.12)
+    alive, dead = FakeWebSocket(), FakeWebSocket()
+    await mgr.connect(alive, 1)
+    await mgr.connect(dead, 1)
+    await mgr.connect(FakeWebSocket(), 2)
+    assert mgr.stats()["connections_by_event"] == {1: 2, 2: 1}
+
+    mgr.start_reaper()
+    # Живой клиент отвечает на ping, второй молчит (полуоткрытое соединение)
+    for _ in range(6):
+        await asyncio.sleep(0.05)
+        mgr.touch(alive, 1)
+    await mgr.stop_reaper()
+
+    assert {"type": "ping"} in [json.loads(m) for m in alive.sent]
+    assert alive.close_code is None
+    assert dead.close_code == 1001
+    assert mgr.stats()["connections_by_event"] == {1: 1}
+    assert mgr.stats()["reaped_clients"] == 2
+    mgr.disconnect(alive, 1)
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_does_not_displace_queued_data():
+    mgr = ConnectionManager(send_timeout=5, queue_size=3, overflow_policy="drop")
+    ws = FakeWebSocket(delay=0.2)
+    await mgr.connect(ws, 1)
+    # Одно сообщение уже отправляется, три ждут в заполненной очереди
+    for i in range(4):
+        await mgr.broadcast(_msg(i), 1)
+        await asyncio.sleep(0)
+
+    # Очередь занята данными: ping не ставится и ничего не вытесняет
+    mgr.reap()
+    stats = mgr.stats()
+    assert stats["dropped_messages"] == 0
+    assert stats["slow_clients"] == 0
+
+    await asyncio.sleep(1)
+    assert _payloads(ws) == [0, 1, 2, 3]
+    mgr.disconnect(ws, 1)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_sends_in_order_off_request_path(monkeypatch):
+    import dispatcher as dispatcher_module
+    from dispatcher import BroadcastDispatcher
+
+    sent = []
+
+    async def slow_broadcast(message, event_id):
+        await asyncio.sleep(0.01)
+        sent.append((event_id, message))
+
+    monkeypatch.setattr(dispatcher_module.manager, "broadcast", slow_broadcast)
+    disp = BroadcastDispatcher(max_size=3)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for i in range(4):
+        disp.enqueue(1, _msg(i))
+    # Постановка в очередь не ждёт рассылки; лишнее сверх лимита отброшено
+    assert loop.time() - started < 0.01
+    stats = disp.stats()
+    assert stats["enqueued"] == 3 and stats["dropped"] == 1 and stats["depth"] == 3
+
+    await disp.join()
+    assert [json.loads(m)["n"] for _, m in sent] == [0, 1, 2]
+    stats = disp.stats()
+    assert stats["dispatched"] == 3 and stats["depth"] == 0
+    assert stats["max_lag_ms"] >= 10
+    await disp.stop()
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Воркер: поднимает UnixSocketBroker и выполняет команды из stdin
+WORKER = r"""
+import asyncio, json, sys
+from broker import UnixSocketBroker
+
+async def main(path, name):
+    received = []
+    broker = UnixSocketBroker(lambda event_id, message: received.append(message), path=path)
+    await broker.start()
+    loop = asyncio.get_running_loop()
+    print(json.dumps({"ready": broker.role}), flush=True)
+    while True:
+        line = (await loop.run_in_executor(None, sys.stdin.readline)).split()
+        if not line or line[0] == "exit":
+            break
+        if line[0] == "role":
+            print(json.dumps({"role": broker.role}), flush=True)
+        elif line[0] == "go":
+            tag, expected = line[1], int(line[2])
+            await broker.publish(1, f"{name}-{tag}")
+            for _ in range(100):
+                if sum(m.endswith("-" + tag) for m in received) >= expected:
+                    break
+                await asyncio.sleep(0.05)
+            tagged = [m for m in received if m.endswith("-" + tag)]
+            print(json.dumps({"received": sorted(tagged), "order": tagged}), flush=True)
+    await broker.stop()
+
+asyncio.run(main(sys.argv[1], sys.argv[2]))
+"""
+
+
+def _command(proc, line):
+    proc.stdin.write(line + "\n")
+    proc.stdin.flush()
+    return json.loads(proc.stdout.readline())
+
+
+def test_unix_broker_fans_out_across_processes(tmp_path):
+    path = str(tmp_path / "broadcast.sock")
+    env = dict(os.environ, DATABASE_URL="sqlite+aiosqlite:///:memory:")
+    names = ["w0", "w1", "w2"]
+    procs = {
+        name: subprocess.Popen(
+            [sys.executable, "-c", WORKER, path, name],
+            cwd=REPO_ROOT, env=env, text=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        for name in names
+    }
+    try:
+        roles = {name: json.loads(proc.stdout.readline())["ready"] for name, proc in procs.items()}
+        assert sorted(roles.values()) == ["client", "client", "hub"]
+
+        # Каждое сообщение доходит до всех процессов, включая отправителя
+        for proc in procs.values():
+            proc.stdin.write("go r1 3\n")
+            proc.stdin.flush()
+        orders = []
+        for proc in procs.values():
+            result = json.loads(proc.stdout.readline())
+            assert result["received"] == ["w0-r1", "w1-r1", "w2-r1"]
+            orders.append(result["order"])
+        # Порядок задаёт хаб, и он одинаков во всех процессах
+        assert all(order == orders[0] for order in orders)
+
+        # Падение хаба: его место занимает один из оставшихся процессов
+        hub = next(name for name, role in roles.items() if role == "hub")
+        procs.pop(hub).kill()
+        for _ in range(50):
+            if sorted(_command(proc, "role")["role"] or "" for proc in procs.values()) == ["client", "hub"]:
+                break
+            time.sleep(0.1)
+        else:
+            pytest.fail("Ретранслятор не восстановился после падения хаба")
+
+        for proc in procs.values():
+            proc.stdin.write("go r2 2\n")
+            proc.stdin.flush()
+        expected = sorted(f"{name}-r2" for name in procs)
+        for proc in procs.values():
+            assert json.loads(proc.stdout.readline())["received"] == expected
+    finally:
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.stdin.write("exit\n")
+                proc.stdin.flush()
+        for proc in procs.values():
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def test_incomplete_broker_backend_fails_on_creation():
+    from broker import Broker
+
+    class NoPublish(Broker):
+        async def start(self) -> None:
+            pass
+
+        async def stop(self) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        NoPublish(lambda event_id, message: None)
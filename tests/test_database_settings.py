@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from db_pool import InstrumentedAsyncQueuePool, instrument_engine, pool_stats
+from db_settings import DatabaseSettings, engine_options
+
+
+def test_settings_from_env(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "postgresql+asyncpg://u:p@db/app")
+    monkeypatch.setenv("DB_ECHO", "true")
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "15000")
+    settings = DatabaseSettings.from_env()
+    assert settings.echo is True and settings.pool_size == 20
+
+    options = engine_options(settings)
+    assert options["pool_size"] == 20 and options["pool_pre_ping"] is True
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "15000"}
+
+    # SQLite в памяти: без параметров пула, но с таймаутом блокировки
+    options = engine_options(DatabaseSettings(url="sqlite+aiosqlite:///:memory:"))
+    assert "pool_size" not in options
+    assert options["connect_args"] == {"check_same_thread": False, "timeout": 5.0}
+    assert options["echo"] is False
+
+
+@pytest.mark.asyncio
+async def test_instrumented_pool_metrics(tmp_path):
+    settings = DatabaseSettings(
+        url=f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0, pool_timeout=0.2,
+    )
+    engine = create_async_engine(settings.url, **engine_options(settings, poolclass=InstrumentedAsyncQueuePool))
+    instrument_engine(engine.sync_engine)
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            stats = pool_stats(engine.sync_engine)
+            assert stats["checked_out"] == 1 and stats["overflow"] == 0
+            # Пул исчерпан: второе соединение ждёт pool_timeout и получает ошибку
+            with pytest.raises(exc.TimeoutError):
+                async with engine.connect() as second:
+                    await second.execute(text("SELECT 1"))
+
+        stats = pool_stats(engine.sync_engine)
+        assert stats["class"] == "InstrumentedAsyncQueuePool"
+        assert stats["checked_out"] == 0
+        assert stats["timeouts"] == 1 and stats["connects"] == 1
+        assert stats["waits"] == 2
+        assert stats["max_wait_ms"] >= 150
+        assert stats["wait_histogram"]["<=500ms"] == 1
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_production_profile(tmp_path, db_session):
+    """WAL и прагмы на соединениях, запись через одного писателя, API работает поверх маршрутизации."""
+    from httpx import AsyncClient, ASGITransport
+
+    from database import Base, get_db
+    from dispatcher import dispatcher
+    from main import app
+    from models import SystemUser, SystemUserRole
+    from passwords import get_password_hash
+    from sqlite_profile import create_engines, routing_sessionmaker
+
+    settings = DatabaseSettings(url=f"sqlite+aiosqlite:///{tmp_path / 'prod.db'}", sqlite_profile="production")
+    assert settings.sqlite_production
+    writer, reader = create_engines(settings)
+    Session = routing_sessionmaker(writer, reader, expire_on_commit=False)
+    async with writer.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async def _get_db():
+        async with Session() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = _get_db
+    try:
+        async with reader.connect() as conn:
+            assert (await conn.execute(text("PRAGMA journal_mode"))).scalar() == "wal"
+            assert (await conn.execute(text("PRAGMA synchronous"))).scalar() == 1  # NORMAL
+            assert (await conn.execute(text("PRAGMA query_only"))).scalar() == 1
+
+        # Запись в транзакции видна последующим чтениям той же транзакции
+        async with Session() as session:
+            session.add(SystemUser(username="admin", role=SystemUserRole.ADMIN, hashed_password=get_password_hash("admin")))
+            await session.flush()
+            assert (await session.execute(text("SELECT count(*) FROM system_users"))).scalar() == 1
+            await session.commit()
+            assert "writing" not in session.sync_session.info
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            token = (await client.post("/token", data={"username": "admin", "password": "admin"})).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            event_id = (await client.post(
+                "/events/", json={"title": "WAL", "event_date": "2025-06-01T12:00:00", "registration_active": True},
+                headers=headers,
+            )).json()["id"]
+            created = await client.post(
+                "/participants/bulk/", json=[{"full_name": f"P{i}", "email": f"p{i}@t.com"} for i in range(20)],
+                headers=headers,
+            )
+            p_ids = [p["id"] for p in created.json()]
+            resp = await client.post(f"/events/{event_id}/register/", json={"participant_ids": p_ids}, headers=headers)
+            assert len(resp.json()) == 20
+
+            # Одновременные отметки прибытия выстраиваются в очередь к писателю без "database is locked"
+            results = await asyncio.gather(*(
+                client.put(f"/events/{event_id}/participants/{p_id}/arrival", headers=headers) for p_id in p_ids
+            ))
+            assert all(r.status_code == 200 for r in results)
+            await dispatcher.join()
+            search = await client.get(f"/events/{event_id}/registrations/search", headers=headers)
+            assert len(search.json()) == 20
+            assert all(item["arrival_time"] is not None for item in search.json())
+    finally:
+        app.dependency_overrides.clear()
+        await writer.dispose()
+        await reader.dispose()
@@ -1,5 +1,5 @@
 import pytest
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
 import models
 
@@ -158,3 +158,155 @@ async def test_download_stats_file(client, admin_token_headers, db_session):
     pos_ivan = content.find("Ivanov Ivan")
     pos_petr = content.find("Petrov Petr")
     assert pos_ivan < pos_petr
+
+
+@pytest.mark.asyncio
+async def test_download_stats_file_formats(client, admin_token_headers, db_session, monkeypatch):
+    """Выгрузка в CSV/JSONL идёт порциями и сохраняет порядок из SQL."""
+    import csv
+    import io
+    import json
+    import stats_export
+
+    monkeypatch.setattr(stats_export, "EXPORT_CHUNK_SIZE", 2)
+    db = db_session
+    event = models.Event(title="Export Event", event_date=datetime.now(), registration_active=False)
+    db.add(event)
+    sys_user = (await db.execute(select(models.SystemUser).limit(1))).scalars().first()
+    participants = [models.Participant(full_name=f"Участник {i}", email=f"exp{i}@test.com") for i in range(5)]
+    db.add_all(participants)
+    await db.flush()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    # Пришли 3 и 1 (в этом порядке), остальные - нет
+    arrivals = {3: now - timedelta(minutes=10), 1: now}
+    db.add_all([
+        models.Registration(
+            event_id=event.id, participant_id=p.id, registered_by_user_id=sys_user.id,
+            arrival_time=arrivals.get(i),
+        )
+        for i, p in enumerate(participants)
+    ])
+    await db.commit()
+    expected = [participants[i].id for i in (3, 1, 0, 2, 4)]
+
+    response = await client.get(f"/events/{event.id}/stats/file?format=csv", headers=admin_token_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert [int(r["participant_id"]) for r in rows] == expected
+    assert rows[0]["full_name"] == "Участник 3"
+    assert rows[2]["arrival_time"] == ""
+
+    response = await client.get(f"/events/{event.id}/stats/file?format=jsonl", headers=admin_token_headers)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["participant_id"] for line in lines] == expected
+    assert lines[1]["arrival_time"] is not None
+
+    response = await client.get(f"/events/{event.id}/stats/file?format=xlsx", headers=admin_token_headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_roster_cache_incremental_updates(client, admin_token_headers):
+    """Ростер прогревается при создании активного мероприятия и обновляется обработчиками."""
+    from roster_cache import roster_cache
+
+    evt = await client.post(
+        "/events/",
+        json={"title": "Roster Event", "event_date": "2025-06-01T12:00:00", "registration_active": True},
+        headers=admin_token_headers,
+    )
+    event_id = evt.json()["id"]
+    assert roster_cache.get(event_id) is not None
+
+    p_ids = []
+    for i in range(3):
+        res_p = await client.post(
+            "/participants/", json={"full_name": f"Roster {i}", "email": f"roster{i}@test.com"},
+            headers=admin_token_headers,
+        )
+        p_ids.append(res_p.json()["id"])
+    await client.post(f"/events/{event_id}/register/", json={"participant_ids": p_ids}, headers=admin_token_headers)
+    await client.put(f"/events/{event_id}/participants/{p_ids[0]}/arrival", headers=admin_token_headers)
+    await client.put(f"/events/{event_id}/participants/{p_ids[1]}/arrival", headers=admin_token_headers)
+    await client.delete(f"/events/{event_id}/participants/{p_ids[1]}", headers=admin_token_headers)
+
+    loads_before = roster_cache.loads
+    stats = (await client.get("/events/active/stats", headers=admin_token_headers)).json()
+    assert stats["total_registrants"] == 2
+    assert stats["arrived_participants"] == 1
+
+    participants = (await client.get(f"/events/{event_id}/participants/", headers=admin_token_headers)).json()
+    assert [p["id"] for p in participants] == [p_ids[0], p_ids[2]]
+    assert participants[0]["arrival_time"] is not None
+    assert participants[0]["registered_by_full_name"] == "admin"
+
+    hits_before = roster_cache.hits
+    # Поиск идёт в БД через индекс, а не по ростеру
+    found = (await client.get(f"/events/{event_id}/participants/?query=roster 2", headers=admin_token_headers)).json()
+    assert [p["id"] for p in found] == [p_ids[2]]
+    assert roster_cache.hits == hits_before
+    # Все чтения обслужены без повторной загрузки
+    assert roster_cache.loads == loads_before
+
+    # Переименование участника сбрасывает ростер, следующее чтение перезагружает его
+    await client.put(f"/participants/{p_ids[2]}", json={"full_name": "Renamed"}, headers=admin_token_headers)
+    participants = (await client.get(f"/events/{event_id}/participants/", headers=admin_token_headers)).json()
+    assert participants[1]["full_name"] == "Renamed"
+    assert roster_cache.loads == loads_before + 1
+
+    metrics = (await client.get("/metrics/", headers=admin_token_headers)).json()
+    assert metrics["roster_cache"]["hits"] >= 2
+    assert str(event_id) in metrics["roster_cache"]["events"]
+
+
+@pytest.mark.asyncio
+async def test_roster_cache_single_flight_load(client, admin_token_headers, db_session, monkeypatch):
+    """Одновременные читатели ждут одну загрузку, изменения во время неё не теряются."""
+    import asyncio
+
+    from roster_cache import RosterCache, roster_cache
+
+    evt = await client.post("/events/", json={"title": "Flight", "event_date": "2025-06-01T12:00:00"}, headers=admin_token_headers)
+    event_id = evt.json()["id"]
+    p_ids = []
+    for i in range(3):
+        res_p = await client.post(
+            "/participants/", json={"full_name": f"Flight {i}", "email": f"flight{i}@test.com"},
+            headers=admin_token_headers,
+        )
+        p_ids.append(res_p.json()["id"])
+    await client.post(f"/events/{event_id}/register/", json={"participant_ids": p_ids}, headers=admin_token_headers)
+
+    cache = RosterCache()
+    first = asyncio.create_task(cache.get_or_load(db_session, event_id))
+    await asyncio.sleep(0)
+    assert event_id in cache._loading
+    # Коммиты других запросов, пока идёт загрузка
+    arrival = datetime(2025, 6, 1, 10, 0)
+    cache.set_arrivals(event_id, [(p_ids[0], arrival)])
+    cache.remove_registration(event_id, p_ids[2])
+    second = await cache.get_or_load(db_session, event_id)
+    roster = await first
+
+    assert second is roster
+    assert cache.loads == 1
+    assert cache.get(event_id) is roster
+    assert list(roster.entries) == p_ids[:2]
+    assert roster.entries[p_ids[0]].arrival_time == arrival
+    assert roster.arrived_count == 1
+
+    # Сброс во время загрузки: снимок отдаётся читателю, но в кэш не попадает
+    cache.invalidate(event_id)
+    loading = asyncio.create_task(cache.load(db_session, event_id))
+    await asyncio.sleep(0)
+    cache.invalidate_participant(p_ids[0])
+    assert (await loading) is not None
+    assert cache.get(event_id) is None
+
+    # Несколько воркеров: кэш выключен, список читается из БД
+    monkeypatch.setattr(roster_cache, "enabled", False)
+    assert await roster_cache.get_or_load(db_session, event_id) is None
+    participants = (await client.get(f"/events/{event_id}/participants/", headers=admin_token_headers)).json()
+    assert [p["id"] for p in participants] == p_ids
@@ -0,0 +1,179 @@
+import asyncio
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from dispatcher import dispatcher
+from idempotency import IdempotencyStore, idempotency_store
+from manager import manager
+
+
+@pytest.fixture
+def broadcasts(monkeypatch):
+    sent = []
+
+    async def fake_publish(event_id, message):
+        sent.append((json.loads(message), event_id))
+
+    monkeypatch.setattr(manager.broker, "publish", fake_publish)
+    idempotency_store.clear()
+    yield sent
+    idempotency_store.clear()
+
+
+async def _prepare(client: AsyncClient, headers: dict, count: int = 2):
+    evt = await client.post("/events/", json={"title": "Replay Event", "event_date": "2025-06-01T12:00:00"}, headers=headers)
+    event_id = evt.json()["id"]
+    p_ids = []
+    for i in range(count):
+        res_p = await client.post("/participants/", json={"full_name": f"Replay {i}", "email": f"replay{i}@test.com"}, headers=headers)
+        p_ids.append(res_p.json()["id"])
+    await client.post(f"/events/{event_id}/register/", json={"participant_ids": p_ids}, headers=headers)
+    await dispatcher.join()
+    return event_id, p_ids
+
+
+def test_idempotency_store_bounds_and_ttl(monkeypatch):
+    import idempotency
+
+    clock = [1000.0]
+    monkeypatch.setattr(idempotency.time, "monotonic", lambda: clock[0])
+
+    store = IdempotencyStore(max_entries=2, ttl_seconds=10)
+    store.put("a", 1)
+    store.put("b", 2)
+    store.put("c", 3)
+    assert store.get("a") is None  # вытеснен по размеру
+    assert store.get("c") == 3
+
+    clock[0] += 11
+    assert store.get("b") is None  # протух
+    assert len(store) == 0
+
+
+@pytest.mark.asyncio
+async def test_arrival_with_idempotency_key(client: AsyncClient, admin_token: str, broadcasts):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    event_id, p_ids = await _prepare(client, headers, count=1)
+    broadcasts.clear()
+
+    key_headers = {**headers, "Idempotency-Key": "tablet-1:42"}
+    first = await client.put(f"/events/{event_id}/participants/{p_ids[0]}/arrival", headers=key_headers)
+    second = await client.put(f"/events/{event_id}/participants/{p_ids[0]}/arrival", headers=key_headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    await dispatcher.join()
+    assert [m["type"] for m, _ in broadcasts] == ["arrival_update", "stats"]
+
+
+@pytest.mark.asyncio
+async def test_replay_queue(client: AsyncClient, admin_token: str, broadcasts):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    event_id, (p1, p2) = await _prepare(client, headers)
+    broadcasts.clear()
+
+    queue = {
+        "items": [
+            {"idempotency_key": "k1", "participant_id": p1, "action": "set", "client_time": "2025-06-01T10:00:00Z"},
+            {"idempotency_key": "k2", "participant_id": p2, "action": "set", "client_time": "2025-06-01T10:01:00Z"},
+            # Ошибочная отметка p2 снята позже - итог: p2 не пришёл
+            {"idempotency_key": "k3", "participant_id": p2, "action": "unset", "client_time": "2025-06-01T10:02:00Z"},
+            {"idempotency_key": "k4", "participant_id": 999999, "action": "set", "client_time": "2025-06-01T10:03:00Z"},
+        ]
+    }
+    resp = await client.post(f"/events/{event_id}/arrivals/replay", json=queue, headers=headers)
+    assert resp.status_code == 200
+    results = {r["idempotency_key"]: r for r in resp.json()}
+    assert results["k1"]["status"] == "ok"
+    assert results["k1"]["arrival_time"] == "2025-06-01T10:00:00"
+    assert results["k3"]["arrival_time"] is None
+    assert results["k4"]["status"] == "not_registered"
+    await dispatcher.join()
+    assert [m["type"] for m, _ in broadcasts] == ["arrival_update", "stats"]
+    assert broadcasts[1][0] == {"type": "stats", "total_registrants": 2, "arrived_participants": 1, "change_seq": 4}
+
+    search = await client.get(f"/events/{event_id}/registrations/search", headers=headers)
+    arrivals = {item["id"]: item["arrival_time"] for item in search.json()}
+    assert arrivals == {p1: "2025-06-01T10:00:00", p2: None}
+
+    # Повторная отправка той же очереди после переподключения
+    resp = await client.post(f"/events/{event_id}/arrivals/replay", json=queue, headers=headers)
+    assert {r["status"] for r in resp.json()} == {"duplicate"}
+    await dispatcher.join()
+    assert len(broadcasts) == 2
+
+
+@pytest.mark.asyncio
+async def test_idempotency_key_scoped_by_user_and_reserved(
+    client: AsyncClient, admin_token: str, registrar_token_headers: dict, broadcasts
+):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    event_id, (p1, p2) = await _prepare(client, headers)
+    broadcasts.clear()
+
+    # Два одновременных запроса с одним ключом: второй ждёт первый и получает его ответ
+    key_headers = {**headers, "Idempotency-Key": "shared"}
+    url = f"/events/{event_id}/participants/{p1}/arrival"
+    first, second = await asyncio.gather(client.put(url, headers=key_headers), client.put(url, headers=key_headers))
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    await dispatcher.join()
+    assert [m["type"] for m, _ in broadcasts] == ["arrival_update", "stats"]
+
+    # Тот же ключ у другого пользователя - другой запрос, а не чужой ответ из хранилища
+    batch_url = f"/events/{event_id}/arrivals/batch"
+    resp = await client.post(batch_url, json={"participant_ids": [p1], "action": "set"}, headers=key_headers)
+    assert [r["participant_id"] for r in resp.json()] == [p1]
+    registrar_headers = {**registrar_token_headers, "Idempotency-Key": "shared"}
+    resp = await client.post(batch_url, json={"participant_ids": [p2], "action": "set"}, headers=registrar_headers)
+    assert [r["participant_id"] for r in resp.json()] == [p2]
+
+
+@pytest.mark.asyncio
+async def test_stats_frames_count_other_workers_changes(client: AsyncClient, admin_token: str, db_session, broadcasts):
+    from sqlalchemy import func, update
+
+    import models
+    from change_feed import record_change
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    event_id, (p1, p2) = await _prepare(client, headers)
+    broadcasts.clear()
+
+    # Отметка, сделанная другим воркером: ростер этого процесса о ней не знает
+    reg_id = (await db_session.execute(
+        update(models.Registration)
+        .where(models.Registration.event_id == event_id, models.Registration.participant_id == p2)
+        .values(arrival_time=func.now())
+        .returning(models.Registration.id)
+    )).scalar_one()
+    await record_change(db_session, event_id, models.RegistrationChangeAction.ARRIVAL_SET, reg_id, p2, arrived=1)
+    await db_session.commit()
+
+    await client.put(f"/events/{event_id}/participants/{p1}/arrival", headers=headers)
+    await dispatcher.join()
+    stats = [m for m, _ in broadcasts if m["type"] == "stats"]
+    assert stats == [{"type": "stats", "total_registrants": 2, "arrived_participants": 2, "change_seq": 4}]
+
+    resp = await client.get("/events/active/stats", headers=headers)
+    assert resp.json()["arrived_participants"] == 2
+    assert resp.json()["change_seq"] == 4
+
+
+@pytest.mark.asyncio
+async def test_stats_frames_running_counters(client: AsyncClient, admin_token: str, broadcasts):
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    event_id, (p1, p2) = await _prepare(client, headers)
+    broadcasts.clear()
+
+    # Повторная отметка пришедшего не сдвигает счётчик
+    await client.put(f"/events/{event_id}/participants/{p1}/arrival", headers=headers)
+    await client.put(f"/events/{event_id}/participants/{p1}/arrival", headers=headers)
+    await client.post(f"/events/{event_id}/arrivals/batch", json={"participant_ids": [p1, p2], "action": "set"}, headers=headers)
+    await client.delete(f"/events/{event_id}/participants/{p1}/arrival", headers=headers)
+    await client.delete(f"/events/{event_id}/participants/{p2}", headers=headers)
+    await dispatcher.join()
+
+    stats = [(m["total_registrants"], m["arrived_participants"]) for m, _ in broadcasts if m["type"] == "stats"]
+    assert stats == [(2, 1), (2, 1), (2, 2), (2, 1), (1, 0)]
@@ -109,3 +109,87 @@ async def test_directory_members_pagination(
     assert resp_big.status_code == 200
     # Должен вернуть всех 5, не обрезая (хотя тут всего 5, но главное, что ошибки 422 нет)
     assert len(resp_big.json()) == 5
+
+
+@pytest.mark.asyncio
+async def test_register_directory_and_ids_without_duplicates(
+    client: AsyncClient,
+    admin_token: str
+):
+    """Регистрация справочника вместе с пересекающимся списком ID не создаёт дублей."""
+    headers = {"Authorization": f"Bearer {admin_token}"}
+
+    evt = await client.post("/events/", json={"title": "Bulk Event", "event_date": "2025-06-01T12:00:00"}, headers=headers)
+    event_id = evt.json()["id"]
+
+    res_d = await client.post("/directories/", json={"name": "Bulk Directory"}, headers=headers)
+    d_id = res_d.json()["id"]
+
+    p_ids = []
+    for i in range(3):
+        res_p = await client.post("/participants/", json={"full_name": f"Bulk {i}", "email": f"bulk{i}@test.com"}, headers=headers)
+        p_ids.append(res_p.json()["id"])
+    for p_id in p_ids[:2]:
+        await client.post("/directories/add-member/", json={"participant_id": p_id, "directory_id": d_id}, headers=headers)
+
+    # Участник 0 уже зарегистрирован заранее
+    await client.post(f"/events/{event_id}/register/", json={"participant_ids": [p_ids[0]]}, headers=headers)
+
+    # Справочник (0, 1) + явно 1, 2 и несуществующий ID
+    resp = await client.post(
+        f"/events/{event_id}/register/",
+        json={"directory_id": d_id, "participant_ids": [p_ids[1], p_ids[2], 999999]},
+        headers=headers,
+    )
+    assert resp.status_code == 200
+    data = resp.json()
+    assert sorted(r["participant_id"] for r in data) == [p_ids[1], p_ids[2]]
+    assert all(r["registered_by"]["username"] == "admin" for r in data)
+
+    # Повторный вызов ничего не добавляет
+    resp = await client.post(f"/events/{event_id}/register/", json={"directory_id": d_id}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json() == []
+
+    # Пустой справочник без явных ID - ошибка
+    res_empty = await client.post("/directories/", json={"name": "Empty Directory"}, headers=headers)
+    resp = await client.post(f"/events/{event_id}/register/", json={"directory_id": res_empty.json()["id"]}, headers=headers)
+    assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_participant_search_index_follows_changes(
+    client: AsyncClient,
+    admin_token: str
+):
+    """Индекс поиска обновляется при создании, изменении и удалении участника."""
+    headers = {"Authorization": f"Bearer {admin_token}"}
+
+    res_p = await client.post(
+        "/participants/",
+        json={"full_name": "Смирнова Ольга", "email": "olga@example.com", "note": "Делегация Казани"},
+        headers=headers,
+    )
+    p_id = res_p.json()["id"]
+
+    async def found(query: str) -> bool:
+        resp = await client.get("/participants/search/", params={"query": query}, headers=headers)
+        assert resp.status_code == 200
+        return any(p["id"] == p_id for p in resp.json())
+
+    # Подстрока в середине, другой регистр, email и примечание
+    assert await found("мирнов")
+    assert await found("ОЛЬГА")
+    assert await found("olga@")
+    assert await found("казани")
+    # Короткий запрос - без trigram, но с тем же регистронезависимым сравнением кириллицы
+    assert await found("Де")
+    assert await found("ол")
+    assert await found("СМ")
+
+    await client.put(f"/participants/{p_id}", json={"full_name": "Кузнецова Ольга"}, headers=headers)
+    assert not await found("Смирнова")
+    assert await found("Кузнецова")
+
+    await client.delete(f"/participants/{p_id}", headers=headers)
+    assert not await found("Кузнецова")
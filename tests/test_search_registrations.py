@@ -119,3 +119,53 @@ async def test_search_registrations_endpoint(client, admin_token, db_session):
     resp = await client.get(f"{base_url}?query=NonExistent", headers=headers)
     assert resp.status_code == 200
     assert resp.json() == []
+
+
+@pytest.mark.asyncio
+async def test_search_registrations_keyset_cursor(client, admin_token, db_session):
+    from sqlalchemy import select
+
+    result = await db_session.execute(select(SystemUser).filter_by(username="admin"))
+    admin_id = result.scalars().first().id
+
+    event = Event(title="Cursor Search Event", event_date=datetime.now(UTC), registration_active=True)
+    db_session.add(event)
+    await db_session.commit()
+    await db_session.refresh(event)
+    event_id = event.id
+
+    await create_test_data(db_session, event_id, admin_id)
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    base_url = f"/events/{event_id}/registrations/search"
+
+    async def walk(params: str) -> list[str]:
+        names, cursor = [], None
+        while True:
+            url = f"{base_url}?limit=1&{params}" + (f"&cursor={cursor}" if cursor else "")
+            resp = await client.get(url, headers=headers)
+            assert resp.status_code == 200
+            names.extend(p["full_name"] for p in resp.json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                return names
+
+    assert await walk("sort_by=alphabet") == ["Anna Karenina", "Boris Godunov", "Cecil Palmer"]
+    assert await walk("sort_by=arrival_time_desc") == ["Boris Godunov", "Anna Karenina", "Cecil Palmer"]
+    assert await walk("sort_by=arrival_time_asc") == ["Anna Karenina", "Boris Godunov", "Cecil Palmer"]
+    assert await walk("sort_by=arrival_time_asc&filter_arrived=true") == ["Anna Karenina", "Boris Godunov"]
+
+    # Страница на стыке прибывших и не прибывших: добирается из отрезка с пустым arrival_time
+    resp = await client.get(f"{base_url}?limit=2&sort_by=arrival_time_desc", headers=headers)
+    assert [p["full_name"] for p in resp.json()] == ["Boris Godunov", "Anna Karenina"]
+    resp = await client.get(f"{base_url}?limit=3&sort_by=arrival_time_desc", headers=headers)
+    assert [p["full_name"] for p in resp.json()] == ["Boris Godunov", "Anna Karenina", "Cecil Palmer"]
+    assert "X-Next-Cursor" not in resp.headers
+
+    # Курсор от другой сортировки и мусорный курсор отклоняются
+    first = await client.get(f"{base_url}?limit=1&sort_by=alphabet", headers=headers)
+    foreign = first.headers["X-Next-Cursor"]
+    resp = await client.get(f"{base_url}?limit=1&sort_by=arrival_time_desc&cursor={foreign}", headers=headers)
+    assert resp.status_code == 400
+    resp = await client.get(f"{base_url}?cursor=not-a-cursor", headers=headers)
+    assert resp.status_code == 400
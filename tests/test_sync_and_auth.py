@@ -79,3 +79,352 @@ async def test_sync_logic(client: AsyncClient, admin_token: str):
     # Должны получить ТОЛЬКО P2 (так как P1 мы исключили)
     assert len(data_2["new_registrations"]) == 1
     assert data_2["new_registrations"][0]["participant_id"] == p2_id
+
+@pytest.mark.asyncio
+async def test_sync_by_cursor(client: AsyncClient, admin_token: str, db_session):
+    from change_feed import record_change
+    from models import RegistrationChangeAction
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+
+    evt = await client.post("/events/", json={"title": "Cursor Event", "event_date": "2025-06-01T12:00:00"}, headers=headers)
+    event_id = evt.json()["id"]
+
+    p1 = await client.post("/participants/", json={"full_name": "C1", "email": "c1@test.com"}, headers=headers)
+    p2 = await client.post("/participants/", json={"full_name": "C2", "email": "c2@test.com"}, headers=headers)
+    p1_id = p1.json()["id"]
+    p2_id = p2.json()["id"]
+
+    await client.post(f"/events/{event_id}/register/", json={"participant_ids": [p1_id, p2_id]}, headers=headers)
+
+    # 1. Первичная загрузка: курсор 0
+    resp = await client.post(f"/events/{event_id}/sync/", json={"cursor": 0}, headers=headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert [c["action"] for c in data["changes"]] == ["registered", "registered"]
+    assert {r["participant_id"] for r in data["new_registrations"]} == {p1_id, p2_id}
+    assert data["has_more"] is False
+    cursor = data["cursor"]
+
+    # 2. Без изменений - пустая дельта, курсор не двигается
+    resp = await client.post(f"/events/{event_id}/sync/", json={"cursor": cursor}, headers=headers)
+    assert resp.json()["changes"] == []
+    assert resp.json()["cursor"] == cursor
+
+    # 3. Прибытие, отмена прибытия и удаление регистрации (вперемешку с другим мероприятием)
+    other = await client.post(
+        "/events/",
+        json={"title": "Other Event", "event_date": "2025-06-01T12:00:00", "registration_active": False},
+        headers=headers,
+    )
+    await record_change(db_session, other.json()["id"], RegistrationChangeAction.REGISTERED, 1000, p1_id)
+    await db_session.commit()
+    await client.put(f"/events/{event_id}/participants/{p1_id}/arrival", headers=headers)
+    await client.delete(f"/events/{event_id}/participants/{p1_id}/arrival", headers=headers)
+    await client.delete(f"/events/{event_id}/participants/{p2_id}", headers=headers)
+
+    resp = await client.post(f"/events/{event_id}/sync/", json={"cursor": cursor, "limit": 2}, headers=headers)
+    data = resp.json()
+    assert [c["action"] for c in data["changes"]] == ["arrival_set", "arrival_unset"]
+    assert data["changes"][0]["arrival_time"] is not None
+    assert data["has_more"] is True
+    assert data["new_registrations"] == []
+
+    resp = await client.post(f"/events/{event_id}/sync/", json={"cursor": data["cursor"]}, headers=headers)
+    data = resp.json()
+    assert len(data["changes"]) == 1
+    tombstone = data["changes"][0]
+    assert tombstone["action"] == "deleted"
+    assert tombstone["participant_id"] == p2_id
+    assert data["has_more"] is False
+
+    # Номера изменений - свои у каждого мероприятия, без пропусков
+    resp = await client.post(f"/events/{event_id}/sync/", json={"cursor": 0}, headers=headers)
+    assert [c["seq"] for c in resp.json()["changes"]] == [1, 2, 3, 4, 5]
+
+@pytest.mark.asyncio
+async def test_current_user_cache(client: AsyncClient, admin_token: str, db_session):
+    from sqlalchemy import select
+    from models import SystemUser
+    from user_cache import user_cache
+
+    headers_admin = {"Authorization": f"Bearer {admin_token}"}
+    resp = await client.post(
+        "/system-users/",
+        json={"username": "cached_op", "password": "pass", "full_name": "Op", "role": "Operator"},
+        headers=headers_admin,
+    )
+    user_id = resp.json()["id"]
+    token = (await client.post("/token", data={"username": "cached_op", "password": "pass"})).json()["access_token"]
+    headers_op = {"Authorization": f"Bearer {token}"}
+
+    evt = await client.post("/events/", json={"title": "Cache Event", "event_date": "2025-06-01T12:00:00"}, headers=headers_admin)
+    event_id = evt.json()["id"]
+
+    # Повторные запросы берут пользователя из кэша; запись через него (last_sync_time) работает
+    hits = user_cache.hits
+    for _ in range(3):
+        sync = await client.post(f"/events/{event_id}/sync/", json={"known_registration_ids": []}, headers=headers_op)
+        assert sync.status_code == 200
+    assert user_cache.hits >= hits + 2
+    last_sync = (await db_session.execute(
+        select(SystemUser.last_sync_time).filter(SystemUser.id == user_id)
+    )).scalar()
+    assert last_sync is not None
+
+    # Смена роли сбрасывает запись; выданный токен отозван (версия токена увеличена)
+    await client.put(f"/system-users/{user_id}", json={"role": "Registrar"}, headers=headers_admin)
+    resp = await client.post("/participants/", json={"full_name": "X", "email": "x@test.com"}, headers=headers_op)
+    assert resp.status_code == 401
+    token = (await client.post("/token", data={"username": "cached_op", "password": "pass"})).json()["access_token"]
+    headers_op = {"Authorization": f"Bearer {token}"}
+    resp = await client.post("/participants/", json={"full_name": "X", "email": "x@test.com"}, headers=headers_op)
+    assert resp.status_code == 403
+
+    # Удалённый пользователь больше не аутентифицируется
+    await client.delete(f"/system-users/{user_id}", headers=headers_admin)
+    resp = await client.get("/participants/", headers=headers_op)
+    assert resp.status_code == 401
+
+    metrics = (await client.get("/metrics/", headers=headers_admin)).json()
+    assert metrics["user_cache"]["hits"] >= 2
+
+@pytest.mark.asyncio
+async def test_claims_auth_mode_and_token_revocation(client: AsyncClient, admin_token: str, monkeypatch):
+    import dependencies
+    from token_versions import token_versions
+
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "claims")
+    headers_admin = {"Authorization": f"Bearer {admin_token}"}
+    resp = await client.post(
+        "/system-users/",
+        json={"username": "claims_op", "password": "pass", "full_name": "Claims Op", "role": "Operator"},
+        headers=headers_admin,
+    )
+    user_id = resp.json()["id"]
+    token = (await client.post("/token", data={"username": "claims_op", "password": "pass"})).json()["access_token"]
+    headers_op = {"Authorization": f"Bearer {token}"}
+
+    # Права - по роли из токена
+    resp = await client.post("/participants/", json={"full_name": "Claims P", "email": "cp@test.com"}, headers=headers_op)
+    assert resp.status_code == 200
+    assert (await client.get("/system-users/", headers=headers_op)).status_code == 403
+    evt = await client.post("/events/", json={"title": "Claims Event", "event_date": "2025-06-01T12:00:00"}, headers=headers_admin)
+    sync = await client.post(f"/events/{evt.json()['id']}/sync/", json={"known_registration_ids": []}, headers=headers_op)
+    assert sync.status_code == 200
+
+    # Смена роли увеличивает версию: старый токен отозван, новый действует с новой ролью
+    await client.put(f"/system-users/{user_id}", json={"role": "Registrar"}, headers=headers_admin)
+    assert (await client.get("/participants/", headers=headers_op)).status_code == 401
+    assert token_versions.stats()["rejected"] >= 1
+    token = (await client.post("/token", data={"username": "claims_op", "password": "pass"})).json()["access_token"]
+    headers_op = {"Authorization": f"Bearer {token}"}
+    assert (await client.get("/participants/", headers=headers_op)).status_code == 200
+    resp = await client.post("/participants/", json={"full_name": "Claims Q", "email": "cq@test.com"}, headers=headers_op)
+    assert resp.status_code == 403
+
+    # Смена пароля отзывает токены и в режиме чтения пользователя из БД
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "db")
+    assert (await client.get("/participants/", headers=headers_op)).status_code == 200
+    await client.put(f"/system-users/{user_id}", json={"password": "new-pass"}, headers=headers_admin)
+    assert (await client.get("/participants/", headers=headers_op)).status_code == 401
+
+    # Удалённый пользователь
+    monkeypatch.setattr(dependencies, "AUTH_MODE", "claims")
+    token = (await client.post("/token", data={"username": "claims_op", "password": "new-pass"})).json()["access_token"]
+    await client.delete(f"/system-users/{user_id}", headers=headers_admin)
+    assert (await client.get("/participants/", headers={"Authorization": f"Bearer {token}"})).status_code == 401
+
+@pytest.mark.asyncio
+async def test_login_rehashes_password_when_cost_changes(client: AsyncClient, db_session, monkeypatch):
+    from passlib.context import CryptContext
+    from sqlalchemy import select
+    import passwords
+    from models import SystemUser, SystemUserRole
+
+    old_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+    db_session.add(SystemUser(
+        username="rehash_me", role=SystemUserRole.REGISTRAR, hashed_password=old_context.hash("secret"),
+    ))
+    await db_session.commit()
+
+    monkeypatch.setattr(
+        passwords, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5)
+    )
+    assert (await client.post("/token", data={"username": "rehash_me", "password": "wrong"})).status_code == 401
+    resp = await client.post("/token", data={"username": "rehash_me", "password": "secret"})
+    assert resp.status_code == 200
+
+    db_session.expire_all()
+    stored = (await db_session.execute(
+        select(SystemUser.hashed_password).filter(SystemUser.username == "rehash_me")
+    )).scalar()
+    assert stored.startswith("$2b$05$")
+    assert passwords.verify_password("secret", stored)
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotation_and_revocation(client: AsyncClient, admin_token: str, monkeypatch):
+    import routers.auth
+
+    headers_admin = {"Authorization": f"Bearer {admin_token}"}
+    resp = await client.post(
+        "/system-users/",
+        json={"username": "tablet_reg", "password": "pass", "full_name": "Tablet", "role": "Registrar"},
+        headers=headers_admin,
+    )
+    user_id = resp.json()["id"]
+    login = (await client.post("/token", data={"username": "tablet_reg", "password": "pass"})).json()
+    assert login["refresh_token"]
+
+    # Продление не проверяет пароль
+    async def no_bcrypt(*args):
+        raise AssertionError("bcrypt при продлении токена")
+
+    monkeypatch.setattr(routers.auth, "verify_and_update_async", no_bcrypt)
+    refreshed = await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})
+    assert refreshed.status_code == 200
+    tokens = refreshed.json()
+    assert tokens["refresh_token"] != login["refresh_token"]
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert (await client.get("/participants/", headers=headers)).status_code == 200
+
+    # Гонка продлений в пределах окна: проигравший получает 401, сессия жива
+    reuse = await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})
+    assert reuse.status_code == 401
+    refreshed = await client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert refreshed.status_code == 200
+    login, tokens = tokens, refreshed.json()
+
+    # Повторное предъявление заменённого токена после окна завершает сессию целиком
+    import device_sessions
+    monkeypatch.setattr(device_sessions, "REFRESH_REUSE_GRACE_SECONDS", 0)
+    reuse = await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})
+    assert reuse.status_code == 401
+    assert (await client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})).status_code == 401
+    assert (await client.post("/token/refresh", json={"refresh_token": "garbage"})).status_code == 401
+    monkeypatch.undo()
+
+    # Выход с устройства
+    login = (await client.post("/token", data={"username": "tablet_reg", "password": "pass"})).json()
+    assert (await client.post("/token/revoke", json={"refresh_token": login["refresh_token"]})).status_code == 204
+    assert (await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})).status_code == 401
+
+    # Смена пароля и принудительный выход администратором завершают сессии
+    login = (await client.post("/token", data={"username": "tablet_reg", "password": "pass"})).json()
+    await client.put(f"/system-users/{user_id}", json={"password": "new-pass"}, headers=headers_admin)
+    assert (await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})).status_code == 401
+
+    login = (await client.post("/token", data={"username": "tablet_reg", "password": "new-pass"})).json()
+    assert (await client.delete(f"/system-users/{user_id}/sessions", headers=headers_admin)).status_code == 204
+    assert (await client.post("/token/refresh", json={"refresh_token": login["refresh_token"]})).status_code == 401
+
+@pytest.mark.asyncio
+async def test_concurrent_refresh_keeps_session(client: AsyncClient, admin_token: str):
+    import asyncio
+
+    login = (await client.post("/token", data={"username": "admin", "password": "admin"})).json()
+    payload = {"refresh_token": login["refresh_token"]}
+    # Две вкладки продлевают сессию одним и тем же токеном
+    first, second = await asyncio.gather(
+        client.post("/token/refresh", json=payload), client.post("/token/refresh", json=payload)
+    )
+    assert sorted([first.status_code, second.status_code]) == [200, 401]
+    winner = first if first.status_code == 200 else second
+
+    # Повтор после потерянного ответа тоже не завершает сессию
+    assert (await client.post("/token/refresh", json=payload)).status_code == 401
+    refreshed = await client.post("/token/refresh", json={"refresh_token": winner.json()["refresh_token"]})
+    assert refreshed.status_code == 200
+
+@pytest.mark.asyncio
+async def test_login_throttling(client: AsyncClient, admin_token: str, monkeypatch):
+    import routers.auth
+    from rate_limit import login_limiter
+
+    monkeypatch.setattr(login_limiter, "burst", 3)
+    monkeypatch.setattr(login_limiter, "refill_per_second", 1 / 60)
+    hashed = []
+    original = routers.auth.verify_and_update_async
+
+    async def counting_verify(*args):
+        hashed.append(args)
+        return await original(*args)
+
+    monkeypatch.setattr(routers.auth, "verify_and_update_async", counting_verify)
+
+    for _ in range(3):
+        resp = await client.post("/token", data={"username": "admin", "password": "wrong"})
+        assert resp.status_code == 401
+    resp = await client.post("/token", data={"username": "admin", "password": "admin"})
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) > 0
+    # Отклонённая попытка не дошла до bcrypt
+    assert len(hashed) == 3
+
+    # Другой логин с того же адреса не затронут
+    resp = await client.post("/token", data={"username": "someone", "password": "x"})
+    assert resp.status_code == 401
+
+    # Тот же логин с другого адреса не заблокирован чужими ошибками
+    import ipaddress
+    import rate_limit
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [ipaddress.ip_network("127.0.0.1/32")])
+    resp = await client.post(
+        "/token", data={"username": "admin", "password": "admin"}, headers={"X-Forwarded-For": "10.0.0.9"}
+    )
+    assert resp.status_code == 200
+    # Успешные входы лимит логина не расходуют
+    for _ in range(4):
+        resp = await client.post(
+            "/token", data={"username": "admin", "password": "admin"}, headers={"X-Forwarded-For": "10.0.0.9"}
+        )
+        assert resp.status_code == 200
+
+    metrics = (await client.get("/metrics/", headers={"Authorization": f"Bearer {admin_token}"})).json()
+    assert metrics["login_limiter"]["rejected"] == 1
+    assert metrics["login_limiter"]["throttled_keys"] == 1
+
+@pytest.mark.asyncio
+async def test_login_throttling_per_client_address(client: AsyncClient, db_session, monkeypatch):
+    import ipaddress
+    import rate_limit
+
+    monkeypatch.setattr(rate_limit.login_ip_limiter, "burst", 2)
+    monkeypatch.setattr(rate_limit.login_ip_limiter, "refill_per_second", 1 / 60)
+    # Тестовый клиент ходит с 127.0.0.1 - как прокси, отдающий API под /api
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [ipaddress.ip_network("127.0.0.1/32")])
+
+    async def login(username: str, forwarded_for: str) -> int:
+        resp = await client.post(
+            "/token", data={"username": username, "password": "x"}, headers={"X-Forwarded-For": forwarded_for}
+        )
+        return resp.status_code
+
+    # Перебор логинов с одного адреса упирается в лимит адреса
+    assert await login("user1", "10.0.0.1") == 401
+    assert await login("user2", "10.0.0.1") == 401
+    assert await login("user3", "10.0.0.1") == 429
+    # Подставленный клиентом X-Forwarded-For не помогает: берётся адрес, добавленный прокси
+    assert await login("user4", "1.2.3.4, 10.0.0.1") == 429
+    # Другой клиент за тем же прокси не затронут
+    assert await login("user5", "10.0.0.2") == 401
+
+
+def test_login_limiter_never_evicts_throttled_keys():
+    import time
+    from rate_limit import TokenBucketLimiter
+
+    limiter = TokenBucketLimiter(burst=1, refill_per_second=1 / 60, max_keys=2)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("b") == 0
+    # Обе корзины исчерпаны: новый ключ не вытесняет их, а получает отказ
+    assert limiter.acquire("c") > 0
+    assert limiter.acquire("a") > 0
+    assert limiter.stats()["overflow_rejected"] == 1
+
+    # Восстановившаяся корзина ничем не отличается от новой и вытесняется
+    limiter = TokenBucketLimiter(burst=1, refill_per_second=1000, max_keys=1)
+    assert limiter.acquire("a") == 0
+    time.sleep(0.01)
+    assert limiter.acquire("b") == 0
+    assert limiter.stats()["keys"] == 1
@@ -46,6 +46,12 @@ def test_websocket_broadcast_scenario(admin_token):
             data = websocket.receive_json()
             assert data["type"] == "new_registrations"
             assert participant_id in data["participant_ids"]
+
+            # Следом приходят обновлённые счётчики мероприятия
+            stats = websocket.receive_json()
+            assert stats["type"] == "stats"
+            assert stats["total_registrants"] == 1
+            assert stats["arrived_participants"] == 0
             
             # Удаление регистрации (триггерит уведомление)
             del_resp = client.delete(
@@ -58,3 +64,46 @@ def test_websocket_broadcast_scenario(admin_token):
             data_del = websocket.receive_json()
             assert data_del["type"] == "deleted_registration"
             assert data_del["participant_id"] == participant_id
+
+
+def test_websocket_directory_subscription(admin_token):
+    """Подписчик справочника получает регистрации только своих участников (счётчики - все)."""
+    with TestClient(app) as client:
+        auth_headers = {"Authorization": f"Bearer {admin_token}"}
+        event_id = client.post(
+            "/events/",
+            json={"title": "Scoped WS Event", "event_date": "2025-12-31T10:00:00", "registration_active": True},
+            headers=auth_headers,
+        ).json()["id"]
+
+        members = {}
+        for name in ("Delegation A", "Delegation B"):
+            dir_id = client.post("/directories/", json={"name": name}, headers=auth_headers).json()["id"]
+            p_id = client.post(
+                "/participants/", json={"full_name": f"Member of {name}", "email": "m@test.com"},
+                headers=auth_headers,
+            ).json()["id"]
+            client.post(
+                "/directories/add-member/", json={"participant_id": p_id, "directory_id": dir_id},
+                headers=auth_headers,
+            )
+            members[name] = (dir_id, p_id)
+
+        dir_a, p_a = members["Delegation A"]
+        _, p_b = members["Delegation B"]
+        with client.websocket_connect(f"/ws/events/{event_id}?directories={dir_a}") as websocket:
+            client.post(f"/events/{event_id}/register/", json={"participant_ids": [p_b]}, headers=auth_headers)
+            client.post(f"/events/{event_id}/register/", json={"participant_ids": [p_a]}, headers=auth_headers)
+            client.put(f"/events/{event_id}/participants/{p_b}/arrival", headers=auth_headers)
+            client.put(f"/events/{event_id}/participants/{p_a}/arrival", headers=auth_headers)
+
+            received = [websocket.receive_json() for _ in range(6)]
+            assert [(m["type"], m.get("participant_id", m.get("participant_ids"))) for m in received] == [
+                ("stats", None),
+                ("new_registrations", [p_a]),
+                ("stats", None),
+                ("stats", None),
+                ("arrival_update", p_a),
+                ("stats", None),
+            ]
+            assert received[-1]["arrived_participants"] == 2
@@ -0,0 +1,72 @@
+"""
+Таблица версий токенов пользователей для проверки JWT без чтения system_users.
+
+Версия пользователя увеличивается при смене роли или пароля и попадает в токен
+(claim "ver"); токен с устаревшей версией отклоняется. Таблица маленькая (одна
+строка на пользователя) и целиком перечитывается из БД раз в TTL - так изменения,
+сделанные другими воркерами, доходят до всех процессов.
+"""
+import os
+import time
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+import models
+
+# Неизвестный пользователь (например, только что созданный в другом воркере)
+# вызывает внеочередное перечитывание не чаще этого интервала
+MIN_REFRESH_SECONDS = 1.0
+
+
+class TokenVersionTable:
+    def __init__(self, ttl_seconds: float = 30.0):
+        self.ttl_seconds = ttl_seconds
+        self._versions: dict[int, int] = {}
+        self._loaded_at: Optional[float] = None
+        self.refreshes = 0
+        self.rejected = 0
+
+    async def refresh(self, db: AsyncSession) -> None:
+        result = await db.execute(select(models.SystemUser.id, models.SystemUser.token_version))
+        self._versions = {user_id: version for user_id, version in result.all()}
+        self._loaded_at = time.monotonic()
+        self.refreshes += 1
+
+    def _needs_refresh(self, user_id: int) -> bool:
+        if self._loaded_at is None:
+            return True
+        age = time.monotonic() - self._loaded_at
+        return age >= self.ttl_seconds or (user_id not in self._versions and age >= MIN_REFRESH_SECONDS)
+
+    async def is_current(self, db: AsyncSession, user_id: int, version: int) -> bool:
+        """Действует ли токен версии version пользователя user_id."""
+        if self._needs_refresh(user_id):
+            await self.refresh(db)
+        if self._versions.get(user_id) != version:
+            self.rejected += 1
+            return False
+        return True
+
+    def set(self, user_id: int, version: int) -> None:
+        self._versions[user_id] = version
+
+    def discard(self, user_id: int) -> None:
+        self._versions.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._versions.clear()
+        self._loaded_at = None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._versions),
+            "refreshes": self.refreshes,
+            "rejected": self.rejected,
+        }
+
+
+token_versions = TokenVersionTable(
+    ttl_seconds=float(os.getenv("TOKEN_VERSIONS_TTL_SECONDS", "30")),
+)
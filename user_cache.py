@@ -0,0 +1,84 @@
+"""
+Кэш аутентифицированных пользователей для get_current_user.
+
+Хранится снимок колонок system_users по логину и версии токена; при попадании
+объект пользователя присоединяется к сессии запроса без SELECT. Изменение и
+удаление пользователя сбрасывают его запись; в других воркерах запись живёт
+не дольше TTL.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+import models
+
+_COLUMNS = [attr.key for attr in inspect(models.SystemUser).column_attrs]
+
+
+class UserCache:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # username -> (время записи, версия токена, снимок колонок)
+        self._entries: OrderedDict[str, tuple[float, Any, dict]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _lookup(self, username: str, token_version: Any) -> Optional[dict]:
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        stored_at, version, snapshot = entry
+        if version != token_version or time.monotonic() - stored_at >= self.ttl_seconds:
+            del self._entries[username]
+            return None
+        self._entries.move_to_end(username)
+        return snapshot
+
+    async def get(self, db: AsyncSession, username: str, token_version: Any = None) -> Optional[models.SystemUser]:
+        """Пользователь из кэша, присоединённый к сессии db (без запроса к БД), или None."""
+        snapshot = self._lookup(username, token_version)
+        if snapshot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        user = models.SystemUser(**snapshot)
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+
+    def put(self, user: models.SystemUser, token_version: Any = None) -> None:
+        snapshot = {key: getattr(user, key) for key in _COLUMNS}
+        self._entries.pop(user.username, None)
+        self._entries[user.username] = (time.monotonic(), token_version, snapshot)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        """Сбрасывает запись пользователя (или весь кэш, если username не задан)."""
+        if username is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(username, None)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+        }
+
+
+user_cache = UserCache(
+    max_entries=int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60")),
+)